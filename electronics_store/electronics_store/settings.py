@@ -23,12 +23,17 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Снаружи сессий, аутентификации и сообщений: их запросы к БД (в том числе
+    # UPDATE django_session после ответа) тоже попадают в метрики запроса
+    'main.middleware.QueryMetricsMiddleware',
+    'main.middleware.DatabaseRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.SessionActivityMiddleware',
 ]
 
 ROOT_URLCONF = 'electronics_store.urls'
@@ -51,15 +56,87 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'electronics_store.wsgi.application'
 
+# БД (main/sqlite_backend): OPTIONS['profile'] — 'default' (как у стандартного
+# бэкенда SQLite) или 'concurrent' (WAL, synchronous=normal, busy_timeout, кэш
+# страниц, транзакции BEGIN IMMEDIATE — для параллельных оформлений заказов).
+# 'concurrent' включается явно (DB_PROFILE=concurrent): режим WAL сохраняется
+# в файле БД, и любая команда manage.py переписала бы db.sqlite3 из репозитория.
+# CONN_MAX_AGE — секунд держать соединение между запросами
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'main.sqlite_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'profile': os.environ.get('DB_PROFILE', 'default')},
     }
 }
 
+# Реплика для чтения (main/db_router.py): путь к копии БД. Локально — второй
+# файл SQLite, который копирует команда sync_replica; без реплики всё читается
+# из default
+DB_REPLICA = os.environ.get('DB_REPLICA')
+if DB_REPLICA:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': DB_REPLICA,
+        # query_only — случайная запись в реплику завершится ошибкой
+        'OPTIONS': {**DATABASES['default']['OPTIONS'], 'pragmas': {'query_only': 'on'}},
+        # В тестах реплика — та же тестовая БД
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['main.db_router.ReplicaRouter']
+# STICKY_SECONDS — сколько секунд после записи пользователь читает только из
+# default (реплика могла ещё не получить его изменения); отметка хранится в
+# cookie COOKIE_NAME
+DATABASE_ROUTING = {
+    'STICKY_SECONDS': int(os.environ.get('DB_STICKY_SECONDS', 15)),
+    'COOKIE_NAME': 'db_primary_until',
+}
+
+# Кэш: Redis-совместимый сервер, если задан REDIS_URL (например,
+# redis://127.0.0.1:6379/1, нужен пакет redis), иначе память процесса —
+# для разработки и тестов
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'store',
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'store',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Время жизни товаров в кэше (main/product_cache.py), секунды
+PRODUCT_CACHE_TIMEOUT = 600
+
+# Хранилище корзины (main/cart.py): 'session', 'cookie' (подписанная cookie)
+# или 'db' (таблица CartItem)
+CART_STORAGE = os.environ.get('CART_STORAGE', 'session')
+
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
+# Сюда collectstatic (команда build_static) складывает файлы с хешем в имени,
+# минифицированные и сжатые (.gz, .br при установленном brotli) — main/staticfiles.py
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+# Отдавать собранную статику самим Django (без nginx перед ним): заранее
+# сжатые копии по Accept-Encoding и Cache-Control: immutable для имён с хешем
+STATIC_SERVE = os.environ.get('STATIC_SERVE') == '1'
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'main.staticfiles.CompressedManifestStaticFilesStorage'},
+}
 
 # Медиафайлы
 MEDIA_URL = '/media/'
@@ -69,4 +146,56 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Настройки для работы с изображениями
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
\ No newline at end of file
+DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
+
+# Каталог: размер страницы и время жизни кэша фрагментов (секунды)
+CATALOG_PAGE_SIZE = 24
+CATALOG_CACHE_TIMEOUT = 300
+
+# История заказов в профиле: заказов на странице
+PROFILE_ORDERS_PAGE_SIZE = 20
+
+# Поиск товаров (main/search.py): 'auto'/'fts5' — таблица SQLite FTS5, если
+# она есть в БД, 'python' — инвертированный индекс в памяти процесса
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+
+# Пул хеширования паролей (main/hashing.py): EXECUTOR — 'thread', 'process'
+# или 'inline' (в потоке запроса, без пула); WORKERS — None по числу ядер;
+# MAX_QUEUE — задач сверх WORKERS, после которых вход отвечает 503;
+# VERIFIED_CACHE_TIMEOUT — сколько секунд помнить успешную проверку пароля
+PASSWORD_HASHING = {
+    'EXECUTOR': os.environ.get('PASSWORD_HASHING_EXECUTOR', 'thread'),
+    'WORKERS': None,
+    'MAX_QUEUE': 64,
+    'VERIFIED_CACHE_TIMEOUT': 300,
+}
+
+# Уменьшенные копии фото товаров и аватаров (main/thumbnails.py): ширины по
+# полям, форматы и пул фоновой обработки. Копии лежат в <каталог>/thumbs/ с
+# хешем содержимого в имени — веб-сервер может отдавать их с
+# Cache-Control: public, max-age=31536000, immutable
+THUMBNAILS = {
+    'WIDTHS': {
+        'main.Product.image': (240, 480, 960),
+        'main.UserProfile.avatar': (64, 128, 256),
+    },
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    'BACKGROUND': True,
+}
+
+# Сессии пользователей (main/activity.py): буфер входов и активности пишется
+# раз в FLUSH_INTERVAL секунд или по набору FLUSH_SIZE сессий
+SESSION_ACTIVITY = {
+    'FLUSH_INTERVAL': 10,
+    'FLUSH_SIZE': 500,
+}
+
+# Метрики запросов (main.middleware.QueryMetricsMiddleware): пороги, после
+# которых запрос попадает в лог вместе с SQL
+REQUEST_METRICS = {
+    'SLOW_QUERY_COUNT': 30,
+    'SLOW_REQUEST_MS': 500,
+    'LOG_SQL_LIMIT': 10,
+}
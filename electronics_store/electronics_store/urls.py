@@ -16,10 +16,12 @@ Including another URLconf
 """
 # electronics_store/urls.py
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from main import staticfiles
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('main.urls')),  # Основные URL приложения
@@ -27,4 +29,10 @@ urlpatterns = [
 
 # Добавляем маршруты для медиафайлов в режиме отладки
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# Собранная статика без отдельного веб-сервера (STATIC_SERVE, см. main/staticfiles.py)
+if settings.STATIC_SERVE:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), staticfiles.serve),
+    ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'electronics_store.settings')
 
 application = get_wsgi_application()
+
+# Фоновая запись сессий пользователей — только в процессах, обслуживающих запросы
+from main.activity import recorder  # noqa: E402
+
+recorder.start()
@@ -0,0 +1,180 @@
+# main/activity.py
+"""Отложенная запись сессий пользователей (UserSession).
+
+Входы и активность копятся в памяти процесса и пишутся пачками: новые
+сессии — одним bulk_create (при совпадении user/session_key строка
+обновляется), активность уже записанных — bulk_update поля last_activity.
+Пачку пишет фоновый поток раз в FLUSH_INTERVAL секунд или раньше, когда в
+буфере набралось FLUSH_SIZE сессий. Сами обращения к recorder только
+меняют словари под блокировкой, поэтому их можно вызывать и из
+асинхронных представлений.
+
+Поток запускают electronics_store/wsgi.py и asgi.py, то есть только в
+процессах, которые обслуживают запросы; при завершении процесса буфер
+дописывается. В тестах и командах потока нет и буфер пишется явным
+flush(). При нескольких воркерах у каждого свой буфер; несброшенные
+события теряются только при аварийном завершении процесса.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import UserSession
+
+logger = logging.getLogger('main.activity')
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 10,
+    'FLUSH_SIZE': 500,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SESSION_ACTIVITY', {})}
+
+
+class SessionRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._logins = {}  # {(user_id, session_key): поля новой UserSession}
+        self._activity = {}  # {(user_id, session_key): время последнего запроса}
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._exit_hook = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._logins) + len(self._activity)
+
+    def record_login(self, user_id, session_key, ip_address, user_agent, at=None):
+        at = at or timezone.now()
+        with self._lock:
+            self._activity.pop((user_id, session_key), None)
+            self._logins[(user_id, session_key)] = {
+                'ip_address': ip_address, 'user_agent': user_agent,
+                'created_at': at, 'last_activity': at, 'is_active': True,
+            }
+        self._added()
+
+    def touch(self, user_id, session_key, at=None):
+        at = at or timezone.now()
+        key = (user_id, session_key)
+        with self._lock:
+            login = self._logins.get(key)
+            if login is not None:
+                login['last_activity'] = at
+            else:
+                self._activity[key] = at
+        self._added()
+
+    def end(self, user_id, session_key):
+        """Выход: ещё не записанный вход сохраняется сразу неактивным"""
+        with self._lock:
+            self._activity.pop((user_id, session_key), None)
+            login = self._logins.get((user_id, session_key))
+            if login is not None:
+                login['is_active'] = False
+
+    def _added(self):
+        if self._thread is not None and len(self) >= get_config()['FLUSH_SIZE']:
+            self._wake.set()
+
+    def start(self):
+        """Запустить фоновую запись (однократно; FLUSH_INTERVAL = None — не запускать)"""
+        with self._lock:
+            if self._thread is not None or get_config()['FLUSH_INTERVAL'] is None:
+                return
+            self._stopping = False
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._run, name='session-activity', daemon=True)
+            self._thread.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def stop(self):
+        """Остановить фоновый поток и дописать буфер"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is not None:
+            self._wake.set()
+            thread.join()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Не удалось записать активность сессий')
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(get_config()['FLUSH_INTERVAL'])
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Не удалось записать активность сессий')
+            finally:
+                close_old_connections()
+
+    def _take(self):
+        with self._lock:
+            logins, self._logins = self._logins, {}
+            activity, self._activity = self._activity, {}
+        return logins, activity
+
+    def _restore(self, logins, activity):
+        # Несохранённое возвращается в буфер, более свежие события не затираются
+        with self._lock:
+            for key, fields in logins.items():
+                self._logins.setdefault(key, fields)
+            for key, at in activity.items():
+                if key not in self._logins:
+                    self._activity.setdefault(key, at)
+
+    def flush(self):
+        """Записать буфер в БД; возвращает (новых сессий, обновлений активности)"""
+        logins, activity = self._take()
+        if not logins and not activity:
+            return 0, 0
+        batch_size = get_config()['FLUSH_SIZE']
+        try:
+            with transaction.atomic():
+                if logins:
+                    UserSession.objects.bulk_create(
+                        [UserSession(user_id=user_id, session_key=session_key, **fields)
+                         for (user_id, session_key), fields in logins.items()],
+                        batch_size=batch_size,
+                        update_conflicts=True,
+                        unique_fields=['user', 'session_key'],
+                        update_fields=['ip_address', 'user_agent', 'last_activity', 'is_active'],
+                    )
+                updated = self._flush_activity(activity, batch_size) if activity else 0
+        except Exception:
+            self._restore(logins, activity)
+            raise
+        return len(logins), updated
+
+    def _flush_activity(self, activity, batch_size):
+        keys = list(activity)
+        sessions = []
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            rows = UserSession.objects.filter(
+                session_key__in={session_key for _, session_key in chunk}
+            ).values_list('id', 'user_id', 'session_key', 'last_activity')
+            for pk, user_id, session_key, last_activity in rows:
+                at = activity.get((user_id, session_key))
+                if at is not None and at > last_activity:
+                    sessions.append(UserSession(id=pk, last_activity=at))
+        UserSession.objects.bulk_update(sessions, ['last_activity'], batch_size=batch_size)
+        return len(sessions)
+
+
+recorder = SessionRecorder()
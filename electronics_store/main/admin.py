@@ -1,11 +1,39 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import UserProfile, UserSession, Category, Product, Order, OrderItem
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from datetime import timedelta
+from .models import UserProfile, UserSession, Category, Product, Order, OrderItem, StockMovement, DailySales
+from . import export, rollups, search, stock
+from .checkout import cancel_orders
+
+def _export_response(request, queryset, fmt):
+    # Выгрузка отдаётся по мере чтения пачек из БД (main/export.py); под
+    # ASGI — асинхронным итератором, чтобы Django не собрал её в памяти
+    chunks = export.stream(queryset, fmt, bom=fmt == 'csv')
+    if isinstance(request, ASGIRequest):
+        chunks = export.aiterate(chunks)
+    response = StreamingHttpResponse(chunks, content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(queryset, fmt)}"'
+    return response
+
+def export_csv(modeladmin, request, queryset):
+    """Действие: выгрузить выбранное в CSV"""
+    return _export_response(request, queryset, 'csv')
+export_csv.short_description = 'Выгрузить выбранное в CSV'
+
+def export_json(modeladmin, request, queryset):
+    """Действие: выгрузить выбранное в JSON"""
+    return _export_response(request, queryset, 'json')
+export_json.short_description = 'Выгрузить выбранное в JSON'
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -47,12 +75,31 @@ class CategoryAdmin(admin.ModelAdmin):
         return obj.products.count()
     products_count.short_description = 'Товаров'
 
+class ProductAdminForm(forms.ModelForm):
+    def stock_delta(self):
+        """Разница между введённым остатком и показанным при открытии формы"""
+        shown = self.data.get(self.add_initial_prefix('stock'), self.initial['stock'])
+        return self.cleaned_data['stock'] - self.fields['stock'].to_python(shown)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.instance.pk and 'stock' in self.changed_data and 'stock' in cleaned_data:
+            # Проверка по текущему остатку в БД: пока форма была открыта,
+            # товар могли раскупить, и списать разницу уже нельзя
+            delta = self.stock_delta()
+            current = Product.objects.filter(pk=self.instance.pk).values_list('stock', flat=True).first()
+            if current is not None and current + delta < 0:
+                self.add_error('stock', f'Остаток изменился: на складе {current} шт., списать {-delta} шт. нельзя')
+        return cleaned_data
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
+    form = ProductAdminForm
     list_display = ('name', 'category', 'price', 'year', 'stock', 'in_stock', 'created_at')
     list_filter = ('category', 'in_stock', 'year', 'country')
     search_fields = ('name', 'model')
     prepopulated_fields = {'slug': ('name',)}
+    actions = [export_csv, export_json]
     fieldsets = (
         ('Основная информация', {
             'fields': ('category', 'name', 'slug', 'price', 'image')
@@ -65,6 +112,36 @@ class ProductAdmin(admin.ModelAdmin):
         }),
     )
 
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        field = super().formfield_for_dbfield(db_field, request, **kwargs)
+        if db_field.name == 'stock':
+            # Форма помнит показанный остаток, чтобы сохранить разницу с ним
+            field.show_hidden_initial = True
+        return field
+
+    def save_model(self, request, obj, form, change):
+        """Остаток меняется на разницу с показанным в форме, а не
+        перезаписывается: продажи, прошедшие пока форма была открыта, не теряются.
+
+        Нехватку остатка отсекает ProductAdminForm.clean; StockConflict здесь
+        (товар раскупили между проверкой и сохранением) не глушится — иначе
+        откат остальных полей сопровождался бы сообщением об успехе.
+        """
+        if not change or 'stock' not in form.changed_data:
+            return super().save_model(request, obj, form, change)
+        fields = [name for name in form.changed_data if name != 'stock']
+        with transaction.atomic():
+            if fields:
+                obj.save(update_fields=fields)
+            stock.adjust(obj, form.stock_delta())
+        obj.refresh_from_db()
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск через полнотекстовый индекс вместо LIKE '%...%' по search_fields"""
+        if not search_term.strip():
+            return queryset, False
+        return search.filter_products(queryset, search_term), False
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
@@ -77,14 +154,24 @@ class OrderItemInline(admin.TabularInline):
         return "-"
     line_total_display.short_description = 'Сумма'
 
+class OrderAdminForm(forms.ModelForm):
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        # cancel_orders пропускает доставленные заказы: такая отмена сохранила
+        # бы статус, не вернув товары на склад
+        if status == 'cancelled' and self.initial.get('status') == 'delivered':
+            raise forms.ValidationError('Доставленный заказ нельзя отменить')
+        return status
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     list_display = ('id', 'created_at_display', 'customer_full_name', 'items_count_display', 'status_display', 'total_price_display', 'cancellation_reason_display')
     list_filter = ('status', 'created_at')
     date_hierarchy = 'created_at'
     inlines = [OrderItemInline]
     readonly_fields = ('created_at', 'total_price', 'customer_full_name_display', 'items_count_display')
-    actions = ['confirm_orders', 'cancel_orders']
+    actions = ['confirm_orders', 'cancel_orders', export_csv, export_json]
     
     fieldsets = (
         ('Информация о заказе', {
@@ -117,6 +204,7 @@ class OrderAdmin(admin.ModelAdmin):
         """Количество товаров в заказе"""
         return obj.items_count
     items_count_display.short_description = 'Кол-во товаров'
+    items_count_display.admin_order_field = 'items_count'
     
     def status_display(self, obj):
         """Цветное отображение статуса"""
@@ -155,52 +243,103 @@ class OrderAdmin(admin.ModelAdmin):
     cancellation_reason_display.short_description = 'Причина отказа'
     
     def confirm_orders(self, request, queryset):
-        """Действие: подтвердить выбранные заказы"""
-        count = 0
-        for order in queryset:
-            if order.status == 'new':
-                order.status = 'confirmed'
-                order.save()
-                count += 1
-        self.message_user(request, f'Подтверждено заказов: {count}')
+        """Действие: подтвердить выбранные заказы одним UPDATE"""
+        ids = list(queryset.values_list('pk', flat=True))
+        count = Order.objects.filter(pk__in=ids, status='new').update(status='confirmed')
+        self.message_user(request, f'Подтверждено заказов: {count}. Пропущено (не в статусе «Новый»): {len(ids) - count}')
     confirm_orders.short_description = 'Подтвердить выбранные заказы'
     
     def cancel_orders(self, request, queryset):
         """Действие: отменить выбранные заказы (требует причину)"""
         # Это действие будет обрабатываться через кастомную форму
         # Для простоты используем стандартный механизм Django
-        count = 0
         reason = request.POST.get('cancellation_reason', 'Отменено администратором')
-        for order in queryset:
-            if order.status not in ('cancelled', 'delivered'):
-                with transaction.atomic():
-                    # Возвращаем товары на склад
-                    for item in order.items.all():
-                        product = item.product
-                        product.stock += item.quantity
-                        product.in_stock = True
-                        product.save()
-                    
-                    order.status = 'cancelled'
-                    order.cancellation_reason = reason
-                    order.save()
-                    count += 1
-        self.message_user(request, f'Отменено заказов: {count}')
+        ids = list(queryset.values_list('pk', flat=True))
+        # Товары возвращаются на склад с записью в журнал (main/checkout.py, main/stock.py)
+        cancel_ids = cancel_orders(ids, reason)
+        self.message_user(
+            request,
+            f'Отменено заказов: {len(cancel_ids)}. Пропущено (уже отменены или доставлены): {len(ids) - len(cancel_ids)}',
+        )
     cancel_orders.short_description = 'Отменить выбранные заказы'
     
     def get_queryset(self, request):
-        """Оптимизация запросов"""
-        qs = super().get_queryset(request)
-        return qs.select_related('user').prefetch_related('items', 'items__product')
+        """Оптимизация запросов: профиль заказчика через JOIN; количество
+        товаров хранится в самом заказе"""
+        return super().get_queryset(request).select_related('user__userprofile')
     
     def save_model(self, request, obj, form, change):
         """Сохранение модели с обработкой отмены заказа"""
-        if change and 'cancellation_reason' in form.changed_data and obj.status == 'cancelled':
-            # Если заказ отменяется, возвращаем товары на склад
-            with transaction.atomic():
-                for item in obj.items.all():
-                    product = item.product
-                    product.stock += item.quantity
-                    product.in_stock = True
-                    product.save()
-        super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            if change and obj.status == 'cancelled' and form.initial.get('status') != 'cancelled':
+                # Заказ отменяется — вернуть товары на склад; повторное сохранение
+                # уже отменённого заказа остатки не трогает
+                cancel_orders([obj.pk], obj.cancellation_reason or 'Отменено администратором')
+            elif change and form.initial.get('status') == 'cancelled' and obj.status != 'cancelled':
+                # Отмена снята — заказ снова учитывается в продажах (остатки не меняются)
+                rollups.orders_cancelled([obj.pk], sign=-1)
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            rollups.orders_removed([obj.pk])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            rollups.orders_removed(list(queryset.values_list('pk', flat=True)))
+            super().delete_queryset(request, queryset)
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """Журнал склада только для просмотра: строки пишет main/stock.py"""
+    list_display = ('created_at', 'product', 'delta', 'reason', 'order_number')
+    list_filter = ('reason', 'created_at')
+    list_select_related = ('product',)
+    search_fields = ('product__name', 'order_number')
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    """Панель продаж вместо списка: читает только дневные итоги (main/rollups.py)"""
+    PERIODS = (7, 30, 90, 365)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        if days not in self.PERIODS:
+            days = 30
+        date_to = timezone.localdate()
+        date_from = date_to - timedelta(days=days - 1)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Продажи',
+            'periods': self.PERIODS,
+            'period': days,
+            'date_from': date_from,
+            'date_to': date_to,
+            **rollups.dashboard(date_from, date_to),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/main/dailysales/dashboard.html', context)
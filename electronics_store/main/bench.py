@@ -0,0 +1,85 @@
+# main/bench.py
+"""Общие помощники для команд замеров производительности"""
+import math
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from .activity import recorder
+
+
+@contextmanager
+def test_database(verbosity=0, name=None):
+    """Временная тестовая БД, чтобы замеры не портили рабочие данные.
+
+    name — файл тестовой БД; нужен, когда к ней обращаются из нескольких
+    потоков одновременно (SQLite в памяти не ждёт снятия блокировок).
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if name:
+        test_settings['NAME'] = name
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        # Буфер сессий дописывается во временную БД, а не в рабочую после неё
+        recorder.stop()
+        connection.creation.destroy_test_db(old_name, verbosity)
+        teardown_test_environment()
+        test_settings['NAME'] = old_test_name
+
+
+def percentile(values, p):
+    """Перцентиль методом ближайшего ранга (p от 0 до 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def peak_memory(func):
+    """Пиковый объём памяти (байт), выделенной при вызове func.
+
+    tracemalloc сильно замедляет код, поэтому память меряется отдельным
+    прогоном, а не вместе со временем.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+class Sample:
+    """Результаты повторных вызовов: время (мс) и число SQL-запросов"""
+
+    def __init__(self):
+        self.timings = []
+        self.queries = []
+
+    @contextmanager
+    def measure(self):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - start
+        self.timings.append(elapsed * 1000)
+        self.queries.append(len(ctx.captured_queries))
+
+    def summary(self):
+        return {
+            'runs': len(self.timings),
+            'queries': max(self.queries) if self.queries else 0,
+            'p50_ms': round(percentile(self.timings, 50), 3),
+            'p95_ms': round(percentile(self.timings, 95), 3),
+            'p99_ms': round(percentile(self.timings, 99), 3),
+        }
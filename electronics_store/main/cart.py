@@ -0,0 +1,189 @@
+# main/cart.py
+"""Корзина покупателя с выбираемым способом хранения (CART_STORAGE).
+
+- 'session' — словарь в сессии; каждое изменение перезаписывает строку
+  django_session целиком;
+- 'cookie'  — компактная подписанная cookie «id:qty,id:qty», в БД не
+  пишется ничего;
+- 'db'      — таблица CartItem, ключ корзины хранится в подписанной cookie;
+  изменение одной позиции — одна строка INSERT/UPDATE/DELETE; строки
+  брошенных корзин удаляет команда purge_carts.
+
+Представления работают только с Cart: get_cart(request) → изменения →
+cart.save(response); в асинхронных — aget_cart(request) и cart.asave(response).
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import CartItem
+
+COOKIE_SALT = 'main.cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+
+class SessionCartStorage:
+    def __init__(self, request):
+        self.request = request
+
+    def load(self):
+        return dict(self.request.session.get('cart', {}))
+
+    def save(self, original, items, response):
+        self.request.session['cart'] = items
+
+    # В Django 5.0 у сессий нет асинхронного API: загрузка идёт через sync_to_async
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, original, items, response):
+        self.save(original, items, response)
+
+
+class CookieCartStorage:
+    cookie_name = 'cart'
+
+    def __init__(self, request):
+        self.request = request
+
+    def load(self):
+        value = self.request.get_signed_cookie(self.cookie_name, default='', salt=COOKIE_SALT)
+        items = {}
+        for part in value.split(','):
+            pid, _, qty = part.partition(':')
+            if pid.isdigit() and qty.isdigit() and int(qty) > 0:
+                items[pid] = int(qty)
+        return items
+
+    def save(self, original, items, response):
+        if not items:
+            response.delete_cookie(self.cookie_name)
+            return
+        value = ','.join(f'{pid}:{qty}' for pid, qty in items.items())
+        response.set_signed_cookie(self.cookie_name, value, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE,
+                                   httponly=True, samesite='Lax')
+
+    async def aload(self):
+        return self.load()
+
+    async def asave(self, original, items, response):
+        self.save(original, items, response)
+
+
+class DatabaseCartStorage:
+    cookie_name = 'cart_id'
+
+    # Новые и изменённые позиции пишутся одним INSERT ... ON CONFLICT DO UPDATE:
+    # два параллельных добавления одного товара (двойной клик, две вкладки)
+    # оба считают его новым, и обычный INSERT нарушил бы unique_together
+    UPSERT = {'update_conflicts': True, 'unique_fields': ['cart_key', 'product'],
+              'update_fields': ['quantity', 'updated_at']}
+
+    def __init__(self, request):
+        self.request = request
+        self.cart_key = request.get_signed_cookie(self.cookie_name, default=None, salt=COOKIE_SALT)
+
+    def load(self):
+        if not self.cart_key:
+            return {}
+        rows = CartItem.objects.filter(cart_key=self.cart_key).values_list('product_id', 'quantity')
+        return {str(pid): qty for pid, qty in rows}
+
+    async def aload(self):
+        if not self.cart_key:
+            return {}
+        rows = CartItem.objects.filter(cart_key=self.cart_key).values_list('product_id', 'quantity')
+        return {str(pid): qty async for pid, qty in rows}
+
+    def _ensure_key(self, response):
+        if not self.cart_key:
+            self.cart_key = uuid.uuid4().hex
+        # Cookie продлевается при каждом изменении: корзина живёт COOKIE_MAX_AGE
+        # с последнего изменения, столько же её строки хранит purge_carts
+        response.set_signed_cookie(self.cookie_name, self.cart_key, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE,
+                                   httponly=True, samesite='Lax')
+
+    def _diff(self, original, items):
+        """(удалённые product_id, строки для upsert новых и изменённых позиций)"""
+        removed = [pid for pid in original if pid not in items]
+        changed = [
+            CartItem(cart_key=self.cart_key, product_id=pid, quantity=qty)
+            for pid, qty in items.items() if original.get(pid) != qty
+        ]
+        return removed, changed
+
+    def save(self, original, items, response):
+        self._ensure_key(response)
+        # Пишем только изменившиеся позиции
+        removed, changed = self._diff(original, items)
+        if removed:
+            CartItem.objects.filter(cart_key=self.cart_key, product_id__in=removed).delete()
+        if changed:
+            CartItem.objects.bulk_create(changed, **self.UPSERT)
+
+    async def asave(self, original, items, response):
+        self._ensure_key(response)
+        removed, changed = self._diff(original, items)
+        if removed:
+            await CartItem.objects.filter(cart_key=self.cart_key, product_id__in=removed).adelete()
+        if changed:
+            await CartItem.objects.abulk_create(changed, **self.UPSERT)
+
+
+STORAGES = {
+    'session': SessionCartStorage,
+    'cookie': CookieCartStorage,
+    'db': DatabaseCartStorage,
+}
+
+
+class Cart:
+    """Содержимое корзины {str(product_id): qty}"""
+
+    def __init__(self, storage, items=None):
+        self.storage = storage
+        self.items = storage.load() if items is None else items
+        self._original = dict(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def get(self, product_id):
+        return int(self.items.get(str(product_id), 0))
+
+    def set(self, product_id, qty):
+        if qty > 0:
+            self.items[str(product_id)] = qty
+        else:
+            self.items.pop(str(product_id), None)
+
+    def clear(self):
+        self.items = {}
+
+    @property
+    def changed(self):
+        return self.items != self._original
+
+    def save(self, response):
+        """Сохранить изменения; без изменений хранилище не трогается"""
+        if self.changed:
+            self.storage.save(self._original, self.items, response)
+            self._original = dict(self.items)
+
+    async def asave(self, response):
+        """Асинхронный вариант save()"""
+        if self.changed:
+            await self.storage.asave(self._original, self.items, response)
+            self._original = dict(self.items)
+
+
+def get_cart(request):
+    storage = STORAGES[getattr(settings, 'CART_STORAGE', 'session')]
+    return Cart(storage(request))
+
+
+async def aget_cart(request):
+    """Асинхронный вариант get_cart()"""
+    storage = STORAGES[getattr(settings, 'CART_STORAGE', 'session')](request)
+    return Cart(storage, await storage.aload())
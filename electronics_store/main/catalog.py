@@ -0,0 +1,193 @@
+# main/catalog.py
+"""Кэширование страниц каталога.
+
+Список категорий и отрендеренные фрагменты со списком товаров хранятся в
+кэше под ключами с номером версии области (все товары / категория).
+При сохранении или удалении товара или категории версия области
+увеличивается, и старые фрагменты просто перестают читаться.
+
+Вместе с версией bump() запоминает время изменения области; версии и время
+вместе (get_state) служат валидаторами условных GET — main/conditional.py.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .db_router import primary_reads
+from .models import Category
+from .pagination import apaginate, paginate
+
+# Поддерживаемые сортировки; id в конце — для стабильного порядка при равных значениях
+SORTS = {
+    'new': ('-created_at', '-id'),
+    'year': ('year', 'id'),
+    'name': ('name', 'id'),
+    'price': ('price', 'id'),
+}
+
+CATEGORIES_SCOPE = 'categories'
+ALL_SCOPE = 'all'
+
+
+def _version_key(scope):
+    return f'catalog:v:{scope}'
+
+
+def category_scope(category_id):
+    return f'cat{category_id}'
+
+
+def get_version(scope):
+    """Текущая версия области; при пустом кэше начинается с метки времени"""
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_version(scope):
+    """Асинхронный вариант get_version()"""
+    key = _version_key(scope)
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def _modified_key(scope):
+    return f'catalog:modified:{scope}'
+
+
+def bump(*scopes):
+    """Сделать устаревшими все фрагменты перечисленных областей"""
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+    cache.set_many({_modified_key(scope): time.time() for scope in scopes}, None)
+
+
+def _state_keys(scopes):
+    return [_version_key(scope) for scope in scopes] + [_modified_key(scope) for scope in scopes]
+
+
+def _state(scopes, values):
+    versions = tuple(values[_version_key(scope)] for scope in scopes)
+    return versions, max(values[_modified_key(scope)] for scope in scopes)
+
+
+def get_state(scopes):
+    """(версии областей, время последнего изменения любой из них) одним чтением кэша.
+
+    При пустом кэше время изменения начинается с текущего: раньше оно
+    быть не может, а точное время изменений до очистки кэша неизвестно.
+    """
+    keys = _state_keys(scopes)
+    values = cache.get_many(keys)
+    if len(values) < len(keys):
+        for scope in scopes:
+            get_version(scope)
+            cache.add(_modified_key(scope), time.time(), None)
+        values = cache.get_many(keys)
+    return _state(scopes, values)
+
+
+async def aget_state(scopes):
+    """Асинхронный вариант get_state()"""
+    keys = _state_keys(scopes)
+    values = await cache.aget_many(keys)
+    if len(values) < len(keys):
+        for scope in scopes:
+            await aget_version(scope)
+            await cache.aadd(_modified_key(scope), time.time(), None)
+        values = await cache.aget_many(keys)
+    return _state(scopes, values)
+
+
+def invalidate_categories(category_ids):
+    """Сбросить кэш «всех товаров» и страниц перечисленных категорий"""
+    bump(ALL_SCOPE, *(category_scope(cid) for cid in set(category_ids) if cid))
+
+
+def get_categories():
+    """Список категорий для боковой панели (из кэша)"""
+    key = f'catalog:categories:{get_version(CATEGORIES_SCOPE)}'
+    categories = cache.get(key)
+    if categories is None:
+        with primary_reads():
+            categories = list(Category.objects.all())
+        cache.set(key, categories, _timeout())
+    return categories
+
+
+async def aget_categories():
+    """Асинхронный вариант get_categories()"""
+    key = f'catalog:categories:{await aget_version(CATEGORIES_SCOPE)}'
+    categories = await cache.aget(key)
+    if categories is None:
+        with primary_reads():
+            categories = [c async for c in Category.objects.all()]
+        await cache.aset(key, categories, _timeout())
+    return categories
+
+
+def _fragment_scope(filters):
+    return category_scope(filters.category.id) if filters.category else ALL_SCOPE
+
+
+def _fragment_key(filters, sort, cursor, version):
+    scope = _fragment_scope(filters)
+    params_hash = hashlib.md5(f'{cursor or ""}\n{filters.cache_key()}'.encode()).hexdigest()
+    return f'catalog:products:{scope}:{version}:{sort}:{params_hash}'
+
+
+def get_products_fragment(qs, filters, sort, cursor):
+    """Вернуть (HTML сетки товаров, курсор следующей страницы).
+
+    qs — уже отфильтрованные товары, filters — main.facets.Filters, по
+    которым они отобраны (часть ключа кэша). Запрос к товарам выполняется
+    только при промахе кэша.
+    """
+    key = _fragment_key(filters, sort, cursor, get_version(_fragment_scope(filters)))
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    with primary_reads():
+        products, next_cursor = paginate(qs, SORTS[sort], cursor, _page_size())
+    html = render_to_string('catalog_products.html', {'products': products})
+    cache.set(key, (html, next_cursor), _timeout())
+    return html, next_cursor
+
+
+async def aget_products_fragment(qs, filters, sort, cursor):
+    """Асинхронный вариант get_products_fragment()"""
+    key = _fragment_key(filters, sort, cursor, await aget_version(_fragment_scope(filters)))
+    cached = await cache.aget(key)
+    if cached is not None:
+        return cached
+
+    with primary_reads():
+        products, next_cursor = await apaginate(qs, SORTS[sort], cursor, _page_size())
+    # Шаблон сетки не обращается к запросу и БД — рендерится прямо в цикле событий
+    html = render_to_string('catalog_products.html', {'products': products})
+    await cache.aset(key, (html, next_cursor), _timeout())
+    return html, next_cursor
+
+
+def _page_size():
+    return getattr(settings, 'CATALOG_PAGE_SIZE', 24)
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
@@ -0,0 +1,131 @@
+# main/checkout.py
+"""Оформление, отмена и удаление заказов вместе с остатками на складе.
+
+Число запросов не зависит от количества строк в корзине: одно чтение
+товаров, условное списание остатков, вставка заказа и одна bulk_create
+для всех позиций. Остатки меняются только через main/stock.py, дневные
+итоги продаж — через main/rollups.py в той же транзакции.
+"""
+from django.db import transaction
+
+from . import rollups, stock
+from .catalog import invalidate_categories
+from .models import Product, Order, OrderItem, StockMovement
+
+# Сколько раз повторять транзакцию, если остаток изменился параллельно
+CHECKOUT_RETRIES = 3
+
+
+class CheckoutError(Exception):
+    """Заказ не может быть оформлен"""
+
+    def __init__(self, message, status=400, shortfalls=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.shortfalls = shortfalls or []
+
+
+def normalize_cart(cart):
+    """Привести корзину из сессии {'id': qty} к {int id: int qty > 0}"""
+    lines = {}
+    for pid, qty in cart.items():
+        try:
+            pid, qty = int(pid), int(qty)
+        except (TypeError, ValueError):
+            continue
+        if qty > 0:
+            lines[pid] = qty
+    return lines
+
+
+def place_order(user, cart):
+    """Оформить заказ по корзине.
+
+    Возвращает (order, shortfalls), где shortfalls — список строк, которые
+    удалось зарезервировать не полностью:
+    [{'product_id': 1, 'requested': 3, 'reserved': 1}, ...]
+    """
+    lines = normalize_cart(cart)
+    if not lines:
+        raise CheckoutError('Корзина пуста')
+
+    for _ in range(CHECKOUT_RETRIES):
+        try:
+            with transaction.atomic():
+                return _place_order(user, lines)
+        except stock.StockConflict:
+            continue
+    raise CheckoutError('Не удалось оформить заказ', status=409)
+
+
+def _place_order(user, lines):
+    # Блокировка берётся внутри транзакции и держится до её конца
+    products = {
+        p.id: p for p in Product.objects.select_for_update()
+        .filter(id__in=lines.keys(), in_stock=True)
+        .only('id', 'price', 'stock', 'category_id')
+        .order_by('id')
+    }
+
+    reserved = {}
+    shortfalls = []
+    for pid, qty in lines.items():
+        product = products.get(pid)
+        available = product.stock if product else 0
+        take = min(qty, available)
+        if take < qty:
+            shortfalls.append({'product_id': pid, 'requested': qty, 'reserved': take})
+        if take:
+            reserved[pid] = take
+
+    if not reserved:
+        raise CheckoutError('Товары недоступны', shortfalls=shortfalls)
+
+    # bulk_create позиций не отправляет сигналы — итоги заказа задаются сразу
+    total = sum(products[pid].price * qty for pid, qty in reserved.items())
+    order = Order.objects.create(user=user, total_price=total, items_count=sum(reserved.values()))
+    stock.reserve(reserved, order_number=order.id)
+    # Остатки на витрине изменились — сбросить кэш каталога после коммита
+    category_ids = [products[pid].category_id for pid in reserved]
+    transaction.on_commit(lambda: invalidate_categories(category_ids))
+
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=pid, quantity=qty, price=products[pid].price)
+        for pid, qty in reserved.items()
+    ])
+    rollups.order_placed(order, [
+        (pid, products[pid].category_id, qty, products[pid].price) for pid, qty in reserved.items()
+    ])
+    return order, shortfalls
+
+
+def cancel_orders(order_ids, reason):
+    """Отменить заказы и вернуть их товары на склад; возвращает id отменённых.
+
+    Уже отменённые и доставленные заказы пропускаются: они блокируются и
+    отбираются в той же транзакции, поэтому товар не возвращается дважды.
+    """
+    with transaction.atomic():
+        cancel_ids = list(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids)
+            .exclude(status__in=('cancelled', 'delivered'))
+            .values_list('pk', flat=True)
+        )
+        stock.restock_orders(cancel_ids, StockMovement.CANCEL)
+        rollups.orders_cancelled(cancel_ids)
+        Order.objects.filter(pk__in=cancel_ids).update(status='cancelled', cancellation_reason=reason)
+    return cancel_ids
+
+
+def delete_order(order_id):
+    """Удалить новый заказ, вернув товары на склад; False — заказ уже не новый"""
+    with transaction.atomic():
+        locked = list(Order.objects.select_for_update().filter(pk=order_id, status='new').values_list('pk', flat=True))
+        if not locked:
+            return False
+        stock.restock_orders(locked, StockMovement.ORDER_DELETE)
+        rollups.orders_removed(locked)
+        Order.objects.filter(pk__in=locked).delete()
+    return True
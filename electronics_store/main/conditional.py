@@ -0,0 +1,100 @@
+# main/conditional.py
+"""Условные GET (ETag / Last-Modified) для каталога и карточек товаров.
+
+Содержимое этих страниц меняется только вместе с версиями областей кэша
+каталога (main/catalog.py): их увеличивают сигналы товаров и категорий и
+изменения остатков в main/stock.py и main/checkout.py. Поэтому валидаторы
+строятся без БД:
+  * ETag (слабый) — хеш версий областей, адреса страницы с параметрами,
+    cookie сессии и CSRF (от них зависят шапка и токен на странице) и
+    отметки выкладки (шаблоны, манифест статики);
+  * Last-Modified — время последнего bump() этих областей.
+Версии и время читаются из кэша одним get_many; на совпадение
+If-None-Match / If-Modified-Since ответ 304 отдаётся до представления —
+без сессии, запроса товаров и рендеринга шаблонов.
+"""
+import functools
+import hashlib
+import os
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template.utils import get_app_template_dirs
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import catalog, metrics
+
+
+@functools.cache
+def _release():
+    """Отметка выкладки: меняется вместе с шаблонами и собранной статикой"""
+    dirs = [d for config in settings.TEMPLATES for d in config.get('DIRS', ())]
+    dirs += get_app_template_dirs('templates')
+    latest = max(
+        (os.stat(os.path.join(root, name)).st_mtime_ns
+         for directory in dirs for root, _, files in os.walk(directory) for name in files),
+        default=0,
+    )
+    return f'{latest}:{getattr(staticfiles_storage, "manifest_hash", "")}'
+
+
+def _validators(request, state):
+    versions, modified = state
+    parts = [
+        _release(),
+        ':'.join(map(str, versions)),
+        request.get_full_path(),
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]
+    etag = 'W/"%s"' % hashlib.md5('\n'.join(parts).encode()).hexdigest()
+    return etag, int(modified)
+
+
+def _respond(request, etag, last_modified):
+    """304/412 по заголовкам запроса или None — тогда нужно выполнить представление"""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        metrics.inc('conditional_not_modified')
+    return response
+
+
+def _finish(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+        # Браузер хранит страницу, но каждый раз сверяет её с сервером
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def conditional_page(*scopes):
+    """Декоратор представления, чья страница зависит только от областей scopes"""
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def inner(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                etag, last_modified = _validators(request, await catalog.aget_state(scopes))
+                response = _respond(request, etag, last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(response, etag, last_modified)
+        else:
+            @functools.wraps(view)
+            def inner(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(request, *args, **kwargs)
+                etag, last_modified = _validators(request, catalog.get_state(scopes))
+                response = _respond(request, etag, last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _finish(response, etag, last_modified)
+        return inner
+
+    return decorator
@@ -0,0 +1,135 @@
+# main/db_router.py
+"""Чтение с реплики, запись — в основную БД.
+
+Реплика — БД с псевдонимом REPLICA в settings.DATABASES (локально — второй
+файл SQLite, который копирует команда sync_replica). Без неё, а также если
+она указывает на тот же файл, что и default (тестовое зеркало),
+маршрутизатор всё отправляет в default.
+
+Куда идёт чтение, решает состояние текущего запроса (RequestState),
+которое ставит DatabaseRoutingMiddleware:
+  * GET/HEAD/OPTIONS читают с реплики: каталог, карточки, профиль,
+    списки в админке;
+  * POST и другие изменяющие запросы (оформление заказа, корзина,
+    действия админки) и всё, что выполняется после первой записи в
+    запросе, читают из default;
+  * после записи пользователь STICKY_SECONDS секунд читает только из
+    default (cookie COOKIE_NAME): реплика могла ещё не получить его
+    изменения — так он видит свой заказ в профиле сразу после оформления.
+Чтение внутри transaction.atomic() и сессии (PRIMARY_APPS) всегда идут в
+default, как и заполнение общих кэшей при промахе (primary_reads). Вне
+запросов (команды, фоновые потоки) чтение тоже идёт в default, если код
+не попросил реплику явно: use_replica() или read_only(queryset).
+
+Состояние хранится в contextvars: оно видно и в потоках sync_to_async,
+через которые асинхронные представления обращаются к ORM.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+# Приложения, которые всегда читаются из основной БД и запись в которые не
+# закрепляет пользователя за ней (сессия пишется почти каждым запросом)
+PRIMARY_APPS = ('sessions',)
+
+DEFAULTS = {
+    'STICKY_SECONDS': 15,
+    'COOKIE_NAME': 'db_primary_until',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_ROUTING', {})}
+
+
+class RequestState:
+    """Маршрутизация одного запроса; общий объект для всех его потоков"""
+
+    def __init__(self, replica=False):
+        self.replica = replica  # можно читать с реплики
+        self.wrote = False  # была запись — закрепить пользователя за default
+
+    def pin(self):
+        self.replica = False
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+@contextmanager
+def activate(state):
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def current():
+    return _state.get()
+
+
+def replica_available():
+    if REPLICA not in connections.settings:
+        return False
+    # Тестовое зеркало получает настройки default, включая имя файла
+    return connections[REPLICA].settings_dict['NAME'] != connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+
+
+def read_alias():
+    """Псевдоним для чтения без учёта запроса: реплика, если она есть"""
+    return REPLICA if replica_available() else DEFAULT_DB_ALIAS
+
+
+def read_only(queryset):
+    """queryset, который можно выполнить на реплике (выгрузки, отчёты)"""
+    return queryset.using(read_alias())
+
+
+@contextmanager
+def use_replica():
+    """Чтение внутри блока — с реплики (если она настроена)"""
+    with activate(RequestState(replica=True)):
+        yield
+
+
+@contextmanager
+def primary_reads():
+    """Чтение внутри блока — из основной БД, даже в запросе с репликой.
+
+    Так заполняются общие кэши (каталог, фасеты, товары, поисковый индекс):
+    их ключи содержат версию, увеличенную записью в основную БД, и данные с
+    отстающей реплики под новой версией отдавались бы всем до следующего
+    изменения — вместе с ETag, который строится из той же версии.
+    """
+    with activate(RequestState(replica=False)):
+        yield
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is not None and state.replica and model._meta.app_label not in PRIMARY_APPS
+                and replica_available() and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label not in PRIMARY_APPS:
+            # Дальше в этом запросе читаем только что записанное из default
+            state.wrote = True
+            state.pin()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной БД: объекты из обеих связываются свободно
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схему реплика получает вместе с данными основной БД
+        return db == DEFAULT_DB_ALIAS
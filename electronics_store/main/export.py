@@ -0,0 +1,203 @@
+# main/export.py
+"""Потоковая выгрузка заказов и товаров в CSV и JSON.
+
+Строки читаются через iterator(chunk_size=...): в памяти одновременно
+только одна пачка заказов с их позициями (prefetch_related выполняется
+для каждой пачки отдельно) или товаров, поэтому объём выгрузки не
+ограничен памятью процесса. Генераторы отдают текст по строке — их можно
+передать в StreamingHttpResponse (действия админки) или писать в файл
+(команда export_data).
+
+Под ASGI генераторы оборачиваются в aiterate(): иначе Django соберёт
+синхронный генератор в список целиком.
+
+Заказ в CSV — по строке на позицию (поля заказа повторяются), заказ без
+позиций — одной строкой с пустыми полями позиции. В JSON — массив заказов
+с вложенным списком позиций.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+
+CHUNK_SIZE = 2000
+# Строк выгрузки за один переход в поток синхронного кода (aiterate)
+ASYNC_LINES = 500
+FORMATS = ('csv', 'json')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'json': 'application/json; charset=utf-8'}
+
+ORDER_COLUMNS = ('order_id', 'created_at', 'status', 'customer', 'email', 'total_price',
+                 'items_count', 'cancellation_reason')
+ITEM_COLUMNS = ('product_id', 'product', 'quantity', 'price', 'line_total')
+PRODUCT_COLUMNS = ('id', 'name', 'slug', 'category', 'price', 'year', 'country', 'model',
+                   'stock', 'in_stock', 'created_at')
+
+
+class _Echo:
+    """Файл для csv.writer, который возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def filter_orders(queryset, date_from=None, date_to=None, status=None):
+    """Фильтры выгрузки — те же, что OrderAdmin.list_filter: дата создания
+    (включительно, по местному времени) и статус"""
+    if date_from:
+        queryset = queryset.filter(created_at__gte=_day_start(date_from))
+    if date_to:
+        # Граница — начало следующего дня, а не created_at__date: так работает индекс по created_at
+        queryset = queryset.filter(created_at__lt=_day_start(date_to + timedelta(days=1)))
+    if status:
+        queryset = queryset.filter(status=status)
+    return queryset
+
+
+def filter_products(queryset, category=None, in_stock=None):
+    """Фильтры ProductAdmin.list_filter, нужные для выгрузки: слаг категории и наличие"""
+    if category:
+        queryset = queryset.filter(category__slug=category)
+    if in_stock is not None:
+        queryset = queryset.filter(in_stock=in_stock)
+    return queryset
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _orders(queryset, chunk_size):
+    items = OrderItem.objects.select_related('product').order_by('id')
+    return (
+        queryset.select_related('user__userprofile')
+        .prefetch_related(Prefetch('items', queryset=items))
+        .order_by('id')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _order_fields(order):
+    return {
+        'order_id': order.id,
+        'created_at': timezone.localtime(order.created_at).isoformat(),
+        'status': order.status,
+        'customer': order.customer_full_name,
+        'email': order.user.email,
+        'total_price': order.total_price,
+        'items_count': order.items_count,
+        'cancellation_reason': order.cancellation_reason or '',
+    }
+
+
+def _item_fields(item):
+    return {
+        'product_id': item.product_id,
+        'product': item.product.name,
+        'quantity': item.quantity,
+        'price': item.price,
+        'line_total': item.line_total(),
+    }
+
+
+def _product_fields(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'category': product.category.name,
+        'price': product.price,
+        'year': product.year,
+        'country': product.country,
+        'model': product.model,
+        'stock': product.stock,
+        'in_stock': product.in_stock,
+        'created_at': timezone.localtime(product.created_at).isoformat(),
+    }
+
+
+def order_records(queryset, chunk_size=CHUNK_SIZE):
+    """Заказы как словари с вложенным списком позиций 'items'"""
+    for order in _orders(queryset, chunk_size):
+        yield {**_order_fields(order), 'items': [_item_fields(item) for item in order.items.all()]}
+
+
+def order_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Строки CSV: по строке на позицию заказа"""
+    for order in _orders(queryset, chunk_size):
+        fields = _order_fields(order)
+        head = [fields[column] for column in ORDER_COLUMNS]
+        items = order.items.all()
+        if not items:
+            yield head + [''] * len(ITEM_COLUMNS)
+        for item in items:
+            line = _item_fields(item)
+            yield head + [line[column] for column in ITEM_COLUMNS]
+
+
+def product_records(queryset, chunk_size=CHUNK_SIZE):
+    for product in queryset.select_related('category').order_by('id').iterator(chunk_size=chunk_size):
+        yield _product_fields(product)
+
+
+def product_rows(queryset, chunk_size=CHUNK_SIZE):
+    for record in product_records(queryset, chunk_size):
+        yield [record[column] for column in PRODUCT_COLUMNS]
+
+
+def stream_csv(header, rows, bom=False):
+    """Текст CSV по строке; bom=True — с BOM, чтобы Excel узнал UTF-8"""
+    writer = csv.writer(_Echo())
+    yield ('\ufeff' if bom else '') + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_json(records):
+    """JSON-массив по элементу на строку, без сборки всего списка в памяти"""
+    yield '['
+    separator = '\n'
+    for record in records:
+        yield separator + json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+def stream(queryset, fmt, chunk_size=CHUNK_SIZE, bom=False):
+    """Выгрузка заказов или товаров queryset в формате fmt ('csv' или 'json')"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+    if queryset.model is Order:
+        if fmt == 'csv':
+            return stream_csv(ORDER_COLUMNS + ITEM_COLUMNS, order_rows(queryset, chunk_size), bom)
+        return stream_json(order_records(queryset, chunk_size))
+    if queryset.model is Product:
+        if fmt == 'csv':
+            return stream_csv(PRODUCT_COLUMNS, product_rows(queryset, chunk_size), bom)
+        return stream_json(product_records(queryset, chunk_size))
+    raise ValueError(f'Выгрузка {queryset.model._meta.label} не поддерживается')
+
+
+async def aiterate(chunks, lines=None):
+    """Асинхронный итератор поверх генератора stream() — для ASGI.
+
+    StreamingHttpResponse под ASGI собирает синхронный генератор целиком
+    (sync_to_async(list)), и вся выгрузка оказывается в памяти. Здесь
+    генератор читается пачками по lines строк в потоке sync_to_async (ORM
+    и курсор БД остаются в одном потоке), и пачки отдаются по мере готовности.
+    """
+    lines = lines or ASYNC_LINES
+    iterator = iter(chunks)
+    next_batch = sync_to_async(lambda: ''.join(islice(iterator, lines)))
+    while batch := await next_batch():
+        yield batch
+
+
+def filename(queryset, fmt):
+    return f'{queryset.model._meta.model_name}s-{timezone.localdate():%Y%m%d}.{fmt}'
@@ -0,0 +1,337 @@
+# main/facets.py
+"""Фасетные фильтры каталога: категория, страна, диапазоны года и цены.
+
+Счётчики товаров в наличии хранятся в таблице ProductFacetCount по
+сочетаниям (категория, страна, год, ценовой диапазон) — их на порядки
+меньше, чем товаров. Таблица правится инкрементально сигналами Product и
+функциями main/stock.py, поэтому для страницы каталога достаточно одного
+чтения этой таблицы (оно ещё и кэшируется), а все счётчики считаются за
+один проход по её строкам.
+
+Для каждого фасета счётчики учитывают все остальные выбранные фильтры,
+но не его собственный — видно, сколько товаров даст другое значение.
+При поиске (?q=) счётчики считаются тем же проходом по найденным товарам.
+"""
+import hashlib
+from bisect import bisect_right
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from . import search
+from .catalog import ALL_SCOPE, aget_version, get_version
+from .db_router import primary_reads
+from .models import Product, ProductFacetCount
+
+# Нижние границы ценовых диапазонов, ₽; последний диапазон открыт сверху
+PRICE_BUCKETS = (0, 5000, 10000, 20000, 50000, 100000, 200000)
+FACETS = ('category', 'country', 'year', 'price')
+# Поля товара, из которых складывается строка счётчиков
+ROW_FIELDS = ('category_id', 'country', 'year', 'price')
+
+
+def price_bucket(price):
+    return bisect_right(PRICE_BUCKETS, Decimal(price)) - 1
+
+
+def price_bucket_label(index):
+    low = PRICE_BUCKETS[index]
+    if index + 1 == len(PRICE_BUCKETS):
+        return f'от {low:,} ₽'.replace(',', ' ')
+    high = PRICE_BUCKETS[index + 1]
+    if not low:
+        return f'до {high:,} ₽'.replace(',', ' ')
+    return f'{low:,} – {high:,} ₽'.replace(',', ' ')
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def _key(category_id, country, year, price):
+    return category_id, country, year, price_bucket(price)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Filters:
+    """Выбранные покупателем фильтры каталога"""
+
+    def __init__(self, category=None, countries=(), year_from=None, year_to=None, price_buckets=(), query=''):
+        self.category = category
+        self.countries = tuple(sorted(set(countries)))
+        self.year_from = year_from
+        self.year_to = year_to
+        self.price_buckets = tuple(sorted(set(price_buckets)))
+        self.query = ' '.join(search.tokenize(query))
+
+    @classmethod
+    def from_request(cls, params, categories):
+        """Разобрать GET-параметры; неизвестные значения отбрасываются"""
+        slug = params.get('category')
+        category = next((c for c in categories if c.slug == slug), None) if slug else None
+        buckets = [_int_or_none(value) for value in params.getlist('price')]
+        return cls(
+            category=category,
+            countries=[value for value in params.getlist('country') if value][:20],
+            year_from=_int_or_none(params.get('year_from')),
+            year_to=_int_or_none(params.get('year_to')),
+            price_buckets=[b for b in buckets if b is not None and 0 <= b < len(PRICE_BUCKETS)],
+            query=params.get('q', '').strip()[:search.QUERY_MAX_LENGTH],
+        )
+
+    def params(self, exclude=()):
+        """[(имя, значение)] для urlencode(..., doseq=True)"""
+        result = []
+        if self.category and 'category' not in exclude:
+            result.append(('category', self.category.slug))
+        if 'country' not in exclude:
+            result += [('country', country) for country in self.countries]
+        if 'year' not in exclude:
+            if self.year_from is not None:
+                result.append(('year_from', self.year_from))
+            if self.year_to is not None:
+                result.append(('year_to', self.year_to))
+        if 'price' not in exclude:
+            result += [('price', bucket) for bucket in self.price_buckets]
+        if self.query and 'q' not in exclude:
+            result.append(('q', self.query))
+        return result
+
+    def cache_key(self):
+        return hashlib.md5(repr(self.params()).encode()).hexdigest()
+
+    @property
+    def active(self):
+        return bool(self.countries or self.year_from is not None or self.year_to is not None or self.price_buckets)
+
+    def passes(self, facet, value):
+        """Проходит ли значение фасета собственный фильтр этого фасета"""
+        if facet == 'category':
+            return not self.category or value == self.category.id
+        if facet == 'country':
+            return not self.countries or value in self.countries
+        if facet == 'year':
+            return ((self.year_from is None or value >= self.year_from)
+                    and (self.year_to is None or value <= self.year_to))
+        return not self.price_buckets or value in self.price_buckets
+
+    def apply(self, qs):
+        """Отфильтровать queryset товаров"""
+        qs = self._apply_facets(qs)
+        if self.query:
+            qs = search.filter_products(qs, self.query)
+        return qs
+
+    async def aapply(self, qs):
+        """Асинхронный вариант apply()"""
+        qs = self._apply_facets(qs)
+        if self.query:
+            qs = await search.afilter_products(qs, self.query)
+        return qs
+
+    def _apply_facets(self, qs):
+        if self.category:
+            qs = qs.filter(category=self.category)
+        if self.countries:
+            qs = qs.filter(country__in=self.countries)
+        if self.year_from is not None:
+            qs = qs.filter(year__gte=self.year_from)
+        if self.year_to is not None:
+            qs = qs.filter(year__lte=self.year_to)
+        if self.price_buckets:
+            condition = Q()
+            for bucket in self.price_buckets:
+                bounds = Q(price__gte=PRICE_BUCKETS[bucket])
+                if bucket + 1 < len(PRICE_BUCKETS):
+                    bounds &= Q(price__lt=PRICE_BUCKETS[bucket + 1])
+                condition |= bounds
+            qs = qs.filter(condition)
+        return qs
+
+
+def _combinations():
+    """[(category_id, country, year, bucket, count)] — из кэша или одним запросом"""
+    key = f'catalog:facets:{get_version(ALL_SCOPE)}'
+    rows = cache.get(key)
+    if rows is None:
+        with primary_reads():
+            rows = list(ProductFacetCount.objects.filter(count__gt=0).values_list(
+                'category_id', 'country', 'year', 'price_bucket', 'count'))
+        cache.set(key, rows, _timeout())
+    return rows
+
+
+def _searched_combinations(filters):
+    """То же по товарам, найденным поиском (счётчики из таблицы не знают про запрос)"""
+    qs = search.filter_products(Product.objects.filter(in_stock=True), filters.query)
+    counter = Counter(_key(*row) for row in qs.values_list(*ROW_FIELDS))
+    return [(*key, count) for key, count in counter.items()]
+
+
+async def _acombinations():
+    key = f'catalog:facets:{await aget_version(ALL_SCOPE)}'
+    rows = await cache.aget(key)
+    if rows is None:
+        qs = ProductFacetCount.objects.filter(count__gt=0).values_list(
+            'category_id', 'country', 'year', 'price_bucket', 'count')
+        with primary_reads():
+            rows = [row async for row in qs]
+        await cache.aset(key, rows, _timeout())
+    return rows
+
+
+async def _asearched_combinations(filters):
+    qs = await search.afilter_products(Product.objects.filter(in_stock=True), filters.query)
+    counter = Counter([_key(*row) async for row in qs.values_list(*ROW_FIELDS)])
+    return [(*key, count) for key, count in counter.items()]
+
+
+def count(filters):
+    """Счётчики фасетов для выбранных фильтров.
+
+    {'total': N, 'category': {id: n}, 'country': {name: n},
+     'year': {year: n}, 'price': {bucket: n}}
+    """
+    key = f'catalog:facet_counts:{get_version(ALL_SCOPE)}:{filters.cache_key()}'
+    result = cache.get(key)
+    if result is None:
+        with primary_reads():
+            result = _count(filters)
+        cache.set(key, result, _timeout())
+    return result
+
+
+async def acount(filters):
+    """Асинхронный вариант count()"""
+    key = f'catalog:facet_counts:{await aget_version(ALL_SCOPE)}:{filters.cache_key()}'
+    result = await cache.aget(key)
+    if result is None:
+        with primary_reads():
+            rows = await _asearched_combinations(filters) if filters.query else await _acombinations()
+        result = _count_rows(filters, rows)
+        await cache.aset(key, result, _timeout())
+    return result
+
+
+def _count(filters):
+    rows = _searched_combinations(filters) if filters.query else _combinations()
+    return _count_rows(filters, rows)
+
+
+def _count_rows(filters, rows):
+    counts = {facet: Counter() for facet in FACETS}
+    total = 0
+    for category_id, country, year, bucket, n in rows:
+        values = {'category': category_id, 'country': country, 'year': year, 'price': bucket}
+        failed = [facet for facet in FACETS if not filters.passes(facet, values[facet])]
+        if not failed:
+            total += n
+            for facet in FACETS:
+                counts[facet][values[facet]] += n
+        elif len(failed) == 1:
+            # Не прошёл только собственный фильтр фасета — значение всё равно считается
+            counts[failed[0]][values[failed[0]]] += n
+    result = {facet: dict(counter) for facet, counter in counts.items()}
+    result['total'] = total
+    return result
+
+
+def options(counts, filters, categories):
+    """Значения фасетов со счётчиками и отметкой выбранных — для шаблона каталога"""
+    countries = set(counts['country']) | set(filters.countries)
+    return {
+        'total': counts['total'],
+        'categories': [(c, counts['category'].get(c.id, 0)) for c in categories],
+        'countries': [
+            {'value': country, 'count': counts['country'].get(country, 0), 'checked': country in filters.countries}
+            for country in sorted(countries)
+        ],
+        'years': [{'value': year, 'count': n} for year, n in sorted(counts['year'].items())],
+        'prices': [
+            {'value': i, 'label': price_bucket_label(i), 'count': counts['price'].get(i, 0),
+             'checked': i in filters.price_buckets}
+            for i in range(len(PRICE_BUCKETS))
+        ],
+    }
+
+
+def facet_search(filters, base=None):
+    """(отфильтрованный queryset товаров в наличии, счётчики фасетов)"""
+    if base is None:
+        base = Product.objects.filter(in_stock=True)
+    return filters.apply(base), count(filters)
+
+
+async def afacet_search(filters, base=None):
+    """Асинхронный вариант facet_search()"""
+    if base is None:
+        base = Product.objects.filter(in_stock=True)
+    return await filters.aapply(base), await acount(filters)
+
+
+def adjust(deltas):
+    """Применить изменения счётчиков {(category_id, country, year, bucket): delta}"""
+    for (category_id, country, year, bucket), delta in deltas.items():
+        if not delta:
+            continue
+        lookup = {'category_id': category_id, 'country': country, 'year': year, 'price_bucket': bucket}
+        if ProductFacetCount.objects.filter(**lookup).update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                ProductFacetCount.objects.create(count=delta, **lookup)
+        except IntegrityError:
+            # Строку успел создать параллельный запрос
+            ProductFacetCount.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def move(old_row, new_row):
+    """Товар перешёл из сочетания old_row в new_row ((category_id, country, year, price) или None)"""
+    old_key = _key(*old_row) if old_row else None
+    new_key = _key(*new_row) if new_row else None
+    if old_key == new_key:
+        return
+    deltas = Counter()
+    if old_key:
+        deltas[old_key] -= 1
+    if new_key:
+        deltas[new_key] += 1
+    adjust(deltas)
+
+
+def rows_to_deltas(rows, sign):
+    """Counter изменений для строк (category_id, country, year, price)"""
+    deltas = Counter()
+    for row in rows:
+        deltas[_key(*row)] += sign
+    return deltas
+
+
+def rebuild():
+    """Пересчитать таблицу счётчиков целиком одним GROUP BY по товарам"""
+    bucket = Case(
+        *(When(price__gte=low, then=Value(i)) for i, low in reversed(list(enumerate(PRICE_BUCKETS)))),
+        default=Value(0), output_field=IntegerField(),
+    )
+    rows = (Product.objects.filter(in_stock=True)
+            .annotate(bucket=bucket)
+            .values('category_id', 'country', 'year', 'bucket')
+            .annotate(n=Count('id'))
+            .order_by())
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create([
+            ProductFacetCount(category_id=row['category_id'], country=row['country'], year=row['year'],
+                              price_bucket=row['bucket'], count=row['n'])
+            for row in rows
+        ], batch_size=1000)
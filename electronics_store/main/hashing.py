@@ -0,0 +1,195 @@
+# main/hashing.py
+"""Хеширование паролей в отдельном ограниченном пуле.
+
+PBKDF2 занимает процессор на сотни миллисекунд. Вход, регистрация и
+подтверждение заказа отдают эту работу пулу из PASSWORD_HASHING['WORKERS']
+потоков или процессов, чтобы не блокировать цикл событий и не занимать
+потоки, обслуживающие остальные запросы. Очередь пула ограничена: при
+наплыве входов лишние задачи сразу получают HashingBusy (ответ 503), а не
+копятся минутами. Длина очереди — показатель password_hashing_queue_depth
+в main/metrics.py.
+
+Успешная проверка пароля на короткое время запоминается в кэше
+(VERIFIED_CACHE_TIMEOUT), чтобы повторный ввод того же пароля при
+оформлении заказа не считал PBKDF2 заново. В кэше хранится только HMAC от
+пароля и текущего хеша: после смены пароля запись перестаёт совпадать.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import cache
+from django.utils.crypto import salted_hmac
+
+from . import metrics
+
+DEFAULTS = {
+    'EXECUTOR': 'thread',
+    'WORKERS': None,
+    'MAX_QUEUE': 64,
+    'VERIFIED_CACHE_TIMEOUT': 300,
+}
+EXECUTORS = ('thread', 'process', 'inline')
+
+_lock = threading.Lock()
+_executor = None
+_executor_config = None
+_pending = 0
+
+
+class HashingBusy(Exception):
+    """Очередь хеширования заполнена — запрос стоит повторить позже"""
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING', {})}
+    if config['EXECUTOR'] not in EXECUTORS:
+        raise ValueError(f"PASSWORD_HASHING['EXECUTOR'] должен быть одним из {EXECUTORS}")
+    config['WORKERS'] = config['WORKERS'] or os.cpu_count() or 1
+    return config
+
+
+def _init_worker():
+    # Процессы пула запускаются через spawn и настраивают Django заново
+    if not apps.ready:
+        django.setup()
+
+
+def _create_executor(config):
+    if config['EXECUTOR'] == 'process':
+        # spawn, а не fork: копировать многопоточный процесс сервера небезопасно
+        return ProcessPoolExecutor(max_workers=config['WORKERS'], mp_context=get_context('spawn'),
+                                   initializer=_init_worker)
+    if config['EXECUTOR'] == 'thread':
+        return ThreadPoolExecutor(max_workers=config['WORKERS'], thread_name_prefix='password-hashing')
+    return None
+
+
+def get_executor():
+    """Пул под текущие настройки; при их смене старый пул закрывается"""
+    global _executor, _executor_config
+    config = get_config()
+    key = (config['EXECUTOR'], config['WORKERS'])
+    with _lock:
+        if _executor_config != key:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = _create_executor(config)
+            _executor_config = key
+        return _executor, config
+
+
+def shutdown():
+    global _executor, _executor_config
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = _executor_config = None
+
+
+def _set_pending(delta, workers, limit=None):
+    """Изменить число задач в работе; False — лимит limit уже достигнут"""
+    global _pending
+    with _lock:
+        if limit is not None and _pending >= limit:
+            return False
+        _pending += delta
+        depth = max(_pending - workers, 0)
+    metrics.set_gauge('password_hashing_queue_depth', depth)
+    return True
+
+
+def submit(func, *args):
+    """Поставить func(*args) в пул; возвращает concurrent.futures.Future.
+
+    Если задач в работе и в очереди уже WORKERS + MAX_QUEUE — HashingBusy.
+    """
+    executor, config = get_executor()
+    workers = config['WORKERS']
+    if not _set_pending(1, workers, limit=workers + config['MAX_QUEUE']):
+        metrics.inc('password_hashing_rejected')
+        raise HashingBusy
+    metrics.inc('password_hashes')
+
+    def done(future):
+        _set_pending(-1, workers)
+
+    if executor is None:
+        # inline: хеш считается в вызывающем потоке, как без пула
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        done(future)
+        return future
+    future = executor.submit(func, *args)
+    future.add_done_callback(done)
+    return future
+
+
+def run(func, *args):
+    return submit(func, *args).result()
+
+
+async def arun(func, *args):
+    return await asyncio.wrap_future(submit(func, *args))
+
+
+def _verify(raw_password, encoded):
+    """(пароль подходит, хеш нужно пересчитать); функция модуля — её можно
+    передать в пул процессов"""
+    outdated = []
+    valid = hashers.check_password(raw_password, encoded, outdated.append)
+    return valid, bool(outdated)
+
+
+def _verified_key(user, raw_password):
+    digest = salted_hmac('main.hashing.verified', f'{user.pk}:{user.password}:{raw_password}',
+                         algorithm='sha256').hexdigest()
+    return f'hashing:verified:{digest}'
+
+
+def make_password(raw_password):
+    return run(hashers.make_password, raw_password)
+
+
+async def amake_password(raw_password):
+    return await arun(hashers.make_password, raw_password)
+
+
+def check_password(user, raw_password, cached=False):
+    """Проверить пароль пользователя; устаревший хеш пересчитывается и сохраняется.
+
+    cached=True — сначала искать недавнюю успешную проверку в кэше
+    (повторный ввод пароля при оформлении заказа).
+    """
+    timeout = get_config()['VERIFIED_CACHE_TIMEOUT']
+    if cached and timeout and cache.get(_verified_key(user, raw_password)):
+        return True
+    valid, outdated = run(_verify, raw_password, user.password)
+    if valid and outdated:
+        user.password = make_password(raw_password)
+        user.save(update_fields=['password'])
+    if valid and timeout:
+        cache.set(_verified_key(user, raw_password), True, timeout)
+    return valid
+
+
+async def acheck_password(user, raw_password, cached=False):
+    timeout = get_config()['VERIFIED_CACHE_TIMEOUT']
+    if cached and timeout and await cache.aget(_verified_key(user, raw_password)):
+        return True
+    valid, outdated = await arun(_verify, raw_password, user.password)
+    if valid and outdated:
+        user.password = await amake_password(raw_password)
+        await user.asave(update_fields=['password'])
+    if valid and timeout:
+        await cache.aset(_verified_key(user, raw_password), True, timeout)
+    return valid
@@ -0,0 +1,209 @@
+# main/management/commands/bench_asgi.py
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.bench import percentile, test_database
+from main.models import Product
+from main.seed import SEED_PASSWORD, seed_store
+
+# Секрет CSRF: одинаковое значение в cookie и заголовке проходит проверку
+CSRF_TOKEN = 'b' * 32
+
+
+class Request:
+    def __init__(self, method, path, query=None, body=None):
+        self.method = method
+        self.path = path
+        self.query = urlencode(query or {})
+        self.body = json.dumps(body).encode() if body is not None else b''
+
+
+def call_wsgi(application, request):
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'PATH_INFO': request.path,
+        'QUERY_STRING': request.query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(request.body)),
+        'HTTP_COOKIE': f'csrftoken={CSRF_TOKEN}',
+        'HTTP_X_CSRFTOKEN': CSRF_TOKEN,
+        'wsgi.input': BytesIO(request.body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    result = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return int(status[0].split()[0])
+
+
+async def call_asgi(application, request):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': request.method,
+        'scheme': 'http',
+        'path': request.path,
+        'raw_path': request.path.encode(),
+        'query_string': request.query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'testserver'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(request.body)).encode()),
+            (b'cookie', f'csrftoken={CSRF_TOKEN}'.encode()),
+            (b'x-csrftoken', CSRF_TOKEN.encode()),
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    body_sent = False
+    status = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': request.body, 'more_body': False}
+        # Клиент не отключается: ожидание прервёт сам обработчик после ответа
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест: пропускная способность WSGI и ASGI при параллельных запросах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на каждый сценарий')
+        parser.add_argument('--concurrency', type=int, default=16, help='Одновременных запросов')
+        parser.add_argument('--products', type=int, default=2000, help='Сколько товаров сгенерировать')
+        parser.add_argument('--only', help='Сценарии через запятую')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        # Под нагрузкой почти каждый запрос «медленный» — не засорять вывод логом
+        logging.getLogger('main.metrics').setLevel(logging.ERROR)
+        # Файл вместо БД в памяти: к базе одновременно обращаются несколько потоков
+        path = os.path.join(tempfile.mkdtemp(), 'bench_asgi.sqlite3')
+        with test_database(name=path):
+            seed_store(products=options['products'], users=20, orders=100)
+            connections.close_all()
+            results = self._run(options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(
+            f"{'сценарий':<16} {'вход':<5} {'запр/с':>8} {'p50, мс':>9} {'p99, мс':>9} {'ошибок':>7}"
+        )
+        for name, rows in results.items():
+            for entry, row in rows.items():
+                self.stdout.write(
+                    f"{name:<16} {entry:<5} {row['rps']:>8} {row['p50_ms']:>9} {row['p99_ms']:>9} {row['errors']:>7}"
+                )
+
+    def _scenarios(self):
+        product_ids = list(Product.objects.filter(in_stock=True).values_list('id', flat=True)[:50])
+        usernames = list(User.objects.values_list('username', flat=True)[:20])
+        return {
+            'catalog': lambda i: Request('GET', '/catalog/'),
+            'catalog_search': lambda i: Request('GET', '/catalog/', {'q': ['смарт', 'ноут', 'науш'][i % 3]}),
+            'api_cart_add': lambda i: Request('POST', '/api/cart/add',
+                                              body={'product_id': product_ids[i % len(product_ids)], 'delta': 1}),
+            'api_login': lambda i: Request('POST', '/api/login',
+                                           body={'login': usernames[i % len(usernames)], 'password': SEED_PASSWORD}),
+        }
+
+    def _run(self, options):
+        from electronics_store.asgi import application as asgi_application
+        from electronics_store.wsgi import application as wsgi_application
+
+        scenarios = self._scenarios()
+        if options['only']:
+            names = {name.strip() for name in options['only'].split(',')}
+            scenarios = {name: build for name, build in scenarios.items() if name in names}
+        total = options['requests']
+        concurrency = options['concurrency']
+        results = {}
+        for name, build in scenarios.items():
+            requests = [build(i) for i in range(total)]
+            results[name] = {
+                'wsgi': self._run_wsgi(wsgi_application, requests, concurrency),
+                'asgi': self._run_asgi(asgi_application, requests, concurrency),
+            }
+        return results
+
+    def _run_wsgi(self, application, requests, concurrency):
+        cache.clear()
+
+        def timed(request):
+            start = time.perf_counter()
+            try:
+                return call_wsgi(application, request), time.perf_counter() - start
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(timed, requests))
+        return self._summary(outcomes, time.perf_counter() - start)
+
+    def _run_asgi(self, application, requests, concurrency):
+        cache.clear()
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def timed(request):
+                async with semaphore:
+                    start = time.perf_counter()
+                    return await call_asgi(application, request), time.perf_counter() - start
+
+            return await asyncio.gather(*(timed(request) for request in requests))
+
+        start = time.perf_counter()
+        outcomes = asyncio.run(run())
+        return self._summary(outcomes, time.perf_counter() - start)
+
+    def _summary(self, outcomes, elapsed):
+        timings = [seconds * 1000 for _, seconds in outcomes]
+        return {
+            'requests': len(outcomes),
+            'errors': sum(1 for status, _ in outcomes if status >= 400),
+            'rps': round(len(outcomes) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+        }
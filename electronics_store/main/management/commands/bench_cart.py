@@ -0,0 +1,69 @@
+# main/management/commands/bench_cart.py
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from main.bench import Sample, test_database
+from main.cart import STORAGES
+from main.models import Category, Product
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class WriteCounter:
+    """execute_wrapper: считает изменяющие запросы и объём записываемых значений"""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(WRITE_PREFIXES):
+            self.writes += 1
+            rows = params if many else [params]
+            self.bytes += sum(len(str(value)) for row in rows for value in (row or ()))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Сравнение способов хранения корзины: записей в БД и время на одно изменение корзины'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=100, help='Изменений корзины на каждый режим')
+
+    def handle(self, *args, **options):
+        clicks = options['clicks']
+        with test_database():
+            category = Category.objects.create(slug='bench', name='Бенчмарк')
+            products = Product.objects.bulk_create([
+                Product(category=category, name=f'Товар {i}', slug=f'bench-{i}', price=100,
+                        year=2024, country='Россия', model=f'B-{i}', stock=10 ** 6)
+                for i in range(5)
+            ])
+            self.stdout.write(f"{'режим':<10} {'записей/клик':>13} {'байт/клик':>10} {'запросов':>9} {'p50, мс':>9} {'p99, мс':>9}")
+            for mode in STORAGES:
+                with override_settings(CART_STORAGE=mode):
+                    row = self._run(products, clicks)
+                self.stdout.write(
+                    f"{mode:<10} {row['writes_per_click']:>13} {row['bytes_per_click']:>10} {row['queries']:>9} "
+                    f"{row['p50_ms']:>9} {row['p99_ms']:>9}"
+                )
+
+    def _run(self, products, clicks):
+        client = Client()
+        counter = WriteCounter()
+        sample = Sample()
+        with connection.execute_wrapper(counter):
+            for i in range(clicks):
+                # Чередуем добавление и уменьшение, как при кликах +/- в корзине
+                product = products[i % len(products)]
+                body = json.dumps({'product_id': product.id, 'delta': 1 if i % 3 else -1})
+                with sample.measure():
+                    client.post('/api/cart/add', body, content_type='application/json')
+        row = sample.summary()
+        row['writes_per_click'] = round(counter.writes / clicks, 2)
+        row['bytes_per_click'] = round(counter.bytes / clicks)
+        return row
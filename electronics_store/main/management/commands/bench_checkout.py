@@ -0,0 +1,55 @@
+# main/management/commands/bench_checkout.py
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from main.bench import Sample, test_database
+from main.checkout import place_order
+from main.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Замер оформления заказа: число запросов и p99 для корзин из 1/10/100 позиций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,100', help='Размеры корзин через запятую')
+        parser.add_argument('--iterations', type=int, default=50, help='Повторов на каждый размер')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+        iterations = options['iterations']
+
+        with test_database():
+            results = self._run(sizes, iterations)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f"{'строк':>6} {'запросов':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+        for size, row in results.items():
+            self.stdout.write(
+                f"{size:>6} {row['queries']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}"
+            )
+
+    def _run(self, sizes, iterations):
+        user = User.objects.create_user(username='bench', password='bench')
+        category = Category.objects.create(slug='bench', name='Бенчмарк')
+        products = Product.objects.bulk_create([
+            Product(
+                category=category, name=f'Товар {i}', slug=f'bench-{i}', price=100 + i,
+                year=2024, country='Россия', model=f'B-{i}', stock=10 ** 6,
+            )
+            for i in range(max(sizes))
+        ])
+
+        results = {}
+        for size in sizes:
+            cart = {str(p.id): 1 for p in products[:size]}
+            sample = Sample()
+            for _ in range(iterations):
+                with sample.measure():
+                    place_order(user, cart)
+            results[size] = sample.summary()
+        return results
@@ -0,0 +1,119 @@
+# main/management/commands/bench_db_writers.py
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from main.bench import percentile, test_database
+from main.checkout import CheckoutError, place_order
+from main.models import Category, Product
+from main.sqlite_backend.base import PROFILES
+
+
+class Command(BaseCommand):
+    help = 'Параллельные оформления заказов: заказов в секунду и ошибок блокировки для профилей SQLite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', default='1,2,4,8', help='Числа параллельных писателей через запятую')
+        parser.add_argument('--orders', type=int, default=40, help='Заказов на каждого писателя')
+        parser.add_argument('--profiles', default='default,concurrent',
+                            help=f'Профили SQLite через запятую: {", ".join(PROFILES)}')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        writers = [int(n) for n in options['writers'].split(',') if n.strip()]
+        profiles = [name.strip() for name in options['profiles'].split(',') if name.strip()]
+        unknown = set(profiles) - set(PROFILES)
+        if unknown:
+            raise CommandError(f'Неизвестные профили: {", ".join(sorted(unknown))}')
+
+        db_options = connection.settings_dict['OPTIONS']
+        old_profile = db_options.get('profile')
+        results = {}
+        try:
+            for profile in profiles:
+                # Профиль действует на соединения, открытые после его смены; журнал
+                # WAL сохраняется в файле, поэтому у каждого профиля своя БД
+                connections.close_all()
+                db_options['profile'] = profile
+                path = os.path.join(tempfile.mkdtemp(), f'bench_db_{profile}.sqlite3')
+                with test_database(name=path):
+                    users, products = self._setup(max(writers))
+                    connections.close_all()
+                    results[profile] = {n: self._run(users[:n], products, options['orders']) for n in writers}
+        finally:
+            connections.close_all()
+            if old_profile is None:
+                db_options.pop('profile', None)
+            else:
+                db_options['profile'] = old_profile
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(
+            f"{'профиль':<11} {'писателей':>9} {'заказов':>8} {'заказов/с':>10} "
+            f"{'p50, мс':>9} {'p99, мс':>9} {'locked':>7}"
+        )
+        for profile, rows in results.items():
+            for n, row in rows.items():
+                self.stdout.write(
+                    f"{profile:<11} {n:>9} {row['orders']:>8} {row['orders_per_sec']:>10} "
+                    f"{row['p50_ms']:>9} {row['p99_ms']:>9} {row['locked']:>7}"
+                )
+
+    def _setup(self, writers):
+        users = [User.objects.create_user(username=f'writer{i}', password='bench') for i in range(writers)]
+        category = Category.objects.create(slug='bench', name='Бенчмарк')
+        products = Product.objects.bulk_create([
+            Product(
+                category=category, name=f'Товар {i}', slug=f'bench-{i}', price=100 + i,
+                year=2024, country='Россия', model=f'B-{i}', stock=10 ** 6,
+            )
+            for i in range(50)
+        ])
+        return users, [p.id for p in products]
+
+    def _run(self, users, product_ids, orders):
+        timings, locked, failed = [], [], []
+
+        def writer(user, seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(orders):
+                    cart = {str(product_id): rng.randint(1, 3) for product_id in rng.sample(product_ids, 3)}
+                    start = time.perf_counter()
+                    try:
+                        place_order(user, cart)
+                    except OperationalError:
+                        # «database is locked»: заказ не оформлен, покупатель видит ошибку
+                        locked.append(1)
+                        continue
+                    except CheckoutError:
+                        failed.append(1)
+                        continue
+                    timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(user, i)) for i, user in enumerate(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {
+            'orders': len(timings),
+            'orders_per_sec': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'locked': len(locked),
+            'failed': len(failed),
+        }
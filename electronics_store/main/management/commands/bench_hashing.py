@@ -0,0 +1,116 @@
+# main/management/commands/bench_hashing.py
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from main import hashing
+from main.bench import percentile, test_database
+from main.management.commands.bench_asgi import Request, call_asgi
+from main.seed import SEED_PASSWORD, seed_store
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест входа: логинов в секунду на ядро для разных пулов хеширования паролей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=40, help='Входов на каждый вариант пула')
+        parser.add_argument('--concurrency', type=int, default=16, help='Одновременных запросов')
+        parser.add_argument('--executors', default='inline,thread,process',
+                            help=f'Варианты пула через запятую: {", ".join(hashing.EXECUTORS)}')
+        parser.add_argument('--workers', type=int, help='Размер пула (по умолчанию — число ядер)')
+        parser.add_argument('--max-queue', type=int, help='Лимит очереди (по умолчанию — с запасом на все запросы)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        executors = [name.strip() for name in options['executors'].split(',') if name.strip()]
+        unknown = set(executors) - set(hashing.EXECUTORS)
+        if unknown:
+            raise CommandError(f'Неизвестные варианты пула: {", ".join(sorted(unknown))}')
+        logging.getLogger('main.metrics').setLevel(logging.ERROR)
+
+        path = os.path.join(tempfile.mkdtemp(), 'bench_hashing.sqlite3')
+        with test_database(name=path):
+            seed_store(products=10, users=20, orders=0)
+            connections.close_all()
+            usernames = list(User.objects.values_list('username', flat=True)[:20])
+            requests = [
+                Request('POST', '/api/login', body={'login': usernames[i % len(usernames)], 'password': SEED_PASSWORD})
+                for i in range(options['requests'])
+            ]
+            results = {name: self._run(name, requests, options) for name in executors}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'Ядер: {available_cores()}')
+        self.stdout.write(
+            f"{'пул':<8} {'потоков':>7} {'входов/с':>9} {'на ядро':>8} {'p50, мс':>9} {'p99, мс':>9} {'503':>5} {'ошибок':>7}"
+        )
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<8} {row['workers']:>7} {row['logins_per_sec']:>9} {row['logins_per_sec_per_core']:>8} "
+                f"{row['p50_ms']:>9} {row['p99_ms']:>9} {row['rejected']:>5} {row['errors']:>7}"
+            )
+
+    def _run(self, executor, requests, options):
+        from electronics_store.asgi import application
+
+        workers = options['workers'] or available_cores()
+        config = {
+            'EXECUTOR': executor,
+            'WORKERS': workers,
+            'MAX_QUEUE': options['max_queue'] if options['max_queue'] is not None else len(requests),
+            'VERIFIED_CACHE_TIMEOUT': 0,
+        }
+        with override_settings(PASSWORD_HASHING=config):
+            hashing.shutdown()
+            # Запуск процессов пула и импорт Django в них не входят в замер
+            for future in [hashing.submit(hashing.hashers.make_password, 'warmup') for _ in range(workers)]:
+                future.result()
+            cache.clear()
+
+            async def run():
+                semaphore = asyncio.Semaphore(options['concurrency'])
+
+                async def timed(request):
+                    async with semaphore:
+                        start = time.perf_counter()
+                        return await call_asgi(application, request), time.perf_counter() - start
+
+                return await asyncio.gather(*(timed(request) for request in requests))
+
+            start = time.perf_counter()
+            outcomes = asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            hashing.shutdown()
+
+        timings = [seconds * 1000 for _, seconds in outcomes]
+        rate = len(outcomes) / elapsed
+        # Ядра, на которых реально может идти хеширование
+        cores = 1 if executor == 'inline' else min(workers, available_cores())
+        return {
+            'workers': 0 if executor == 'inline' else workers,
+            'requests': len(outcomes),
+            'rejected': sum(1 for status, _ in outcomes if status == 503),
+            'errors': sum(1 for status, _ in outcomes if status >= 400 and status != 503),
+            'logins_per_sec': round(rate, 2),
+            'logins_per_sec_per_core': round(rate / cores, 2),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+        }
@@ -0,0 +1,74 @@
+# main/management/commands/bench_search.py
+import json
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from main import search
+from main.bench import Sample, test_database
+from main.seed import seed_store
+
+# Префиксы и целые слова, как их набирают в строке поиска
+QUERIES = ['смарт', 'ноутбук sams', 'Apple', 'ЯПОН', 'науш sony', 'пылесос dyson 1', 'категория', 'кит', 'tele', 'xiaomi 4']
+
+
+class Command(BaseCommand):
+    help = 'Замер поиска товаров: каталог с ?q= и подсказки, FTS5 против индекса в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help='Сколько товаров сгенерировать')
+        parser.add_argument('--iterations', type=int, default=5, help='Повторов каждого запроса')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        results = {}
+        with test_database():
+            seed_store(products=options['products'], users=5, orders=0)
+            backends = ['fts5', 'python'] if search.fts_available() else ['python']
+            for backend in backends:
+                with override_settings(SEARCH_BACKEND=backend):
+                    results[backend] = self._run(iterations)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f"{'индекс':<8} {'запрос':<9} {'запросов':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+        for backend, rows in results.items():
+            for name, row in rows.items():
+                if name == 'build_ms':
+                    self.stdout.write(f"{backend:<8} {'сборка':<9} {'':>9} {row:>9}")
+                    continue
+                self.stdout.write(
+                    f"{backend:<8} {name:<9} {row['queries']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}"
+                )
+
+    def _run(self, iterations):
+        client = Client()
+        result = {}
+        if search.fts_available():
+            build_ms = 0
+        else:
+            # Индекс в памяти строится при первом запросе — замеряем отдельно
+            search._fallback.reset()
+            start = time.perf_counter()
+            search._fallback.search(['x'])
+            build_ms = round((time.perf_counter() - start) * 1000, 2)
+        result['build_ms'] = build_ms
+
+        catalog = Sample()
+        suggest = Sample()
+        for _ in range(iterations):
+            for query in QUERIES:
+                # Каталог без кэша фрагментов — замеряется сам поиск
+                cache.clear()
+                with catalog.measure():
+                    client.get('/catalog/', {'q': query})
+                with suggest.measure():
+                    client.get('/api/search/suggest', {'q': query})
+        result['catalog'] = catalog.summary()
+        result['suggest'] = suggest.summary()
+        return result
@@ -0,0 +1,143 @@
+# main/management/commands/bench_views.py
+import json
+import platform
+from datetime import datetime
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+
+from main.bench import Sample, peak_memory, test_database
+from main.models import Product
+from main.seed import seed_store, SEED_PASSWORD
+
+ADMIN_CHANGELISTS = ['order', 'product', 'category', 'userprofile', 'usersession']
+
+
+class Endpoint:
+    """Замеряемый запрос: request() выполняется под замером, prepare() — перед ним"""
+
+    def __init__(self, name, request, prepare=None):
+        self.name = name
+        self.request = request
+        self.prepare = prepare or (lambda: None)
+
+
+class Command(BaseCommand):
+    help = ('Замер представлений через тестовый клиент на синтетических данных: '
+            'число запросов, перцентили времени и пик памяти; отчёт в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Повторов на каждую точку')
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--only', default='', help='Замерить только эти точки (через запятую)')
+        parser.add_argument('--output', help='Куда записать JSON-отчёт')
+        parser.add_argument('--compare', help='Предыдущий JSON-отчёт для сравнения')
+
+    def handle(self, *args, **options):
+        only = {name.strip() for name in options['only'].split(',') if name.strip()}
+        with test_database():
+            dataset = seed_store(products=options['products'], orders=options['orders'], users=options['users'])
+            endpoints = [e for e in self._endpoints() if not only or e.name in only]
+            results = {e.name: self._measure(e, options['iterations']) for e in endpoints}
+
+        report = {
+            'meta': {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'iterations': options['iterations'],
+                'dataset': dataset,
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+            },
+            'endpoints': results,
+        }
+        self._print(results)
+        if options['compare']:
+            self._compare(options['compare'], results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Отчёт записан в {options['output']}"))
+
+    def _endpoints(self):
+        customer = User.objects.annotate(n=Count('order')).order_by('-n').first()
+        User.objects.create_superuser('bench-admin', 'admin@example.com', 'bench')
+        products = list(Product.objects.filter(in_stock=True, stock__gte=100).order_by('id')[:10])
+        if len(products) < 10:
+            raise CommandError('Недостаточно товаров для замеров — увеличьте --products')
+        cart = {str(p.id): 1 for p in products}
+
+        anonymous = Client()
+        customer_client = Client()
+        customer_client.login(username=customer.username, password=SEED_PASSWORD)
+        admin_client = Client()
+        admin_client.login(username='bench-admin', password='bench')
+
+        def fill_cart():
+            session = customer_client.session
+            session['cart'] = cart
+            session.save()
+
+        def post_json(client, url, data):
+            return lambda: client.post(url, json.dumps(data), content_type='application/json')
+
+        endpoints = [
+            Endpoint('catalog', lambda: anonymous.get('/catalog/')),
+            Endpoint('catalog_cold', lambda: anonymous.get('/catalog/?sort=price'), prepare=cache.clear),
+            Endpoint('product_detail', lambda: anonymous.get(f'/product/{products[0].slug}/')),
+            Endpoint('cart', lambda: customer_client.get('/cart/'), prepare=fill_cart),
+            Endpoint('profile', lambda: customer_client.get('/profile/')),
+            Endpoint('api_cart_add', post_json(customer_client, '/api/cart/add',
+                                               {'product_id': products[0].id, 'delta': 1}), prepare=fill_cart),
+            Endpoint('api_checkout', post_json(customer_client, '/api/checkout', {'password': SEED_PASSWORD}),
+                     prepare=fill_cart),
+        ]
+        for model in ADMIN_CHANGELISTS:
+            endpoints.append(Endpoint(f'admin_{model}_changelist',
+                                      lambda model=model: admin_client.get(f'/admin/main/{model}/')))
+        return endpoints
+
+    def _measure(self, endpoint, iterations):
+        sample = Sample()
+        statuses = set()
+        for _ in range(iterations):
+            endpoint.prepare()
+            with sample.measure():
+                response = endpoint.request()
+            statuses.add(response.status_code)
+        endpoint.prepare()
+        result = sample.summary()
+        result['peak_kb'] = round(peak_memory(endpoint.request) / 1024, 1)
+        result['status'] = sorted(statuses)
+        return result
+
+    def _print(self, results):
+        self.stdout.write(f"{'точка':<32} {'запр.':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'пик, КБ':>9}")
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<32} {row['queries']:>6} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+                f"{row['p99_ms']:>9} {row['peak_kb']:>9}"
+            )
+
+    def _compare(self, path, results):
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)['endpoints']
+        self.stdout.write(f'\nСравнение с {path}:')
+        for name, row in results.items():
+            old = baseline.get(name)
+            if not old:
+                self.stdout.write(f'{name:<32} нет в базовом отчёте')
+                continue
+            parts = []
+            for key in ('queries', 'p50_ms', 'p99_ms', 'peak_kb'):
+                before, after = old.get(key, 0), row[key]
+                change = f'{(after - before) / before * 100:+.0f}%' if before else 'н/д'
+                parts.append(f'{key} {before} → {after} ({change})')
+            self.stdout.write(f'{name:<32} ' + '; '.join(parts))
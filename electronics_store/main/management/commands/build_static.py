@@ -0,0 +1,50 @@
+# main/management/commands/build_static.py
+import json
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Собрать статику в STATIC_ROOT: хеш в именах, минификация CSS/JS, '
+            'сжатые копии .gz/.br — и вывести экономию в байтах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Очистить STATIC_ROOT перед сборкой')
+        parser.add_argument('--top', type=int, default=10, help='Сколько файлов с наибольшей экономией показать')
+        parser.add_argument('--json', action='store_true', help='Вывести сводку в JSON')
+
+    def handle(self, *args, **options):
+        if not hasattr(staticfiles_storage, 'report'):
+            raise CommandError("STORAGES['staticfiles'] должен быть main.staticfiles.CompressedManifestStaticFilesStorage")
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        report = staticfiles_storage.report()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        totals = report['totals']
+        files = sorted(report['files'], key=lambda f: f['original'] - f['gzip'], reverse=True)
+        self.stdout.write(f'{"файл":<48} {"исходный":>10} {"минифиц.":>10} {"gzip":>10}'
+                          + (f' {"br":>10}' if report['brotli'] else ''))
+        for f in files[:options['top']]:
+            self.stdout.write(f'{f["name"][:48]:<48} {f["original"]:>10} {f["minified"]:>10} {f["gzip"]:>10}'
+                              + (f' {f["br"]:>10}' if report['brotli'] else ''))
+        if not totals['original']:
+            self.stdout.write(self.style.WARNING('Нет текстовых файлов для сжатия'))
+            return
+        best = totals['br'] if report['brotli'] else totals['gzip']
+
+        def percent(size):
+            return 100 * (1 - size / totals['original'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов: {len(files)}; исходный размер {totals["original"]} Б, '
+            f'после минификации {totals["minified"]} Б (-{percent(totals["minified"]):.1f}%), '
+            f'gzip {totals["gzip"]} Б (-{percent(totals["gzip"]):.1f}%)'
+            + (f', br {totals["br"]} Б (-{percent(totals["br"]):.1f}%)' if report['brotli']
+               else '; brotli не установлен — только gzip')
+            + f'. Экономия на передаче: {totals["original"] - best} Б'
+        ))
@@ -0,0 +1,87 @@
+# main/management/commands/compact_stock.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from main.models import Product, StockMovement
+from main.stock import record
+
+
+class Command(BaseCommand):
+    help = ('Свернуть старые движения журнала склада в одну строку на товар и сверить '
+            'сумму движений с Product.stock')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Движения старше стольких дней сворачиваются')
+        parser.add_argument('--batch-size', type=int, default=500, help='Товаров в одной транзакции')
+        parser.add_argument('--verify', action='store_true',
+                            help='Только сверить остатки с журналом и вывести расхождения, ничего не изменяя')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        verify = options['verify']
+        checked = compacted = mismatched = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # Остатки и журнал пачки читаются в одной транзакции; строки
+                # товаров заблокированы, пока пачка сворачивается
+                products = dict(
+                    Product.objects.select_for_update().filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'stock')[:batch_size]
+                )
+                if not products:
+                    break
+                last_id = max(products)
+                if not verify:
+                    compacted += self._compact(products, cutoff)
+                mismatched += self._reconcile(products, verify)
+                checked += len(products)
+
+        if verify:
+            if mismatched:
+                raise CommandError(f'Расхождений: {mismatched} из {checked} товаров')
+            self.stdout.write(self.style.SUCCESS(f'Проверено товаров: {checked}, расхождений нет'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Проверено товаров: {checked}, свёрнуто движений: {compacted}, исправлено остатков: {mismatched}'
+            ))
+
+    def _compact(self, products, cutoff):
+        """Заменить движения до cutoff одной строкой с их суммой на товар"""
+        old = StockMovement.objects.filter(product_id__in=products.keys(), created_at__lt=cutoff)
+        rows = list(
+            old.values('product_id').annotate(total=Sum('delta'), n=Count('id')).filter(n__gt=1)
+            .values_list('product_id', 'total', 'n')
+        )
+        if not rows:
+            return 0
+        old.filter(product_id__in=[pid for pid, _, _ in rows]).delete()
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=pid, delta=total, reason=StockMovement.COMPACTION, created_at=cutoff)
+            for pid, total, _ in rows if total
+        ])
+        return sum(n for _, _, n in rows)
+
+    def _reconcile(self, products, verify):
+        """Сверить Product.stock с суммой журнала; расхождение — это изменение
+        остатка в обход main/stock.py, оно дописывается в журнал как сверка"""
+        totals = dict(
+            StockMovement.objects.filter(product_id__in=products.keys())
+            .values('product_id').annotate(total=Sum('delta')).values_list('product_id', 'total')
+        )
+        fixes = []
+        for pid, stock in products.items():
+            total = totals.get(pid, 0)
+            if total != stock:
+                if verify:
+                    self.stdout.write(f'Товар #{pid}: остаток {stock}, по журналу {total}')
+                fixes.append((pid, stock - total, None))
+        if fixes and not verify:
+            record(fixes, StockMovement.CORRECTION)
+        return len(fixes)
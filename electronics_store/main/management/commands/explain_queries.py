@@ -0,0 +1,127 @@
+# main/management/commands/explain_queries.py
+import re
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+
+from main.bench import test_database
+from main.models import Category, Product
+from main.seed import seed_store
+
+# Таблицы, полный просмотр которых на больших данных недопустим
+LARGE_TABLES = ('main_product', 'main_order', 'main_orderitem', 'main_usersession')
+
+
+class QueryCollector:
+    """execute_wrapper: запоминает SELECT-запросы вместе с параметрами"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN для запросов каждого представления на больших синтетических данных; ошибка при полном сканировании'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--verbose-plans', action='store_true', help='Печатать план каждого запроса')
+        parser.add_argument('--no-fail', action='store_true', help='Не завершаться ошибкой при найденных сканированиях')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'EXPLAIN не поддерживается для {connection.vendor}')
+
+        with test_database():
+            seed_store(products=options['products'], orders=options['orders'], users=options['users'])
+            problems = self._check_all(options['verbose_plans'])
+
+        if problems:
+            self.stdout.write(self.style.ERROR(f'Найдено полных сканирований: {len(problems)}'))
+            for scenario, sql, line in problems:
+                self.stdout.write(f'  [{scenario}] {line}\n      {sql[:200]}')
+            if not options['no_fail']:
+                raise CommandError('Планы запросов содержат полное сканирование больших таблиц')
+        else:
+            self.stdout.write(self.style.SUCCESS('Полных сканирований больших таблиц не найдено'))
+
+    def _scenarios(self):
+        """(название, клиент, URL) для каждого проверяемого представления"""
+        customer = User.objects.annotate(n=Count('order')).order_by('-n').first()
+        admin = User.objects.create_superuser('explain-admin', 'admin@example.com', 'explain')
+        category = Category.objects.annotate(n=Count('products')).order_by('-n').first()
+        products = list(Product.objects.filter(in_stock=True).order_by('id')[:10])
+
+        anonymous = Client()
+        customer_client = Client()
+        customer_client.force_login(customer)
+        session = customer_client.session
+        session['cart'] = {str(p.id): 1 for p in products}
+        session.save()
+        admin_client = Client()
+        admin_client.force_login(admin)
+
+        scenarios = []
+        for sort in ('new', 'year', 'name', 'price'):
+            scenarios.append((f'catalog sort={sort}', anonymous, f'/catalog/?sort={sort}'))
+            scenarios.append((f'catalog category sort={sort}', anonymous,
+                              f'/catalog/?sort={sort}&category={category.slug}'))
+        scenarios += [
+            ('product_detail', anonymous, f'/product/{products[0].slug}/'),
+            ('cart', customer_client, '/cart/'),
+            ('profile', customer_client, '/profile/'),
+            ('admin order changelist', admin_client, '/admin/main/order/'),
+            ('admin product changelist', admin_client, '/admin/main/product/'),
+        ]
+        return scenarios
+
+    def _check_all(self, verbose):
+        problems = []
+        for name, client, url in self._scenarios():
+            urls = [url]
+            if url.startswith('/catalog/'):
+                # Вторая страница — проверка условия keyset-пагинации
+                cache.clear()
+                match = re.search(r'href="\?([^"]*cursor=[^"]*)"', client.get(url).content.decode())
+                if match:
+                    urls.append('/catalog/?' + match.group(1).replace('&amp;', '&'))
+            for page_url in urls:
+                cache.clear()
+                collector = QueryCollector()
+                with connection.execute_wrapper(collector):
+                    response = client.get(page_url)
+                if response.status_code != 200:
+                    raise CommandError(f'{page_url}: HTTP {response.status_code}')
+                self.stdout.write(f'{name} {page_url}: запросов {len(collector.queries)}')
+                for sql, params in collector.queries:
+                    for line in self._explain(sql, params):
+                        if verbose:
+                            self.stdout.write(f'    {line}')
+                        if self._is_full_scan(line):
+                            problems.append((name, sql, line))
+        return problems
+
+    def _explain(self, sql, params):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def _is_full_scan(self, line):
+        for table in LARGE_TABLES:
+            if connection.vendor == 'sqlite':
+                if re.match(rf'SCAN {table}\b', line) and 'USING' not in line:
+                    return True
+            elif re.search(rf'Seq Scan on {table}\b', line):
+                return True
+        return False
@@ -0,0 +1,58 @@
+# main/management/commands/export_data.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import export
+from main.db_router import read_only
+from main.models import Order, Product
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Дата должна быть в формате ГГГГ-ММ-ДД: {value}')
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгрузить заказы (с позициями) или товары в CSV/JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('orders', 'products'), help='Что выгружать')
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--output', '-o', default='-', help='Файл; «-» — стандартный вывод')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE,
+                            help='Строк, читаемых из БД за раз')
+        parser.add_argument('--from', dest='date_from', help='Заказы с этой даты, ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='date_to', help='Заказы по эту дату включительно, ГГГГ-ММ-ДД')
+        parser.add_argument('--status', choices=[value for value, _ in Order.STATUS_CHOICES],
+                            help='Заказы в этом статусе')
+        parser.add_argument('--category', help='Товары категории (слаг)')
+        parser.add_argument('--in-stock', choices=('yes', 'no'), help='Только товары в наличии / не в наличии')
+        parser.add_argument('--bom', action='store_true', help='BOM в начале CSV (для Excel)')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным')
+        # Выгрузка только читает — долгий запрос можно выполнить на реплике
+        if options['kind'] == 'orders':
+            queryset = export.filter_orders(
+                read_only(Order.objects.all()),
+                date_from=_date(options['date_from']) if options['date_from'] else None,
+                date_to=_date(options['date_to']) if options['date_to'] else None,
+                status=options['status'],
+            )
+        else:
+            in_stock = {'yes': True, 'no': False}.get(options['in_stock'])
+            queryset = export.filter_products(read_only(Product.objects.all()), options['category'], in_stock)
+
+        chunks = export.stream(queryset, options['format'], options['chunk_size'], bom=options['bom'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        # newline='' — переводы строк CSV (\r\n) записываются как есть
+        with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+            f.writelines(chunks)
+        self.stderr.write(self.style.SUCCESS(f'Выгрузка записана в {options["output"]}'))
@@ -0,0 +1,45 @@
+# main/management/commands/generate_thumbnails.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from main import thumbnails
+from main.models import Product, UserProfile
+
+FIELDS = {
+    'products': (Product, 'image'),
+    'avatars': (UserProfile, 'avatar'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Построить уменьшенные копии фото товаров и аватаров (WebP/JPEG нескольких ширин)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=sorted(FIELDS), help='Только товары или только аватары')
+        parser.add_argument('--all', action='store_true',
+                            help='Перестроить и те, у которых копии уже есть (например, после смены ширин)')
+
+    def handle(self, *args, **options):
+        names = [options['only']] if options['only'] else list(FIELDS)
+        start = time.perf_counter()
+        built = failed = 0
+        for name in names:
+            model, field_name = FIELDS[name]
+            rows = (
+                model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list('pk', field_name, thumbnails.thumbnails_field(field_name))
+                .iterator(chunk_size=500)
+            )
+            for pk, image, current in rows:
+                if not options['all'] and (current or {}).get('source') == image:
+                    continue
+                try:
+                    thumbnails.generate(model, pk, field_name, image)
+                    built += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{name} #{pk} ({image}): {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Построено: {built}, ошибок: {failed} за {time.perf_counter() - start:.1f} с'
+        ))
@@ -0,0 +1,53 @@
+# main/management/commands/purge_carts.py
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from main.cart import COOKIE_MAX_AGE
+from main.models import CartItem
+
+
+class Command(BaseCommand):
+    help = 'Удалить строки корзин (CART_STORAGE = "db"), не менявшихся дольше N дней — небольшими пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=COOKIE_MAX_AGE // (60 * 60 * 24),
+                            help='Сколько дней хранить корзину после последнего изменения '
+                                 '(по умолчанию — срок жизни её cookie)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Корзин в одном DELETE')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Пауза между пачками, секунд: даёт пройти запросам сайта')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удаляя')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days и --batch-size должны быть положительными')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Корзина брошена, если не менялась ни одна её позиция: updated_at
+        # обновляется только у изменённой строки, поэтому сравнивается максимум
+        stale = (CartItem.objects.values('cart_key').annotate(last_change=Max('updated_at'))
+                 .filter(last_change__lt=cutoff).values_list('cart_key', flat=True))
+
+        if options['dry_run']:
+            self.stdout.write(f'Будет удалено корзин: {stale.count()} (изменены до {cutoff:%d.%m.%Y})')
+            return
+
+        carts = rows = 0
+        while True:
+            # Каждая пачка — отдельный короткий DELETE в автокоммите: таблица
+            # блокируется на время одной пачки, а не всей очистки
+            keys = list(stale.order_by('cart_key')[:options['batch_size']])
+            if not keys:
+                break
+            count, _ = CartItem.objects.filter(cart_key__in=keys).delete()
+            carts += len(keys)
+            rows += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  удалено корзин {carts}')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено корзин: {carts}, позиций: {rows} (изменены до {cutoff:%d.%m.%Y})'))
@@ -0,0 +1,45 @@
+# main/management/commands/purge_sessions.py
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.models import UserSession
+
+
+class Command(BaseCommand):
+    help = 'Удалить записи сессий пользователей без активности дольше N дней — небольшими пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Сколько дней хранить сессии после последней активности')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Строк в одном DELETE')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Пауза между пачками, секунд: даёт пройти запросам сайта')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удаляя')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days и --batch-size должны быть положительными')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Выборка по индексу usersession_activity_idx
+        stale = UserSession.objects.filter(last_activity__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f'Будет удалено сессий: {stale.count()} (активность до {cutoff:%d.%m.%Y})')
+            return
+
+        deleted = 0
+        while True:
+            # Каждая пачка — отдельный короткий DELETE в автокоммите: таблица
+            # блокируется на время одной пачки, а не всей очистки
+            ids = list(stale.order_by('last_activity').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            count, _ = UserSession.objects.filter(id__in=ids).delete()
+            deleted += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  удалено {deleted}')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий: {deleted} (активность до {cutoff:%d.%m.%Y})'))
@@ -0,0 +1,39 @@
+# main/management/commands/seed_store.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.seed import seed_store, SEED_PASSWORD
+
+
+class Command(BaseCommand):
+    help = 'Заполнить БД синтетическими категориями, товарами, пользователями и заказами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней раскидать даты заказов')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        created = seed_store(
+            categories=options['categories'],
+            products=options['products'],
+            users=options['users'],
+            orders=options['orders'],
+            items_per_order=options['items_per_order'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+        )
+        elapsed = time.perf_counter() - start
+        for name, count in created.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f} с. Пароль сгенерированных пользователей: {SEED_PASSWORD}'
+        ))
@@ -0,0 +1,53 @@
+# main/management/commands/sync_order_totals.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.models import Order
+from main.order_totals import calculate
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать хранимые итоги заказов (количество товаров и сумму) пачками или только проверить их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Заказов в одной транзакции')
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить и вывести расхождения, ничего не изменяя')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        verify = options['verify']
+        checked = mismatched = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # Заказы пачки блокируются, пока их итоги сверяются и исправляются
+                rows = list(
+                    Order.objects.select_for_update().filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'items_count', 'total_price')[:batch_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                expected = calculate([order_id for order_id, _, _ in rows])
+                fixes = []
+                for order_id, items_count, total_price in rows:
+                    count, total = expected[order_id]
+                    if (items_count, total_price) != (count, total):
+                        mismatched += 1
+                        if verify:
+                            self.stdout.write(
+                                f'Заказ #{order_id}: хранится {items_count} шт. / {total_price} ₽, '
+                                f'по позициям {count} шт. / {total} ₽'
+                            )
+                        fixes.append(Order(id=order_id, items_count=count, total_price=total))
+                if fixes and not verify:
+                    Order.objects.bulk_update(fixes, ['items_count', 'total_price'], batch_size=batch_size)
+                checked += len(rows)
+
+        if verify:
+            if mismatched:
+                raise CommandError(f'Расхождений: {mismatched} из {checked} заказов')
+            self.stdout.write(self.style.SUCCESS(f'Проверено заказов: {checked}, расхождений нет'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Проверено заказов: {checked}, исправлено: {mismatched}'))
@@ -0,0 +1,42 @@
+# main/management/commands/sync_replica.py
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from main.db_router import REPLICA
+
+
+class Command(BaseCommand):
+    help = 'Скопировать основную БД SQLite в файл реплики (замена репликации для локальной проверки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 — скопировать один раз)')
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.settings:
+            raise CommandError('Реплика не настроена: задайте DB_REPLICA — путь к её файлу')
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        target = connections[REPLICA].settings_dict['NAME']
+        if str(source) == str(target):
+            raise CommandError('Реплика указывает на файл основной БД')
+        while True:
+            start = time.perf_counter()
+            self._copy(source, target)
+            self.stdout.write(f'{source} → {target}: {(time.perf_counter() - start) * 1000:.0f} мс')
+            if options['interval'] <= 0:
+                return
+            time.sleep(options['interval'])
+
+    def _copy(self, source, target):
+        # Онлайн-копия через backup API: согласованный снимок без остановки
+        # записи в основную БД; читатели реплики видят её целиком до или после
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        dst = sqlite3.connect(target, timeout=30)
+        try:
+            primary.connection.backup(dst)
+        finally:
+            dst.close()
@@ -0,0 +1,193 @@
+# main/metrics.py
+"""Гистограммы метрик запросов по имени URL.
+
+Хранятся в памяти процесса: при нескольких воркерах у каждого свои
+значения, как у обычного Prometheus-клиента без multiprocess-режима.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template import base as template_base
+
+# Границы корзин гистограмм для каждой метрики
+BUCKETS = {
+    'queries': (1, 2, 5, 10, 20, 50, 100, 200, 500),
+    'db_ms': (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+    'template_ms': (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+    'duration_ms': (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+    'response_bytes': (1024, 5120, 10240, 51200, 102400, 512000, 1048576, 5242880),
+}
+
+DESCRIPTIONS = {
+    'queries': 'SQL-запросов за запрос',
+    'db_ms': 'Суммарное время SQL-запросов, мс',
+    'template_ms': 'Время рендеринга шаблонов, мс',
+    'duration_ms': 'Полное время обработки запроса, мс',
+    'response_bytes': 'Размер тела ответа, байт',
+}
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя корзина — +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """[(граница, число наблюдений <= граница), ...] включая +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+_lock = threading.Lock()
+_histograms = {}  # {view_name: {metric: Histogram}}
+_counters = {}  # {name: value} — счётчики вне привязки к URL (попадания в кэш и т.п.)
+_gauges = {}  # {name: value} — текущие значения (длина очереди и т.п.)
+
+
+def observe(view_name, **values):
+    """Учесть значения метрик одного запроса"""
+    with _lock:
+        per_view = _histograms.get(view_name)
+        if per_view is None:
+            per_view = _histograms[view_name] = {name: Histogram(b) for name, b in BUCKETS.items()}
+        for name, value in values.items():
+            per_view[name].observe(value)
+
+
+def inc(name, value=1):
+    """Увеличить счётчик"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def set_gauge(name, value):
+    """Запомнить текущее значение показателя"""
+    with _lock:
+        _gauges[name] = value
+
+
+def gauges():
+    with _lock:
+        return dict(_gauges)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def snapshot():
+    """Копия агрегатов для JSON: {view: {metric: {count, sum, avg, buckets}}}"""
+    with _lock:
+        return {
+            view: {
+                name: {
+                    'count': h.count,
+                    'sum': round(h.sum, 3),
+                    'avg': round(h.sum / h.count, 3) if h.count else 0,
+                    'buckets': {str(bound): count for bound, count in h.cumulative()},
+                }
+                for name, h in per_view.items()
+            }
+            for view, per_view in sorted(_histograms.items())
+        }
+
+
+def render_prometheus(prefix='store_request'):
+    """Текстовый формат экспозиции Prometheus"""
+    lines = []
+    with _lock:
+        for name in BUCKETS:
+            metric = f'{prefix}_{name}'
+            lines.append(f'# HELP {metric} {DESCRIPTIONS[name]}')
+            lines.append(f'# TYPE {metric} histogram')
+            for view, per_view in sorted(_histograms.items()):
+                h = per_view[name]
+                label = view.replace('\\', '\\\\').replace('"', '\\"')
+                for bound, count in h.cumulative():
+                    lines.append(f'{metric}_bucket{{view="{label}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{view="{label}"}} {round(h.sum, 3)}')
+                lines.append(f'{metric}_count{{view="{label}"}} {h.count}')
+        for name, value in sorted(_counters.items()):
+            lines.append(f'# TYPE store_{name}_total counter')
+            lines.append(f'store_{name}_total {value}')
+        for name, value in sorted(_gauges.items()):
+            lines.append(f'# TYPE store_{name} gauge')
+            lines.append(f'store_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Время рендеринга шаблонов: Template.render оборачивается один раз, а
+# время копится только для запроса, внутри которого включён track_templates()
+_template_timer = ContextVar('template_timer', default=None)
+_template_depth = ContextVar('template_depth', default=0)
+_instrumented = False
+
+
+class TemplateTimer:
+    def __init__(self):
+        self.seconds = 0.0
+
+
+def instrument_templates():
+    """Обернуть Template.render для замера времени (однократно)"""
+    global _instrumented
+    if _instrumented:
+        return
+    original = template_base.Template.render
+
+    def render(self, context):
+        timer = _template_timer.get()
+        depth = _template_depth.get()
+        if timer is None or depth:
+            # Вложенные include уже учтены во внешнем шаблоне
+            token = _template_depth.set(depth + 1)
+            try:
+                return original(self, context)
+            finally:
+                _template_depth.reset(token)
+        token = _template_depth.set(1)
+        start = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            timer.seconds += time.perf_counter() - start
+            _template_depth.reset(token)
+
+    template_base.Template.render = render
+    _instrumented = True
+
+
+@contextmanager
+def track_templates():
+    timer = TemplateTimer()
+    token = _template_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _template_timer.reset(token)
@@ -0,0 +1,235 @@
+# main/middleware.py
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import connections
+
+from . import db_router, metrics
+from .activity import recorder
+
+logger = logging.getLogger('main.metrics')
+
+DEFAULT_METRICS_SETTINGS = {
+    'SLOW_QUERY_COUNT': 30,   # запросов к БД за один HTTP-запрос
+    'SLOW_REQUEST_MS': 500,   # полное время обработки
+    'LOG_SQL_LIMIT': 10,      # сколько SQL выводить в лог
+}
+
+
+class QueryRecorder:
+    """execute_wrapper: считает запросы и их время для текущего HTTP-запроса"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []  # (sql, секунды)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            self.statements.append((sql, elapsed))
+
+
+class QueryMetricsMiddleware:
+    """Метрики по каждому имени URL: число SQL-запросов, время БД и шаблонов,
+    размер ответа. Медленные запросы логируются вместе с SQL.
+
+    Работает и в синхронной, и в асинхронной цепочке middleware."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = {**DEFAULT_METRICS_SETTINGS, **getattr(settings, 'REQUEST_METRICS', {})}
+        metrics.instrument_templates()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        stack = self._install(recorder)
+        try:
+            with metrics.track_templates() as timer:
+                response = self.get_response(request)
+        except BaseException:
+            stack.close()
+            raise
+        if response.streaming:
+            self._observe_streaming(request, response, stack, recorder, timer, start)
+        else:
+            stack.close()
+            self._observe(request, recorder, timer, start, len(response.content))
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        # Асинхронный ORM выполняет SQL в потоке sync_to_async, а соединения у
+        # каждого потока свои, поэтому обёртки ставятся в этом же потоке
+        stack = await sync_to_async(self._install)(recorder)
+        try:
+            with metrics.track_templates() as timer:
+                response = await self.get_response(request)
+        except BaseException:
+            await sync_to_async(stack.close)()
+            raise
+        if response.streaming:
+            self._observe_streaming(request, response, stack, recorder, timer, start)
+        else:
+            await sync_to_async(stack.close)()
+            self._observe(request, recorder, timer, start, len(response.content))
+        return response
+
+    def _install(self, recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def _observe_streaming(self, request, response, stack, recorder, timer, start):
+        """Потоковый ответ (выгрузки) читает БД, пока отдаётся тело: обёртки
+        снимаются и метрики пишутся, когда тело отдано или ответ закрыт"""
+        def finish(size):
+            stack.close()
+            self._observe(request, recorder, timer, start, size)
+
+        if response.is_async:
+            async def content(chunks):
+                size = 0
+                try:
+                    async for chunk in chunks:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    await sync_to_async(finish)(size)
+        else:
+            def content(chunks):
+                size = 0
+                try:
+                    for chunk in chunks:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    finish(size)
+        response.streaming_content = content(response.streaming_content)
+
+    def _observe(self, request, recorder, timer, start, size):
+        duration_ms = (time.perf_counter() - start) * 1000
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        metrics.observe(
+            view_name,
+            queries=recorder.count,
+            db_ms=recorder.seconds * 1000,
+            template_ms=timer.seconds * 1000,
+            duration_ms=duration_ms,
+            response_bytes=size,
+        )
+
+        if recorder.count > self.options['SLOW_QUERY_COUNT'] or duration_ms > self.options['SLOW_REQUEST_MS']:
+            self._log_slow(request, view_name, recorder, duration_ms)
+
+    def _log_slow(self, request, view_name, recorder, duration_ms):
+        limit = self.options['LOG_SQL_LIMIT']
+        # Повторяющиеся SQL — признак N+1, самые долгие — кандидаты на индекс
+        repeated = Counter(sql for sql, _ in recorder.statements).most_common(limit)
+        slowest = sorted(recorder.statements, key=lambda s: s[1], reverse=True)[:limit]
+        lines = [f'  x{count}: {sql}' for sql, count in repeated if count > 1]
+        lines += [f'  {elapsed * 1000:.1f} мс: {sql}' for sql, elapsed in slowest]
+        logger.warning(
+            'Медленный запрос %s %s (%s): %d SQL, БД %.1f мс, всего %.1f мс\n%s',
+            request.method, request.path, view_name, recorder.count,
+            recorder.seconds * 1000, duration_ms, '\n'.join(lines),
+        )
+
+
+class SessionActivityMiddleware:
+    """Отмечает активность сессии вошедшего пользователя в буфере
+    main/activity.py — без запроса к БД.
+
+    Учитываются только запросы, которые и так прочитали сессию: загружать
+    её ради отметки активности не нужно."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self._touch(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self._touch(request)
+        return response
+
+    def _touch(self, request):
+        session = getattr(request, 'session', None)
+        if session is None or not session.accessed or not session.session_key:
+            return
+        user_id = session.get(SESSION_KEY)
+        if user_id is not None:
+            recorder.touch(int(user_id), session.session_key)
+
+
+class DatabaseRoutingMiddleware:
+    """Состояние маршрутизации БД для запроса (main/db_router.py): безопасные
+    запросы читают с реплики, после записи пользователь на STICKY_SECONDS
+    закрепляется за основной БД cookie с отметкой времени.
+
+    Работает и в синхронной, и в асинхронной цепочке middleware."""
+    sync_capable = True
+    async_capable = True
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with db_router.activate(self._state(request)) as state:
+            response = self.get_response(request)
+        return self._finish(response, state)
+
+    async def __acall__(self, request):
+        with db_router.activate(self._state(request)) as state:
+            response = await self.get_response(request)
+        return self._finish(response, state)
+
+    def _state(self, request):
+        config = db_router.get_config()
+        try:
+            pinned = float(request.COOKIES.get(config['COOKIE_NAME'], 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return db_router.RequestState(replica=request.method in self.SAFE_METHODS and not pinned)
+
+    def _finish(self, response, state):
+        if state.wrote:
+            config = db_router.get_config()
+            seconds = config['STICKY_SECONDS']
+            response.set_cookie(config['COOKIE_NAME'], f'{time.time() + seconds:.0f}', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_catalog_and_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_key', models.CharField(max_length=32, verbose_name='Ключ корзины')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Кол-во')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменена')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Позиция корзины',
+                'verbose_name_plural': 'Позиции корзин',
+                'unique_together': {('cart_key', 'product')},
+            },
+        ),
+    ]
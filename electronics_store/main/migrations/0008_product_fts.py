@@ -0,0 +1,45 @@
+from django.db import migrations
+
+FTS_TABLE = 'main_product_fts'
+
+
+def normalize(text):
+    # Та же нормализация, что в main/search.py
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def create_fts_table(apps, schema_editor):
+    """Таблица FTS5 для поиска товаров (только SQLite со сборкой FTS5)"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            f"name, model, country, category, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        Product = apps.get_model('main', 'Product')
+        rows = Product.objects.values_list('id', 'name', 'model', 'country', 'category__name')
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, model, country, category) VALUES (%s, %s, %s, %s, %s)',
+            [(pid, *(normalize(value) for value in fields)) for pid, *fields in rows],
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_cartitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
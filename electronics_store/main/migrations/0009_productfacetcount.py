@@ -0,0 +1,50 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:09
+
+import django.db.models.deletion
+from bisect import bisect_right
+from collections import Counter
+
+from django.db import migrations, models
+
+# Те же границы, что main.facets.PRICE_BUCKETS на момент миграции
+PRICE_BUCKETS = (0, 5000, 10000, 20000, 50000, 100000, 200000)
+
+
+def fill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductFacetCount = apps.get_model('main', 'ProductFacetCount')
+    counter = Counter(
+        (category_id, country, year, bisect_right(PRICE_BUCKETS, price) - 1)
+        for category_id, country, year, price in
+        Product.objects.filter(in_stock=True).values_list('category_id', 'country', 'year', 'price').iterator()
+    )
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_id=category_id, country=country, year=year, price_bucket=bucket, count=n)
+        for (category_id, country, year, bucket), n in counter.items()
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_product_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100, verbose_name='Страна-производитель')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='Год выпуска')),
+                ('price_bucket', models.PositiveSmallIntegerField(verbose_name='Ценовой диапазон')),
+                ('count', models.IntegerField(default=0, verbose_name='Товаров')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фасетов',
+                'verbose_name_plural': 'Счётчики фасетов',
+                'unique_together': {('category', 'country', 'year', 'price_bucket')},
+            },
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
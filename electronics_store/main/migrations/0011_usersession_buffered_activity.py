@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:22
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_order_items_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usersession',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата входа'),
+        ),
+        migrations.AlterField(
+            model_name='usersession',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последняя активность'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['last_activity'], name='usersession_activity_idx'),
+        ),
+    ]
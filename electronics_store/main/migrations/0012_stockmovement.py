@@ -0,0 +1,42 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    """Текущие остатки — начальные движения журнала"""
+    Product = apps.get_model('main', 'Product')
+    StockMovement = apps.get_model('main', 'StockMovement')
+    rows = Product.objects.filter(stock__gt=0).values_list('id', 'stock').iterator(chunk_size=1000)
+    StockMovement.objects.bulk_create(
+        (StockMovement(product_id=pid, delta=stock, reason='opening') for pid, stock in rows),
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_usersession_buffered_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField(verbose_name='Изменение')),
+                ('reason', models.CharField(choices=[('opening', 'Начальный остаток'), ('sale', 'Продажа'), ('cancel', 'Отмена заказа'), ('order_delete', 'Удаление заказа'), ('return', 'Возврат на склад'), ('adjustment', 'Корректировка'), ('compaction', 'Свёрнутые движения'), ('correction', 'Сверка с остатком')], max_length=20, verbose_name='Причина')),
+                ('order_number', models.PositiveIntegerField(blank=True, null=True, verbose_name='Номер заказа')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='main.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Движение по складу',
+                'verbose_name_plural': 'Движения по складу',
+                'indexes': [models.Index(fields=['product', 'created_at'], name='stockmove_product_idx'), models.Index(fields=['created_at'], name='stockmove_created_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Копии фото'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Копии аватара'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='День')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('cancelled_orders', models.PositiveIntegerField(default=0, verbose_name='Отменено заказов')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Штук')),
+                ('cancelled_units', models.PositiveIntegerField(default=0, verbose_name='Отменено штук')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('cancelled_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Отменено на сумму')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Штук')),
+                ('cancelled_units', models.PositiveIntegerField(default=0, verbose_name='Отменено штук')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('cancelled_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Отменено на сумму')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='main.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='main.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+                'indexes': [models.Index(fields=['day', 'category'], name='dailyproduct_day_cat_idx')],
+                'unique_together': {('day', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.14 on 2026-10-17 10:05
+
+from django.db import migrations
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+# Те же поля, что main.rollups.PRODUCT_FIELDS на момент миграции
+PRODUCT_FIELDS = ('units', 'cancelled_units', 'revenue', 'cancelled_revenue')
+
+
+def backfill_rollups(apps, schema_editor):
+    """Итоги за все дни по существующим заказам — как rebuild_rollups без --from/--to"""
+    Order = apps.get_model('main', 'Order')
+    OrderItem = apps.get_model('main', 'OrderItem')
+    DailySales = apps.get_model('main', 'DailySales')
+    DailyProductSales = apps.get_model('main', 'DailyProductSales')
+
+    cancelled = Q(order__status='cancelled')
+    line_amount = F('quantity') * F('price')
+    revenue_field = DailyProductSales._meta.get_field('revenue')
+    days = {
+        row['day']: {'orders': row['orders'], 'cancelled_orders': row['cancelled_orders'],
+                     **{field: 0 for field in PRODUCT_FIELDS}}
+        for row in Order.objects.annotate(day=TruncDate('created_at')).values('day')
+        .annotate(orders=Count('id'), cancelled_orders=Count('id', filter=Q(status='cancelled')))
+        .order_by()
+    }
+    products = []
+    rows = (
+        OrderItem.objects.annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id', 'product__category_id')
+        .annotate(
+            units=Sum('quantity'), cancelled_units=Sum('quantity', filter=cancelled),
+            revenue=Sum(line_amount, output_field=revenue_field),
+            cancelled_revenue=Sum(line_amount, filter=cancelled, output_field=revenue_field),
+        )
+        .order_by()
+    )
+    for row in rows.iterator(chunk_size=1000):
+        values = {field: row[field] or 0 for field in PRODUCT_FIELDS}
+        for field, value in values.items():
+            days[row['day']][field] += value
+        products.append(DailyProductSales(day=row['day'], product_id=row['product_id'],
+                                          category_id=row['product__category_id'], **values))
+
+    # Заказы, оформленные после 0014, уже учтены — дни пересчитываются целиком
+    DailySales.objects.all().delete()
+    DailyProductSales.objects.all().delete()
+    DailySales.objects.bulk_create([DailySales(day=day, **values) for day, values in days.items()],
+                                   batch_size=1000)
+    DailyProductSales.objects.bulk_create(products, batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
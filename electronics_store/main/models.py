@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 class Category(models.Model):
     """Категория товара (например, лазерные/струйные/термо принтеры)"""
@@ -25,6 +26,8 @@ class Product(models.Model):
     country = models.CharField(max_length=100, verbose_name="Страна-производитель")
     model = models.CharField(max_length=100, verbose_name="Модель")
     image = models.ImageField(upload_to='products/', blank=True, null=True, verbose_name="Фото")
+    # Уменьшенные копии фото (main/thumbnails.py)
+    image_thumbnails = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Копии фото")
     stock = models.PositiveIntegerField(default=0, verbose_name="Остаток на складе")
     in_stock = models.BooleanField(default=True, verbose_name="В наличии")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Добавлен")
@@ -33,10 +36,170 @@ class Product(models.Model):
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ['-created_at']  # по умолчанию новизна
+        # Каталог показывает только товары в наличии: частичные индексы под
+        # каждую сортировку — для всего каталога и внутри категории
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(in_stock=True), name='product_instock_new_idx'),
+            models.Index(fields=['year', 'id'], condition=models.Q(in_stock=True), name='product_instock_year_idx'),
+            models.Index(fields=['name', 'id'], condition=models.Q(in_stock=True), name='product_instock_name_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(in_stock=True), name='product_instock_price_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], condition=models.Q(in_stock=True), name='product_cat_new_idx'),
+            models.Index(fields=['category', 'year', 'id'], condition=models.Q(in_stock=True), name='product_cat_year_idx'),
+            models.Index(fields=['category', 'name', 'id'], condition=models.Q(in_stock=True), name='product_cat_name_idx'),
+            models.Index(fields=['category', 'price', 'id'], condition=models.Q(in_stock=True), name='product_cat_price_idx'),
+            # Фильтры списка товаров в админке (DISTINCT по значениям)
+            models.Index(fields=['year'], name='product_year_idx'),
+            models.Index(fields=['country'], name='product_country_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class ProductFacetCount(models.Model):
+    """Число товаров в наличии для сочетания значений фасетов каталога.
+
+    Поддерживается инкрементально (main/facets.py) при сохранении и удалении
+    товара и при изменении наличия в main/stock.py.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    country = models.CharField(max_length=100, verbose_name="Страна-производитель")
+    year = models.PositiveSmallIntegerField(verbose_name="Год выпуска")
+    price_bucket = models.PositiveSmallIntegerField(verbose_name="Ценовой диапазон")
+    count = models.IntegerField(default=0, verbose_name="Товаров")
+
+    class Meta:
+        verbose_name = "Счётчик фасетов"
+        verbose_name_plural = "Счётчики фасетов"
+        unique_together = ['category', 'country', 'year', 'price_bucket']
+
+class StockMovement(models.Model):
+    """Движение товара по складу.
+
+    Журнал только дополняется: каждое изменение остатка (main/stock.py)
+    записывается строкой с разницей delta, а Product.stock в той же
+    транзакции меняется на ту же разницу F-выражением. Сумма delta по
+    товару равна его остатку; старые строки сворачивает команда
+    compact_stock.
+    """
+    OPENING = 'opening'
+    SALE = 'sale'
+    CANCEL = 'cancel'
+    ORDER_DELETE = 'order_delete'
+    RETURN = 'return'
+    ADJUSTMENT = 'adjustment'
+    COMPACTION = 'compaction'
+    CORRECTION = 'correction'
+    REASON_CHOICES = [
+        (OPENING, 'Начальный остаток'),
+        (SALE, 'Продажа'),
+        (CANCEL, 'Отмена заказа'),
+        (ORDER_DELETE, 'Удаление заказа'),
+        (RETURN, 'Возврат на склад'),
+        (ADJUSTMENT, 'Корректировка'),
+        (COMPACTION, 'Свёрнутые движения'),
+        (CORRECTION, 'Сверка с остатком'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements', verbose_name="Товар")
+    delta = models.IntegerField(verbose_name="Изменение")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name="Причина")
+    # Не внешний ключ: заказ может быть удалён, а строки журнала не меняются
+    order_number = models.PositiveIntegerField(blank=True, null=True, verbose_name="Номер заказа")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Время")
+
+    class Meta:
+        verbose_name = "Движение по складу"
+        verbose_name_plural = "Движения по складу"
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='stockmove_product_idx'),
+            models.Index(fields=['created_at'], name='stockmove_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.delta:+d} ({self.get_reason_display()})"
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    """Запомнить прежние категорию, slug и значения фасетов товара, чтобы
+    сбросить их кэш и поправить счётчики фасетов"""
+    if instance.pk:
+        previous = Product.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'slug', 'country', 'year', 'price', 'in_stock', 'stock').first()
+        if previous:
+            category_id, instance._previous_slug, country, year, price, in_stock, instance._previous_stock = previous
+            instance._previous_category_id = category_id
+            instance._previous_facet_row = (category_id, country, year, price) if in_stock else None
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog_on_product_change(sender, instance, **kwargs):
+    """Сбросить кэш фрагментов каталога и кэш самого товара после фиксации
+    транзакции: иначе параллельный запрос успеет снова положить в кэш
+    старую строку, и она будет отдаваться до истечения TTL"""
+    from .catalog import invalidate_categories
+    from . import product_cache
+    category_ids = [instance.category_id, getattr(instance, '_previous_category_id', None)]
+    product_ids, slugs = [instance.pk], [instance.slug, getattr(instance, '_previous_slug', None)]
+    transaction.on_commit(lambda: invalidate_categories(category_ids))
+    transaction.on_commit(lambda: product_cache.invalidate(product_ids, slugs=slugs))
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog_on_category_change(sender, instance, **kwargs):
+    """Сбросить кэш списка категорий, страниц категории и товаров (они хранятся
+    с категорией) — тоже после фиксации транзакции"""
+    from .catalog import bump, invalidate_categories, CATEGORIES_SCOPE
+    from . import product_cache
+    category_id = instance.id
+    transaction.on_commit(lambda: bump(CATEGORIES_SCOPE))
+    transaction.on_commit(lambda: invalidate_categories([category_id]))
+    transaction.on_commit(product_cache.invalidate_all)
+
+@receiver(post_save, sender=Product)
+def update_facet_counts_on_save(sender, instance, **kwargs):
+    from . import facets
+    new_row = (instance.category_id, instance.country, instance.year, instance.price) if instance.in_stock else None
+    facets.move(getattr(instance, '_previous_facet_row', None), new_row)
+
+@receiver(post_delete, sender=Product)
+def update_facet_counts_on_delete(sender, instance, **kwargs):
+    from . import facets
+    if instance.in_stock:
+        facets.move((instance.category_id, instance.country, instance.year, instance.price), None)
+
+@receiver(post_save, sender=Product)
+def record_stock_change(sender, instance, created, update_fields=None, **kwargs):
+    """Остаток, заданный при создании или сохранении товара целиком (форма
+    админки, shell), — тоже движение по журналу склада"""
+    if update_fields is not None and 'stock' not in update_fields:
+        return
+    previous = 0 if created else getattr(instance, '_previous_stock', instance.stock)
+    if instance.stock != previous:
+        from . import stock
+        stock.record([(instance.pk, instance.stock - previous, None)],
+                     StockMovement.OPENING if created else StockMovement.ADJUSTMENT)
+
+@receiver(post_save, sender=Product)
+def refresh_product_thumbnails(sender, instance, update_fields=None, **kwargs):
+    from . import thumbnails
+    thumbnails.image_saved(instance, 'image', update_fields)
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Обновить запись товара в поисковом индексе"""
+    from . import search
+    search.index_products([instance])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    from . import search
+    search.remove_product(instance.pk)
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    """Название категории входит в индекс — переиндексировать её товары"""
+    if not created:
+        from . import search
+        search.index_products(instance.products.select_related('category'))
+
 class Order(models.Model):
     """Заказ пользователя"""
     STATUS_CHOICES = [
@@ -51,6 +214,8 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
     total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Сумма")
+    # Итоги по позициям хранятся в заказе и обновляются вместе с ними (main/order_totals.py)
+    items_count = models.PositiveIntegerField(default=0, verbose_name="Кол-во товаров")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new', verbose_name="Статус")
     cancellation_reason = models.TextField(blank=True, null=True, verbose_name="Причина отказа")
 
@@ -58,6 +223,10 @@ class Order(models.Model):
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['-created_at']  # От новых к старым
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),  # заказы в профиле
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),  # список заказов в админке
+        ]
 
     def __str__(self):
         return f"Заказ #{self.id} от {self.created_at.strftime('%d.%m.%Y %H:%M')}"
@@ -67,11 +236,6 @@ class Order(models.Model):
         """Проверка, можно ли удалить заказ (только новые)"""
         return self.status == 'new'
     
-    @property
-    def items_count(self):
-        """Общее количество товаров в заказе"""
-        return sum(item.quantity for item in self.items.all())
-    
     @property
     def customer_full_name(self):
         """Полное имя заказчика"""
@@ -93,6 +257,91 @@ class OrderItem(models.Model):
     def line_total(self):
         return self.price * self.quantity
 
+    def save(self, *args, **kwargs):
+        # Позиция и итоги заказа (сигналы ниже) меняются в одной транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+@receiver(pre_save, sender=OrderItem)
+def remember_order_item(sender, instance, **kwargs):
+    """Запомнить прежние заказ, количество и цену позиции"""
+    if instance.pk:
+        instance._previous_line = OrderItem.objects.filter(pk=instance.pk).values_list(
+            'order_id', 'quantity', 'price').first()
+
+@receiver(post_save, sender=OrderItem)
+def update_order_totals_on_save(sender, instance, **kwargs):
+    from . import order_totals
+    order_totals.line_changed(getattr(instance, '_previous_line', None),
+                              (instance.order_id, instance.quantity, instance.price))
+
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals_on_delete(sender, instance, origin=None, **kwargs):
+    """Вычесть позицию из итогов, если удаляется не сам заказ"""
+    if isinstance(origin, Order) or getattr(origin, 'model', None) is Order:
+        return
+    from . import order_totals
+    order_totals.line_changed((instance.order_id, instance.quantity, instance.price), None)
+
+class DailySales(models.Model):
+    """Продажи за день: заказы, отмены, выручка и штуки.
+
+    День — местная дата создания заказа; отменённый заказ остаётся в своём
+    дне и добавляется в столбцы cancelled_*. Поддерживается инкрементально
+    (main/rollups.py) при оформлении, отмене и удалении заказов, историю
+    пересчитывает команда rebuild_rollups.
+    """
+    day = models.DateField(unique=True, verbose_name="День")
+    orders = models.PositiveIntegerField(default=0, verbose_name="Заказов")
+    cancelled_orders = models.PositiveIntegerField(default=0, verbose_name="Отменено заказов")
+    units = models.PositiveIntegerField(default=0, verbose_name="Штук")
+    cancelled_units = models.PositiveIntegerField(default=0, verbose_name="Отменено штук")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Выручка")
+    cancelled_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Отменено на сумму")
+
+    class Meta:
+        verbose_name = "Продажи за день"
+        verbose_name_plural = "Продажи по дням"
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"Продажи за {self.day:%d.%m.%Y}"
+
+class DailyProductSales(models.Model):
+    """Продажи товара за день; category — категория товара на момент первой продажи за день"""
+    day = models.DateField(verbose_name="День")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales', verbose_name="Товар")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales', verbose_name="Категория")
+    units = models.PositiveIntegerField(default=0, verbose_name="Штук")
+    cancelled_units = models.PositiveIntegerField(default=0, verbose_name="Отменено штук")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Выручка")
+    cancelled_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Отменено на сумму")
+
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        unique_together = ['day', 'product']
+        indexes = [
+            models.Index(fields=['day', 'category'], name='dailyproduct_day_cat_idx'),
+        ]
+
+class CartItem(models.Model):
+    """Позиция корзины при хранении корзин в отдельной таблице (CART_STORAGE = 'db')"""
+    cart_key = models.CharField(max_length=32, verbose_name="Ключ корзины")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Товар")
+    quantity = models.PositiveIntegerField(verbose_name="Кол-во")
+    # Брошенные корзины удаляет purge_carts по последнему изменению позиций
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменена")
+
+    class Meta:
+        verbose_name = "Позиция корзины"
+        verbose_name_plural = "Позиции корзин"
+        unique_together = ['cart_key', 'product']
+
 class UserProfile(models.Model):
     """Расширенный профиль пользователя"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="Пользователь")
@@ -101,6 +350,7 @@ class UserProfile(models.Model):
     birth_date = models.DateField(blank=True, null=True, verbose_name="Дата рождения")
     address = models.TextField(blank=True, null=True, verbose_name="Адрес")
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name="Аватар")
+    avatar_thumbnails = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Копии аватара")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
     
@@ -131,20 +381,31 @@ def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'userprofile'):
         instance.userprofile.save()
 
+@receiver(post_save, sender=UserProfile)
+def refresh_avatar_thumbnails(sender, instance, update_fields=None, **kwargs):
+    from . import thumbnails
+    thumbnails.image_saved(instance, 'avatar', update_fields)
+
 class UserSession(models.Model):
     """Модель для отслеживания сессий пользователей"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
     session_key = models.CharField(max_length=40, verbose_name="Ключ сессии")
     ip_address = models.GenericIPAddressField(verbose_name="IP адрес")
     user_agent = models.TextField(verbose_name="User Agent")
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата входа")
-    last_activity = models.DateTimeField(auto_now=True, verbose_name="Последняя активность")
+    # Не auto_now: время приходит из буфера main/activity.py и пишется пачками
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата входа")
+    last_activity = models.DateTimeField(default=timezone.now, verbose_name="Последняя активность")
     is_active = models.BooleanField(default=True, verbose_name="Активна")
     
     class Meta:
         verbose_name = "Сессия пользователя"
         verbose_name_plural = "Сессии пользователей"
         unique_together = ['user', 'session_key']
+        indexes = [
+            models.Index(fields=['user', 'is_active', '-last_activity'], name='usersession_user_active_idx'),
+            # Очистка старых сессий (purge_sessions) выбирает по last_activity
+            models.Index(fields=['last_activity'], name='usersession_activity_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.created_at.strftime('%d.%m.%Y %H:%M')}"
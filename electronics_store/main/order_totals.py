@@ -0,0 +1,46 @@
+# main/order_totals.py
+"""Хранимые итоги заказа: Order.items_count и Order.total_price.
+
+Итоги меняются на разницу при создании, изменении и удалении позиций
+(сигналы OrderItem в main/models.py) одним UPDATE с F-выражениями в той же
+транзакции. bulk_create и QuerySet.update сигналов не отправляют — там
+итоги нужно передать явно (как в main/checkout.py) или пересчитать
+командой sync_order_totals.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import F
+
+from .models import Order, OrderItem
+
+
+def adjust(deltas):
+    """Применить изменения {order_id: (delta_count, delta_total)}"""
+    for order_id, (count, total) in deltas.items():
+        if count or total:
+            Order.objects.filter(id=order_id).update(
+                items_count=F('items_count') + count,
+                total_price=F('total_price') + total,
+            )
+
+
+def line_changed(old, new):
+    """Позиция заказа изменилась: old/new — (order_id, quantity, price) или None"""
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for line, sign in ((old, -1), (new, 1)):
+        if line:
+            order_id, quantity, price = line
+            deltas[order_id][0] += sign * quantity
+            deltas[order_id][1] += sign * quantity * Decimal(str(price))
+    adjust(deltas)
+
+
+def calculate(order_ids):
+    """{order_id: (items_count, total_price)} по позициям заказов, точно в Decimal"""
+    totals = {order_id: [0, Decimal(0)] for order_id in order_ids}
+    rows = OrderItem.objects.filter(order_id__in=order_ids).values_list('order_id', 'quantity', 'price')
+    for order_id, quantity, price in rows:
+        totals[order_id][0] += quantity
+        totals[order_id][1] += quantity * price
+    return {order_id: tuple(values) for order_id, values in totals.items()}
@@ -0,0 +1,104 @@
+# main/pagination.py
+"""Keyset-пагинация (по курсору) для списков с сортировкой.
+
+Вместо OFFSET следующая страница выбирается условием «строго после
+последней записи предыдущей страницы», поэтому стоимость запроса не
+растёт с номером страницы. Порядок всегда завершается уникальным полем
+(id), чтобы записи с одинаковым значением сортировки не терялись.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+CURSOR_SALT = 'main.pagination'
+
+
+def _salt(ordering, scope):
+    # Курсор действует только для своего порядка и области (например,
+    # пользователя и фильтра): чужой токен не проходит проверку подписи
+    return f'{CURSOR_SALT}:{",".join(ordering)}:{scope}'
+
+
+def encode_cursor(values, ordering, scope=''):
+    """Упаковать значения полей сортировки последней записи в подписанный токен"""
+    prepared = []
+    for value in values:
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        prepared.append(value)
+    return signing.dumps(prepared, salt=_salt(ordering, scope), compress=True)
+
+
+def decode_cursor(token, ordering, scope=''):
+    """Распаковать токен курсора; None, если токен пустой, подделан или
+    выдан для другого порядка или области"""
+    if not token:
+        return None
+    try:
+        values = signing.loads(token, salt=_salt(ordering, scope))
+    except signing.BadSignature:
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    return values
+
+
+def keyset_filter(ordering, values, model=None):
+    """Условие «после записи с values» для порядка ordering.
+
+    Для ('price', 'id') и (p, i) получится: price > p OR (price = p AND id > i).
+    С model значения приводятся к типам полей; None — если они к ним не
+    подходят (тогда курсор считается отсутствующим).
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        if model is not None:
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except (FieldDoesNotExist, ValidationError, ValueError, TypeError):
+                return None
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def _page_queryset(qs, ordering, cursor, page_size, scope):
+    values = decode_cursor(cursor, ordering, scope)
+    qs = qs.order_by(*ordering)
+    condition = keyset_filter(ordering, values, qs.model) if values is not None else None
+    if condition is not None:
+        qs = qs.filter(condition)
+    return qs[:page_size + 1]
+
+
+def _page(items, ordering, page_size, scope):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, f.lstrip('-')) for f in ordering], ordering, scope)
+    return items, next_cursor
+
+
+def paginate(qs, ordering, cursor, page_size, scope=''):
+    """Вернуть (объекты страницы, курсор следующей страницы или None).
+
+    scope — строка, к которой привязан курсор (например, пользователь и
+    фильтр): курсор из другого списка даёт первую страницу.
+    """
+    items = list(_page_queryset(qs, ordering, cursor, page_size, scope))
+    return _page(items, ordering, page_size, scope)
+
+
+async def apaginate(qs, ordering, cursor, page_size, scope=''):
+    """Асинхронный вариант paginate()"""
+    items = [obj async for obj in _page_queryset(qs, ordering, cursor, page_size, scope)]
+    return _page(items, ordering, page_size, scope)
@@ -0,0 +1,133 @@
+# main/product_cache.py
+"""Cache-aside для товаров по id и slug.
+
+Товар кладётся в кэш вместе с категорией. Ключи содержат поколение,
+которое увеличивается при изменении любой категории; отдельные товары
+удаляются из кэша сигналами post_save/post_delete и после изменения
+остатков (main/stock.py).
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .catalog import aget_version, bump, get_version
+from .db_router import primary_reads
+from .models import Product
+
+GENERATION_SCOPE = 'products'
+
+
+def _id_key(generation, product_id):
+    return f'product:{generation}:id:{product_id}'
+
+
+def _slug_key(generation, slug):
+    return f'product:{generation}:slug:{slug}'
+
+
+def _timeout():
+    return getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 600)
+
+
+def _count(hits, misses):
+    if hits:
+        metrics.inc('product_cache_hits', hits)
+    if misses:
+        metrics.inc('product_cache_misses', misses)
+
+
+def get_products(ids):
+    """{id: Product} для перечисленных id; отсутствующие в БД пропускаются"""
+    ids = {int(pid) for pid in ids if str(pid).isdigit()}
+    if not ids:
+        return {}
+    generation = get_version(GENERATION_SCOPE)
+    keys = {_id_key(generation, pid): pid for pid in ids}
+    cached = cache.get_many(keys)
+    found = {keys[key]: product for key, product in cached.items()}
+    missing = ids - found.keys()
+    _count(len(found), len(missing))
+    if missing:
+        with primary_reads():
+            loaded = {p.id: p for p in Product.objects.filter(id__in=missing).select_related('category')}
+        cache.set_many({_id_key(generation, pid): p for pid, p in loaded.items()}, _timeout())
+        found.update(loaded)
+    return found
+
+
+async def aget_products(ids):
+    """Асинхронный вариант get_products()"""
+    ids = {int(pid) for pid in ids if str(pid).isdigit()}
+    if not ids:
+        return {}
+    generation = await aget_version(GENERATION_SCOPE)
+    keys = {_id_key(generation, pid): pid for pid in ids}
+    cached = await cache.aget_many(keys)
+    found = {keys[key]: product for key, product in cached.items()}
+    missing = ids - found.keys()
+    _count(len(found), len(missing))
+    if missing:
+        with primary_reads():
+            loaded = {p.id: p async for p in Product.objects.filter(id__in=missing).select_related('category')}
+        await cache.aset_many({_id_key(generation, pid): p for pid, p in loaded.items()}, _timeout())
+        found.update(loaded)
+    return found
+
+
+def get_product(product_id):
+    """Товар по id или None"""
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return None
+    return get_products([product_id]).get(product_id)
+
+
+async def aget_product(product_id):
+    """Асинхронный вариант get_product()"""
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return None
+    return (await aget_products([product_id])).get(product_id)
+
+
+def get_product_by_slug(slug):
+    """Товар по slug или None; slug хранится как ссылка на id"""
+    generation = get_version(GENERATION_SCOPE)
+    product_id = cache.get(_slug_key(generation, slug))
+    if product_id is not None:
+        product = get_product(product_id)
+        if product is not None and product.slug == slug:
+            return product
+    _count(0, 1)
+    with primary_reads():
+        product = Product.objects.filter(slug=slug).select_related('category').first()
+    if product is not None:
+        cache.set_many({
+            _slug_key(generation, slug): product.id,
+            _id_key(generation, product.id): product,
+        }, _timeout())
+    return product
+
+
+def invalidate(product_ids, slugs=()):
+    """Удалить товары из кэша (после изменения или удаления)"""
+    generation = get_version(GENERATION_SCOPE)
+    keys = [_id_key(generation, pid) for pid in product_ids]
+    keys += [_slug_key(generation, slug) for slug in slugs if slug]
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_all():
+    """Сбросить кэш всех товаров (например, после изменения категории)"""
+    bump(GENERATION_SCOPE)
+
+
+def stats():
+    counters = metrics.counters()
+    return {
+        'hits': counters.get('product_cache_hits', 0),
+        'misses': counters.get('product_cache_misses', 0),
+    }
@@ -0,0 +1,259 @@
+# main/rollups.py
+"""Дневные итоги продаж (DailySales, DailyProductSales).
+
+Итоги меняются на разницу в той же транзакции, что и заказ:
+  * order_placed — оформление (main/checkout.py);
+  * orders_cancelled — отмена; с sign=-1 — отмена снята в админке;
+  * orders_removed — удаление заказа: вычитается всё, что он внёс.
+Существующие строки дня обновляются одним UPDATE с CASE и F-выражениями,
+недостающие создаются одним bulk_create, поэтому число запросов не
+зависит от числа позиций. Итоги не уходят ниже нуля: вычитание по
+заказу, которого в них нет, обрезается и пишется в лог. Позиции,
+изменённые в обход этих функций (например, в карточке заказа в админке),
+учитывает команда rebuild_rollups — она пересчитывает дни целиком.
+Заказы до появления итогов заполнила миграция 0015.
+
+Панель продаж в админке (dashboard) читает только эти таблицы.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySales, Order, OrderItem
+
+logger = logging.getLogger('main.rollups')
+
+# Ключей в одном UPDATE ... CASE (ограничение на число параметров SQL)
+BATCH_SIZE = 200
+DAY_FIELDS = ('orders', 'cancelled_orders', 'units', 'cancelled_units', 'revenue', 'cancelled_revenue')
+PRODUCT_FIELDS = ('units', 'cancelled_units', 'revenue', 'cancelled_revenue')
+
+
+def _lookup(key_fields, key):
+    return dict(zip(key_fields, key))
+
+
+def _condition(key_fields, keys):
+    condition = Q()
+    for key in keys:
+        condition |= Q(**_lookup(key_fields, key))
+    return condition
+
+
+def _increment(model, key_fields, deltas, defaults=None, retry=True):
+    """Прибавить {ключ: {поле: приращение}} к строкам model.
+
+    defaults — {ключ: {поле: значение}} для создаваемых строк (не ключевые
+    поля, которые не суммируются, например категория товара).
+
+    Итоги не опускаются ниже нуля: вычитание из строки, где столько не
+    набралось (заказ старше итогов, позиции изменены в админке), обрезается
+    до нуля, а строка из одних вычитаний не создаётся. Такие расхождения
+    пишутся в лог — их исправляет rebuild_rollups.
+    """
+    deltas = {key: values for key, values in deltas.items() if any(values.values())}
+    keys = list(deltas)
+    for start in range(0, len(keys), BATCH_SIZE):
+        batch = keys[start:start + BATCH_SIZE]
+        fields = sorted({field for key in batch for field in deltas[key]})
+        existing = {
+            tuple(row[:len(key_fields)]): dict(zip(fields, row[len(key_fields):]))
+            for row in model.objects.filter(_condition(key_fields, batch)).values_list(*key_fields, *fields)
+        }
+        if existing:
+            updates = {}
+            for field in fields:
+                output = model._meta.get_field(field)
+                whens = [When(Q(**_lookup(key_fields, key)),
+                              then=Greatest(F(field) + deltas[key][field], Value(0), output_field=output))
+                         for key in existing if deltas[key].get(field)]
+                if whens:
+                    updates[field] = Case(*whens, default=F(field), output_field=output)
+            for key, current in existing.items():
+                _warn_negative(model, key, {field: current[field] + delta for field, delta in deltas[key].items()})
+            model.objects.filter(_condition(key_fields, existing)).update(**updates)
+
+        missing = [key for key in batch if key not in existing]
+        rows = {}
+        for key in missing:
+            values = deltas[key]
+            _warn_negative(model, key, values)
+            values = {field: max(value, 0) for field, value in values.items()}
+            if any(values.values()):
+                rows[key] = values
+        if not rows:
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([
+                    model(**_lookup(key_fields, key), **(defaults or {}).get(key, {}), **values)
+                    for key, values in rows.items()
+                ])
+        except IntegrityError:
+            # Строку дня могла успеть создать параллельная транзакция — тогда
+            # прибавить к ней, один раз; иначе ошибка не из-за гонки
+            if not retry or not model.objects.filter(_condition(key_fields, rows)).exists():
+                raise
+            _increment(model, key_fields, {key: deltas[key] for key in rows}, defaults, retry=False)
+
+
+def _warn_negative(model, key, values):
+    negative = {field: value for field, value in values.items() if value < 0}
+    if negative:
+        logger.warning('Итоги %s %s ушли бы ниже нуля (%s) и обрезаны до нуля — выполните rebuild_rollups',
+                       model._meta.object_name, key, negative)
+
+
+def _apply(days, products, categories):
+    _increment(DailySales, ('day',), {(day,): values for day, values in days.items()})
+    _increment(DailyProductSales, ('day', 'product_id'), products,
+               {key: {'category_id': categories[key]} for key in products})
+
+
+def _new_totals(fields):
+    return {field: 0 for field in fields}
+
+
+def order_placed(order, lines):
+    """Новый заказ; lines — [(product_id, category_id, quantity, price), ...]"""
+    day = timezone.localdate(order.created_at)
+    totals = _new_totals(DAY_FIELDS)
+    totals['orders'] = 1
+    products, categories = {}, {}
+    for product_id, category_id, quantity, price in lines:
+        amount = quantity * Decimal(price)
+        totals['units'] += quantity
+        totals['revenue'] += amount
+        row = products.setdefault((day, product_id), _new_totals(PRODUCT_FIELDS))
+        row['units'] += quantity
+        row['revenue'] += amount
+        categories[(day, product_id)] = category_id
+    _apply({day: totals}, products, categories)
+
+
+def _collect(order_ids, placed_sign, cancelled_sign, only_cancelled=False):
+    """Изменения итогов для заказов order_ids по их текущим позициям.
+
+    placed_sign — знак для столбцов заказов/штук/выручки, cancelled_sign —
+    для cancelled_*; only_cancelled — cancelled_* меняются только у уже
+    отменённых заказов (при удалении заказа).
+    """
+    orders = {}  # {order_id: (день, знак для заказов/штук/выручки, знак для cancelled_*)}
+    for order_id, created_at, status in Order.objects.filter(pk__in=order_ids).values_list('pk', 'created_at', 'status'):
+        cancelled = 0 if only_cancelled and status != 'cancelled' else cancelled_sign
+        orders[order_id] = (timezone.localdate(created_at), placed_sign, cancelled)
+    days = defaultdict(lambda: _new_totals(DAY_FIELDS))
+    products = defaultdict(lambda: _new_totals(PRODUCT_FIELDS))
+    categories = {}
+
+    for day, placed, cancelled in orders.values():
+        days[day]['orders'] += placed
+        days[day]['cancelled_orders'] += cancelled
+    rows = (OrderItem.objects.filter(order_id__in=orders.keys())
+            .values_list('order_id', 'product_id', 'product__category_id', 'quantity', 'price'))
+    for order_id, product_id, category_id, quantity, price in rows:
+        day, placed, cancelled = orders[order_id]
+        amount = quantity * price
+        for prefix, sign in (('', placed), ('cancelled_', cancelled)):
+            if sign:
+                days[day][f'{prefix}units'] += sign * quantity
+                days[day][f'{prefix}revenue'] += sign * amount
+                products[(day, product_id)][f'{prefix}units'] += sign * quantity
+                products[(day, product_id)][f'{prefix}revenue'] += sign * amount
+        categories[(day, product_id)] = category_id
+    return days, dict(products), categories
+
+
+def orders_cancelled(order_ids, sign=1):
+    """Заказы отменены (sign=1) или с них снята отмена (sign=-1)"""
+    if order_ids:
+        _apply(*_collect(order_ids, 0, sign))
+
+
+def orders_removed(order_ids):
+    """Заказы будут удалены — вычесть их из итогов; вызывать до удаления"""
+    if order_ids:
+        _apply(*_collect(order_ids, -1, -1, only_cancelled=True))
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild(date_from, date_to):
+    """Пересчитать итоги дней [date_from, date_to] по заказам; возвращает число дней с продажами"""
+    start, end = _day_start(date_from), _day_start(date_to + timedelta(days=1))
+    cancelled = Q(order__status='cancelled')
+    line_amount = F('quantity') * F('price')
+    with transaction.atomic():
+        DailySales.objects.filter(day__range=(date_from, date_to)).delete()
+        DailyProductSales.objects.filter(day__range=(date_from, date_to)).delete()
+        orders = {
+            row['day']: row for row in
+            Order.objects.filter(created_at__gte=start, created_at__lt=end)
+            .annotate(day=TruncDate('created_at')).values('day')
+            .annotate(orders=Count('id'), cancelled_orders=Count('id', filter=Q(status='cancelled')))
+            .order_by()
+        }
+        product_rows = list(
+            OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+            .annotate(day=TruncDate('order__created_at')).values('day', 'product_id', 'product__category_id')
+            .annotate(
+                units=Sum('quantity'), cancelled_units=Sum('quantity', filter=cancelled),
+                revenue=Sum(line_amount, output_field=DailyProductSales._meta.get_field('revenue')),
+                cancelled_revenue=Sum(line_amount, filter=cancelled,
+                                      output_field=DailyProductSales._meta.get_field('revenue')),
+            )
+            .order_by()
+        )
+        days = {day: {**_new_totals(DAY_FIELDS), 'orders': row['orders'],
+                      'cancelled_orders': row['cancelled_orders']} for day, row in orders.items()}
+        products = []
+        for row in product_rows:
+            values = {field: row[field] or 0 for field in PRODUCT_FIELDS}
+            for field, value in values.items():
+                days[row['day']][field] += value
+            products.append(DailyProductSales(day=row['day'], product_id=row['product_id'],
+                                              category_id=row['product__category_id'], **values))
+        DailySales.objects.bulk_create([DailySales(day=day, **values) for day, values in days.items()],
+                                       batch_size=BATCH_SIZE)
+        DailyProductSales.objects.bulk_create(products, batch_size=BATCH_SIZE)
+    return len(days)
+
+
+def _rate(cancelled, total):
+    return round(100 * cancelled / total, 1) if total else 0.0
+
+
+def dashboard(date_from, date_to, top=10):
+    """Данные панели продаж за период — только из таблиц итогов"""
+    days = list(DailySales.objects.filter(day__range=(date_from, date_to)).order_by('-day'))
+    for day in days:
+        day.net_revenue = day.revenue - day.cancelled_revenue
+        day.net_units = day.units - day.cancelled_units
+        day.cancellation_rate = _rate(day.cancelled_orders, day.orders)
+    totals = {field: sum(getattr(day, field) for day in days) for field in DAY_FIELDS}
+    totals['net_revenue'] = totals['revenue'] - totals['cancelled_revenue']
+    totals['net_units'] = totals['units'] - totals['cancelled_units']
+    totals['cancellation_rate'] = _rate(totals['cancelled_orders'], totals['orders'])
+
+    period = DailyProductSales.objects.filter(day__range=(date_from, date_to))
+    net = {
+        'net_units': Sum('units') - Sum('cancelled_units'),
+        'net_revenue': Sum('revenue') - Sum('cancelled_revenue'),
+    }
+    products = list(
+        period.values('product_id', 'product__name').annotate(**net)
+        .order_by('-net_units', '-net_revenue', 'product_id')[:top]
+    )
+    categories = list(
+        period.values('category_id', 'category__name').annotate(**net)
+        .order_by('-net_revenue', 'category_id')
+    )
+    return {'days': days, 'totals': totals, 'products': products, 'categories': categories}
@@ -0,0 +1,242 @@
+# main/search.py
+"""Полнотекстовый поиск товаров по названию, модели, стране и категории.
+
+Основной вариант — виртуальная таблица SQLite FTS5 main_product_fts
+(rowid = id товара), которую поддерживают в актуальном состоянии сигналы
+модели Product/Category. Если FTS5 недоступен (другая СУБД или SQLite без
+расширения), используется инвертированный индекс в памяти процесса.
+
+Текст и запрос нормализуются одинаково: приведение регистра (casefold) и
+замена «ё» на «е»; каждое слово запроса ищется как префикс.
+"""
+import bisect
+import re
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .db_router import primary_reads
+from .models import Product
+
+FTS_TABLE = 'main_product_fts'
+# Ограничение выдачи резервного индекса: список id уходит в IN (...),
+# берутся самые новые товары (сортировка каталога по умолчанию)
+FALLBACK_MAX_RESULTS = 1000
+# Максимальная длина строки поиска
+QUERY_MAX_LENGTH = 100
+# Сколько совпадений ранжировать при подсказках
+SUGGEST_CANDIDATES = 500
+
+_WORD_RE = re.compile(r'\w+')
+# Наличие таблицы FTS5 проверяется один раз на файл БД
+_fts_tables = {}
+
+
+def normalize(text):
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    return _WORD_RE.findall(normalize(text))
+
+
+def _document(name, model, country, category_name):
+    return [normalize(name), normalize(model), normalize(country), normalize(category_name)]
+
+
+def fts_available():
+    """Есть ли в текущей БД таблица FTS5 для поиска"""
+    if getattr(settings, 'SEARCH_BACKEND', 'auto') == 'python' or connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_tables[name] = cursor.fetchone() is not None
+    return _fts_tables[name]
+
+
+async def afts_available():
+    """Асинхронный вариант fts_available(): проверка выполняется один раз,
+    дальше ответ берётся из памяти"""
+    name = connection.settings_dict['NAME']
+    if getattr(settings, 'SEARCH_BACKEND', 'auto') != 'python' and name in _fts_tables:
+        return _fts_tables[name]
+    return await sync_to_async(fts_available)()
+
+
+def _match_expression(tokens):
+    # Каждое слово — префиксный поиск, слова объединяются через AND
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+class InvertedIndex:
+    """Резервный индекс в памяти: слово → множество id товаров"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None  # строится при первом обращении
+        self.words = []       # отсортированный словарь для поиска по префиксу
+        self.documents = {}   # id → слова товара
+
+    def _ensure_built(self):
+        if self.postings is not None:
+            return
+        postings = {}
+        documents = {}
+        rows = Product.objects.values_list('id', 'name', 'model', 'country', 'category__name')
+        # Индекс живёт весь процесс — строится по основной БД, а не по реплике
+        with primary_reads():
+            for pid, *fields in rows.iterator(chunk_size=2000):
+                words = set(tokenize(' '.join(_document(*fields))))
+                documents[pid] = words
+                for word in words:
+                    postings.setdefault(word, set()).add(pid)
+        self.postings = postings
+        self.documents = documents
+        self.words = sorted(postings)
+
+    def add(self, pid, fields):
+        with self.lock:
+            if self.postings is None:
+                return
+            self._remove(pid)
+            words = set(tokenize(' '.join(_document(*fields))))
+            self.documents[pid] = words
+            for word in words:
+                if word not in self.postings:
+                    bisect.insort(self.words, word)
+                self.postings.setdefault(word, set()).add(pid)
+
+    def remove(self, pid):
+        with self.lock:
+            if self.postings is not None:
+                self._remove(pid)
+
+    def _remove(self, pid):
+        for word in self.documents.pop(pid, ()):
+            ids = self.postings.get(word)
+            if ids:
+                ids.discard(pid)
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        start = bisect.bisect_left(self.words, prefix)
+        for word in self.words[start:]:
+            if not word.startswith(prefix):
+                break
+            ids |= self.postings[word]
+        return ids
+
+    def search(self, tokens):
+        with self.lock:
+            self._ensure_built()
+            result = None
+            for token in tokens:
+                ids = self._prefix_ids(token)
+                result = ids if result is None else result & ids
+                if not result:
+                    return set()
+            return result or set()
+
+    def reset(self):
+        with self.lock:
+            self.postings = None
+            self.words = []
+            self.documents = {}
+
+
+_fallback = InvertedIndex()
+
+
+def filter_products(qs, query):
+    """Оставить в queryset только товары, подходящие под запрос"""
+    tokens = tokenize(query)
+    if not tokens:
+        return qs
+    if fts_available():
+        return qs.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_match_expression(tokens)]
+        ))
+    ids = sorted(_fallback.search(tokens), reverse=True)[:FALLBACK_MAX_RESULTS]
+    return qs.filter(id__in=ids)
+
+
+async def afilter_products(qs, query):
+    """Асинхронный вариант filter_products(); запросы выполняются при
+    асинхронном обходе возвращённого queryset"""
+    tokens = tokenize(query)
+    if not tokens:
+        return qs
+    if await afts_available():
+        return filter_products(qs, query)
+    if _fallback.postings is None:
+        # Индекс в памяти строится при первом обращении синхронным обходом таблицы
+        ids = await sync_to_async(_fallback.search)(tokens)
+    else:
+        ids = _fallback.search(tokens)
+    return qs.filter(id__in=sorted(ids, reverse=True)[:FALLBACK_MAX_RESULTS])
+
+
+def suggest(query, limit=10):
+    """Подсказки для строки поиска: [{'name', 'slug'}] товаров в наличии"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    if fts_available():
+        with connection.cursor() as cursor:
+            # Ранжируются только первые SUGGEST_CANDIDATES совпадений, чтобы
+            # короткий префикс вроде «с» не сортировал весь каталог
+            cursor.execute(
+                f'SELECT p.name, p.slug FROM ('
+                f'SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT %s'
+                f') f JOIN main_product p ON p.id = f.rowid '
+                f'WHERE p.in_stock ORDER BY f.rank LIMIT %s',
+                [_match_expression(tokens), SUGGEST_CANDIDATES, limit],
+            )
+            return [{'name': name, 'slug': slug} for name, slug in cursor.fetchall()]
+    ids = _fallback.search(tokens)
+    rows = Product.objects.filter(id__in=sorted(ids, reverse=True)[:FALLBACK_MAX_RESULTS], in_stock=True)
+    return list(rows.order_by('name').values('name', 'slug')[:limit])
+
+
+def index_products(products):
+    """Добавить или обновить товары в индексе (нужна загруженная категория)"""
+    rows = [(p.id, (p.name, p.model, p.country, p.category.name)) for p in products]
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pid,) for pid, _ in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, model, country, category) VALUES (%s, %s, %s, %s, %s)',
+                [(pid, *_document(*fields)) for pid, fields in rows],
+            )
+    for pid, fields in rows:
+        _fallback.add(pid, fields)
+
+
+def remove_product(product_id):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+    _fallback.remove(product_id)
+
+
+def rebuild():
+    """Перестроить индекс целиком по данным таблицы товаров"""
+    _fallback.reset()
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    qs = Product.objects.select_related('category').order_by('id')
+    batch = []
+    for product in qs.iterator(chunk_size=2000):
+        batch.append(product)
+        if len(batch) >= 2000:
+            index_products(batch)
+            batch = []
+    if batch:
+        index_products(batch)
@@ -0,0 +1,126 @@
+# main/seed.py
+"""Генерация синтетических данных магазина пачками (bulk_create).
+
+Используется командами замеров и проверки планов запросов. Сигналы
+post_save при bulk_create не срабатывают, поэтому профили пользователей,
+поисковый индекс, счётчики фасетов и начальные остатки в журнале склада
+заполняются здесь же явно.
+"""
+import random
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import facets, search
+from .catalog import invalidate_categories
+from .models import Category, Product, Order, OrderItem, StockMovement, UserProfile, UserSession
+
+KINDS = ['Смартфон', 'Ноутбук', 'Планшет', 'Наушники', 'Часы', 'Пылесос', 'Телевизор', 'Колонка']
+BRANDS = ['Apple', 'Samsung', 'Xiaomi', 'Sony', 'Dyson', 'Huawei', 'Lenovo', 'Asus']
+COUNTRIES = ['Китай', 'Южная Корея', 'Япония', 'США', 'Вьетнам', 'Россия', 'Малайзия']
+STATUSES = ['new', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+
+# Пароль всех сгенерированных пользователей
+SEED_PASSWORD = 'password'
+
+
+def seed_store(categories=20, products=10000, users=100, orders=2000, items_per_order=3,
+               days=365, batch_size=1000, seed=0):
+    """Заполнить БД синтетическими данными и вернуть число созданных записей"""
+    rng = random.Random(seed)
+    run = uuid.uuid4().hex[:6]
+    now = timezone.now()
+
+    with transaction.atomic():
+        cats = Category.objects.bulk_create([
+            Category(slug=f'seed-{run}-cat-{i}', name=f'Категория {run}-{i}')
+            for i in range(categories)
+        ], batch_size=batch_size)
+
+        product_rows = []
+        for i in range(products):
+            stock = 0 if rng.random() < 0.05 else rng.randint(1, 500)
+            product_rows.append(Product(
+                category=rng.choice(cats),
+                name=f'{rng.choice(KINDS)} {rng.choice(BRANDS)} {rng.randint(1, 99)}',
+                slug=f'seed-{run}-product-{i}',
+                price=Decimal(rng.randint(500, 300000)),
+                year=rng.randint(2015, 2025),
+                country=rng.choice(COUNTRIES),
+                model=f'{rng.choice(BRANDS)[:2].upper()}-{rng.randint(100, 9999)}',
+                stock=stock,
+                in_stock=stock > 0,
+            ))
+        prods = Product.objects.bulk_create(product_rows, batch_size=batch_size)
+        _spread_dates(Product, [p.id for p in prods], now, days, rng)
+        for start in range(0, len(prods), batch_size):
+            search.index_products(prods[start:start + batch_size])
+        facets.rebuild()
+        StockMovement.objects.bulk_create([
+            StockMovement(product=p, delta=p.stock, reason=StockMovement.OPENING) for p in prods if p.stock
+        ], batch_size=batch_size)
+
+        password = make_password(SEED_PASSWORD)
+        people = User.objects.bulk_create([
+            User(username=f'seed-{run}-user-{i}', email=f'user{i}@{run}.example',
+                 first_name='Иван', last_name=f'Тестов{i}', password=password)
+            for i in range(users)
+        ], batch_size=batch_size)
+        UserProfile.objects.bulk_create([UserProfile(user=u) for u in people], batch_size=batch_size)
+        UserSession.objects.bulk_create([
+            UserSession(user=u, session_key=uuid.uuid4().hex, ip_address='127.0.0.1',
+                        user_agent='seed', is_active=rng.random() > 0.5)
+            for u in people for _ in range(3)
+        ], batch_size=batch_size)
+
+        order_rows = []
+        item_rows = []
+        for _ in range(orders):
+            order = Order(user=rng.choice(people), status=rng.choice(STATUSES))
+            lines = rng.sample(prods, min(items_per_order, len(prods)))
+            total = Decimal(0)
+            for product in lines:
+                qty = rng.randint(1, 3)
+                item_rows.append(OrderItem(order=order, product=product, quantity=qty, price=product.price))
+                total += product.price * qty
+            order.total_price = total
+            order.items_count = sum(item.quantity for item in item_rows[-len(lines):])
+            order_rows.append(order)
+        Order.objects.bulk_create(order_rows, batch_size=batch_size)
+        for item in item_rows:
+            item.order_id = item.order.id
+        OrderItem.objects.bulk_create(item_rows, batch_size=batch_size)
+        _spread_dates(Order, [o.id for o in order_rows], now, days, rng)
+
+    # bulk_create не отправляет сигналы — сбросить кэш каталога вручную
+    invalidate_categories([c.id for c in cats])
+
+    if connection.vendor == 'sqlite':
+        # Обновить статистику планировщика после массовой вставки
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    return {
+        'categories': len(cats),
+        'products': len(prods),
+        'users': len(people),
+        'orders': len(order_rows),
+        'order_items': len(item_rows),
+    }
+
+
+def _spread_dates(model, ids, now, days, rng, chunk=500):
+    """Раскидать created_at по последним days дням (auto_now_add не даёт задать его при вставке)"""
+    by_day = defaultdict(list)
+    for pk in ids:
+        by_day[rng.randrange(days)].append(pk)
+    for offset, pks in by_day.items():
+        moment = now - timedelta(days=offset, seconds=rng.randrange(86400))
+        for start in range(0, len(pks), chunk):
+            model.objects.filter(id__in=pks[start:start + chunk]).update(created_at=moment)
@@ -0,0 +1,2 @@
+# main/sqlite_backend/__init__.py
+"""SQLite с профилем производительности: ENGINE = 'main.sqlite_backend'"""
@@ -0,0 +1,84 @@
+# main/sqlite_backend/base.py
+"""Бэкенд SQLite с профилем производительности.
+
+Прагмы профиля выполняются на каждом новом соединении, а транзакции
+открываются в заданном режиме. Профиль выбирается в DATABASES[...]['OPTIONS']:
+
+    'OPTIONS': {
+        'profile': 'concurrent',            # имя из PROFILES
+        'pragmas': {'cache_size': -64000},  # поверх прагм профиля
+        'transaction_mode': 'IMMEDIATE',    # поверх режима профиля
+    }
+
+Остальные ключи OPTIONS, как и у стандартного бэкенда, передаются в
+sqlite3.connect(). В Django 5.1 появились свои OPTIONS init_command и
+transaction_mode — до перехода на него их роль выполняет этот модуль.
+
+Профиль 'concurrent' рассчитан на параллельные оформления заказов:
+  * journal_mode=wal — читатели не блокируют писателя и наоборот;
+  * synchronous=normal — в режиме WAL не теряет целостность, а fsync
+    делается только на контрольных точках, а не на каждом COMMIT;
+  * busy_timeout — ждать снятия блокировки, а не сразу сообщать
+    «database is locked»;
+  * транзакции BEGIN IMMEDIATE — блокировка на запись берётся в начале
+    atomic(). Иначе транзакция, которая сначала читала, при первой записи
+    получает SQLITE_BUSY без ожидания: busy_timeout в этом случае не
+    помогает, потому что её снимок данных уже устарел.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PROFILES = {
+    # Как у стандартного бэкенда: журнал DELETE, отложенные транзакции
+    'default': {
+        'pragmas': {},
+        'transaction_mode': None,
+    },
+    'concurrent': {
+        'pragmas': {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'busy_timeout': 5000,  # мс
+            'cache_size': -32000,  # отрицательное — в КиБ, то есть 32 МиБ на соединение
+            'temp_store': 'memory',
+            'mmap_size': 134217728,  # 128 МиБ
+        },
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+def resolve(options):
+    """(прагмы, режим транзакций) для OPTIONS соединения"""
+    name = options.get('profile', 'default')
+    if name not in PROFILES:
+        raise ImproperlyConfigured(f'Неизвестный профиль SQLite: {name}')
+    pragmas = {**PROFILES[name]['pragmas'], **options.get('pragmas', {})}
+    mode = options.get('transaction_mode', PROFILES[name]['transaction_mode'])
+    if mode is not None and mode.upper() not in TRANSACTION_MODES:
+        raise ImproperlyConfigured(f'Неизвестный режим транзакций SQLite: {mode}')
+    return pragmas, mode and mode.upper()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for key in ('profile', 'pragmas', 'transaction_mode'):
+            params.pop(key, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas, _ = resolve(self.settings_dict['OPTIONS'])
+        for pragma, value in pragmas.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        _, mode = resolve(self.settings_dict['OPTIONS'])
+        if mode:
+            self.cursor().execute(f'BEGIN {mode}')
+        else:
+            super()._start_transaction_under_autocommit()
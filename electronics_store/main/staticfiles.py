@@ -0,0 +1,333 @@
+# main/staticfiles.py
+"""Сборка и отдача статики: хеш в имени, минификация и сжатие при collectstatic.
+
+CompressedManifestStaticFilesStorage (STORAGES['staticfiles']) при
+collectstatic:
+  * минифицирует .css и .js (кроме уже минифицированных *.min.*) при
+    записи; хеш считается по исходнику, а минификация детерминирована,
+    поэтому новый хеш появляется ровно тогда, когда меняется файл;
+  * как ManifestStaticFilesStorage, копирует файлы под именами с хешем
+    содержимого (css/style.3f2a9c1d0b7e.css) и пишет staticfiles.json —
+    тег {% static %} подставляет эти имена;
+  * рядом с каждым текстовым файлом кладёт .gz (gzip -9) и .br, если
+    установлен пакет brotli (в стандартной библиотеке его нет — тогда только
+    gzip). Сжатая копия остаётся, только если она заметно меньше.
+
+Файлы с хешем в имени никогда не меняются, поэтому serve() отдаёт их с
+Cache-Control: immutable на год и выбирает .br/.gz по Accept-Encoding.
+Сводку экономии печатает команда build_static.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MINIFY_EXTENSIONS = ('.css', '.js')
+COMPRESS_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.xml', '.html', '.ico')
+# Сжатая копия сохраняется, если она меньше оригинала хотя бы на 5%
+COMPRESS_MIN_RATIO = 0.95
+# Расширение файла -> значение Content-Encoding, в порядке предпочтения
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip')) if brotli else (('.gz', 'gzip'),)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_JS_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                      'throw', 'case', 'do', 'else', 'yield', 'await'}
+_TRAILING_WORD = re.compile(r'[A-Za-z_$][\w$]*$')
+
+
+def _skip_quoted(source, start):
+    """Индекс после строки/шаблона, начинающегося с кавычки source[start]"""
+    quote = source[start]
+    i = start + 1
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == quote:
+            return i + 1
+        if c == '\n' and quote != '`':
+            # Незакрытая строка — дальше не разбираем как строку
+            return i
+        i += 1
+    return len(source)
+
+
+def _skip_regex(source, start):
+    """Индекс после литерала регулярного выражения /.../ (без флагов)"""
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '\n':
+            return i
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            return i + 1
+        i += 1
+    return len(source)
+
+
+def _regex_allowed(out, last):
+    """Может ли «/» после уже выведенного текста начинать регулярное выражение"""
+    if not last or not (last.isalnum() or last in '_$)]}'):
+        return True
+    word = _TRAILING_WORD.search(''.join(out[-32:]))
+    return word is not None and word.group() in _JS_REGEX_KEYWORDS
+
+
+def minify_css(source):
+    """Убрать комментарии (кроме /*! ... */) и лишние пробелы; строки не трогаются"""
+    out = []
+    i, n = 0, len(source)
+    space = False
+    while i < n:
+        c = source[i]
+        if c in '"\'':
+            j = _skip_quoted(source, i)
+            chunk = source[i:j]
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            j = n if end == -1 else end + 2
+            if not source.startswith('/*!', i):
+                space = space or bool(out)
+                i = j
+                continue
+            chunk = source[i:j]
+        elif c.isspace():
+            space = bool(out)
+            i += 1
+            continue
+        else:
+            j = i + 1
+            chunk = c
+        if space and chunk not in '{};,>' and out[-1] not in '{};,>:':
+            out.append(' ')
+        space = False
+        if chunk == '}' and out and out[-1] == ';':
+            out.pop()
+        out.append(chunk)
+        i = j
+    return ''.join(out)
+
+
+def minify_js(source):
+    """Консервативная минификация JS: комментарии, отступы и пустые строки.
+
+    Переводы строк сохраняются (от них зависит автоматическая расстановка
+    точек с запятой), строки, шаблоны и регулярные выражения копируются как
+    есть. Сомнительный «/» считается началом регулярного выражения — тогда
+    текст до следующего «/» просто не меняется.
+    """
+    out = []
+    i, n = 0, len(source)
+    line_start = True
+    space = False
+    last = ''
+
+    def emit(chunk):
+        nonlocal line_start, space
+        if space and not line_start:
+            out.append(' ')
+        space = False
+        line_start = False
+        out.append(chunk)
+
+    while i < n:
+        c = source[i]
+        if c in '"\'`':
+            j = _skip_quoted(source, i)
+            emit(source[i:j])
+            last = c
+        elif source.startswith('//', i):
+            j = source.find('\n', i)
+            j = n if j == -1 else j
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            j = n if end == -1 else end + 2
+            if '\n' in source[i:j]:
+                if not line_start:
+                    out.append('\n')
+                line_start = True
+                space = False
+            else:
+                space = True
+        elif c == '/' and _regex_allowed(out, last):
+            j = _skip_regex(source, i)
+            emit(source[i:j])
+            last = '/'
+        elif c == '\n':
+            j = i + 1
+            if not line_start:
+                out.append('\n')
+            line_start = True
+            space = False
+        elif c.isspace():
+            j = i + 1
+            space = True
+        else:
+            j = i + 1
+            emit(c)
+            last = c
+        i = j
+    return ''.join(out).rstrip('\n') + '\n'
+
+
+def minify(name, content):
+    """Минифицированный текст файла name или None, если файл не минифицируется"""
+    base, extension = os.path.splitext(name)
+    if extension not in MINIFY_EXTENSIONS or base.endswith('.min'):
+        return None
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return (minify_css(text) if extension == '.css' else minify_js(text)).encode('utf-8')
+
+
+def compress(data):
+    """{расширение: сжатые байты} для всех доступных алгоритмов"""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return variants
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # {имя с хешем: {'': размер, '.gz': размер сжатой копии, ...}}
+        self.compressed_sizes = {}
+
+    def _save(self, name, content):
+        # Django передаёт сюда и уже прочитанные при вычислении хеша файлы
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        data = content.read()
+        minified = minify(name, data)
+        if minified is not None:
+            data = minified
+        return super()._save(name, ContentFile(data))
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(COMPRESS_EXTENSIONS):
+                self._compress(name)
+
+    def _compress(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        sizes = {'': len(data)}
+        for extension, compressed in compress(data).items():
+            path = name + extension
+            if self.exists(path):
+                self.delete(path)
+            if len(compressed) < len(data) * COMPRESS_MIN_RATIO:
+                super()._save(path, ContentFile(compressed))
+                sizes[extension] = len(compressed)
+        self.compressed_sizes[name] = sizes
+
+    def stored_name(self, name):
+        # До первого collectstatic манифеста нет (разработка, тесты) —
+        # ссылки ведут на исходные файлы из STATICFILES_DIRS
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def report(self):
+        """Сводка последней сборки: по файлам и итог в байтах"""
+        source_names = {hashed: name for name, hashed in self.hashed_files.items()}
+        files = []
+        for hashed, sizes in sorted(self.compressed_sizes.items()):
+            name = source_names.get(hashed, hashed)
+            source = finders.find(name)
+            files.append({
+                'name': name,
+                'original': os.path.getsize(source) if source else sizes[''],
+                'minified': sizes[''],
+                'gzip': sizes.get('.gz', sizes['']),
+                'br': sizes.get('.br', sizes['']) if brotli else None,
+            })
+        totals = {key: sum(f[key] for f in files) for key in ('original', 'minified', 'gzip')}
+        totals['br'] = sum(f['br'] for f in files) if brotli else None
+        return {'files': files, 'totals': totals, 'brotli': brotli is not None}
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с ненулевым q"""
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if token and quality > 0:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def serve(request, path):
+    """Отдать файл из STATIC_ROOT, по возможности заранее сжатую копию.
+
+    Для развёртываний без отдельного веб-сервера (STATIC_SERVE = True); nginx
+    делает то же самое директивами gzip_static/brotli_static.
+    """
+    if not settings.STATIC_ROOT:
+        raise Http404
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    chosen, encoding = full_path, None
+    for extension, candidate in ENCODINGS:
+        if (candidate in accepted or '*' in accepted) and os.path.isfile(full_path + extension):
+            chosen, encoding = full_path + extension, candidate
+            break
+
+    stat = os.stat(chosen)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        response = FileResponse(open(chosen, 'rb'), content_type=content_type)
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    hashed = getattr(staticfiles_storage, 'hashed_files', {})
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if name in hashed.values() else 'no-cache'
+    return response
@@ -0,0 +1,133 @@
+# main/stock.py
+"""Изменение складских остатков пачками через F-выражения.
+
+Единственный путь изменения остатков: оформление заказа (reserve), возврат
+позиций отменённых и удалённых заказов (restock_orders), корректировка из
+админки (adjust). Каждое изменение Product.stock сопровождается строками
+журнала StockMovement в той же транзакции, поэтому сумма движений по товару
+совпадает с его остатком (проверяет и сворачивает команда compact_stock).
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+
+from . import facets, product_cache
+from .catalog import invalidate_categories
+from .models import OrderItem, Product, StockMovement
+
+# Сколько позиций списывать или возвращать одним UPDATE (ограничение на число параметров SQL)
+RESERVE_BATCH_SIZE = 200
+
+
+class StockConflict(Exception):
+    """Остаток изменился между чтением и списанием — транзакцию нужно повторить"""
+
+
+def record(lines, reason):
+    """Дописать в журнал движения [(product_id, delta, order_number), ...]"""
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=pid, delta=delta, reason=reason, order_number=order_number)
+        for pid, delta, order_number in lines if delta
+    ], batch_size=RESERVE_BATCH_SIZE)
+
+
+def _positive(quantities):
+    return [(int(pid), int(qty)) for pid, qty in quantities.items() if int(qty) > 0]
+
+
+def reserve(quantities, order_number=None, reason=StockMovement.SALE):
+    """Списать остатки {product_id: qty} условным UPDATE ... WHERE stock >= qty.
+
+    Вызывать внутри transaction.atomic(): если хотя бы одна строка не
+    обновилась (остаток уже меньше qty), выбрасывается StockConflict и
+    транзакция откатывается целиком.
+    """
+    items = _positive(quantities)
+    for start in range(0, len(items), RESERVE_BATCH_SIZE):
+        batch = items[start:start + RESERVE_BATCH_SIZE]
+        condition = Q()
+        whens = []
+        for pid, qty in batch:
+            condition |= Q(id=pid, stock__gte=qty)
+            whens.append(When(id=pid, then=F('stock') - qty))
+        updated = Product.objects.filter(condition).update(
+            stock=Case(*whens, default=F('stock'), output_field=PositiveIntegerField())
+        )
+        if updated != len(batch):
+            raise StockConflict()
+    ids = [pid for pid, _ in items]
+    if ids:
+        # Закончившиеся товары снимаем с витрины и вычитаем из счётчиков фасетов
+        sold_out = list(Product.objects.filter(id__in=ids, stock=0, in_stock=True)
+                        .values_list('id', *facets.ROW_FIELDS))
+        if sold_out:
+            Product.objects.filter(id__in=[row[0] for row in sold_out]).update(in_stock=False)
+            facets.adjust(facets.rows_to_deltas([row[1:] for row in sold_out], -1))
+        record([(pid, -qty, order_number) for pid, qty in items], reason)
+        transaction.on_commit(lambda: product_cache.invalidate(ids))
+
+
+def _restock(items):
+    """Вернуть на склад [(product_id, qty), ...] без записи в журнал,
+    по UPDATE на пачку из RESERVE_BATCH_SIZE позиций"""
+    ids = [pid for pid, _ in items]
+    restocked = []
+    for start in range(0, len(items), RESERVE_BATCH_SIZE):
+        batch = items[start:start + RESERVE_BATCH_SIZE]
+        batch_ids = [pid for pid, _ in batch]
+        # Товары, которые возвращаются на витрину, — для счётчиков фасетов
+        restocked += Product.objects.filter(id__in=batch_ids, in_stock=False).values_list(*facets.ROW_FIELDS)
+        whens = [When(id=pid, then=F('stock') + qty) for pid, qty in batch]
+        Product.objects.filter(id__in=batch_ids).update(
+            stock=Case(*whens, default=F('stock'), output_field=PositiveIntegerField()),
+            in_stock=True,
+        )
+    if restocked:
+        facets.adjust(facets.rows_to_deltas(restocked, 1))
+    transaction.on_commit(lambda: product_cache.invalidate(ids))
+
+
+def release(quantities, order_number=None, reason=StockMovement.RETURN):
+    """Вернуть остатки {product_id: qty} на склад"""
+    items = _positive(quantities)
+    if not items:
+        return
+    _restock(items)
+    record([(pid, qty, order_number) for pid, qty in items], reason)
+
+
+def restock_orders(order_ids, reason):
+    """Вернуть на склад все позиции заказов order_ids.
+
+    Вызывать в транзакции, в которой заказы уже заблокированы и проверен их
+    статус, — иначе параллельная отмена вернёт товары дважды. В журнал
+    попадает строка на каждую позицию, остатки меняются пачками UPDATE.
+    """
+    rows = list(
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values_list('order_id', 'product_id', 'quantity', 'product__category_id')
+    )
+    if not rows:
+        return
+    quantities = defaultdict(int)
+    for _, pid, qty, _ in rows:
+        quantities[pid] += qty
+    _restock(_positive(quantities))
+    record([(pid, qty, order_id) for order_id, pid, qty, _ in rows], reason)
+    category_ids = {category_id for *_, category_id in rows}
+    transaction.on_commit(lambda: invalidate_categories(category_ids))
+
+
+def adjust(product, delta):
+    """Корректировка остатка товара на delta (форма товара в админке).
+
+    Разница применяется к текущему значению в БД, а не перезаписывает его
+    прочитанным в форме: параллельные продажи не теряются. Списание больше
+    остатка — StockConflict.
+    """
+    if delta > 0:
+        release({product.pk: delta}, reason=StockMovement.ADJUSTMENT)
+    elif delta < 0:
+        reserve({product.pk: -delta}, reason=StockMovement.ADJUSTMENT)
+    transaction.on_commit(lambda: invalidate_categories([product.category_id]))
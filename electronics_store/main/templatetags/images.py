@@ -0,0 +1,42 @@
+# main/templatetags/images.py
+"""Тег {% responsive_image %}: <picture> с srcset из копий main/thumbnails.py"""
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from ..thumbnails import CONTENT_TYPES, thumbnails_field
+
+register = template.Library()
+
+
+def _srcset(variants):
+    return ', '.join(f'{default_storage.url(name)} {width}w' for width, _, name in variants)
+
+
+@register.simple_tag
+def responsive_image(instance, field_name, sizes='100vw', alt='', css_class='', loading='lazy'):
+    """{% responsive_image product 'image' sizes='(min-width: 992px) 300px, 50vw' alt=product.name %}
+
+    Пока копии не построены, выводится обычный <img> с оригиналом.
+    """
+    image = getattr(instance, field_name)
+    if not image:
+        return ''
+    thumbnails = getattr(instance, thumbnails_field(field_name)) or {}
+    fallback = thumbnails.get('jpeg') if thumbnails.get('source') == image.name else None
+    if not fallback:
+        return format_html('<img src="{}" class="{}" alt="{}" loading="{}" decoding="async">',
+                           image.url, css_class, alt, loading)
+
+    # Сначала более компактные форматы, последним — JPEG в самом <img>
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((CONTENT_TYPES[fmt], _srcset(thumbnails[fmt]), sizes)
+         for fmt in CONTENT_TYPES if fmt != 'jpeg' and thumbnails.get(fmt)),
+    )
+    width, height, largest = fallback[-1]
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}" '
+        'loading="{}" decoding="async"></picture>',
+        sources, default_storage.url(largest), _srcset(fallback), sizes, width, height, css_class, alt, loading,
+    )
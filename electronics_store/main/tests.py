@@ -1,3 +1,1513 @@
-from django.test import TestCase
-
-# Create your tests here.
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from urllib.parse import parse_qs, urlsplit
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.contrib import admin
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.db.models import Sum
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (catalog, db_router, export, pagination, facets, hashing, metrics, product_cache, rollups, search,
+               staticfiles, stock, thumbnails)
+from .activity import recorder
+from .cart import Cart, DatabaseCartStorage
+from .checkout import CheckoutError, cancel_orders, delete_order, place_order
+from .models import (CartItem, Category, DailyProductSales, DailySales, Product, Order, OrderItem,
+                     StockMovement, UserSession)
+from .seed import seed_store
+from .sqlite_backend.base import DatabaseWrapper
+from .views import CART_UPDATE_MAX_ITEMS, ORDER_HISTORY_ORDERING
+
+
+def create_buyer(username='buyer', password='secret1', **fields):
+    """Покупатель с адресом <username>@example.com"""
+    return User.objects.create_user(username, f'{username}@example.com', password, **fields)
+
+
+def create_category(slug='phones', name='Телефоны'):
+    return Category.objects.get_or_create(slug=slug, defaults={'name': name})[0]
+
+
+def create_product(category=None, name='Телефон', slug='phone', model='P1', price=100, stock=10, **fields):
+    """Товар в наличии; без category — в категории «Телефоны»"""
+    return Product.objects.create(category=category or create_category(), name=name, slug=slug, price=price,
+                                  year=2024, country='Китай', model=model, stock=stock, **fields)
+
+
+def create_phones(count, **fields):
+    """count телефонов: «Телефон 0», «Телефон 1», … со слагами phone-0, phone-1, …"""
+    return [create_product(name=f'Телефон {i}', slug=f'phone-{i}', model=f'P{i}', **fields) for i in range(count)]
+
+
+class OrderAdminChangelistTests(TestCase):
+    """Список заказов в админке не должен делать запросы на каждую строку"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.customer = create_buyer(first_name='Иван', last_name='Петров')
+        cls.customer.userprofile.patronymic = 'Сергеевич'
+        cls.customer.userprofile.save()
+        cls.products = create_phones(3)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.customer)
+            for qty, product in enumerate(self.products, start=1):
+                OrderItem.objects.create(order=order, product=product, quantity=qty, price=100)
+
+    def _changelist_queries(self):
+        url = reverse('admin:main_order_changelist')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self._create_orders(2)
+        small, _ = self._changelist_queries()
+        self._create_orders(30)
+        large, _ = self._changelist_queries()
+        self.assertEqual(small, large)
+
+    def test_items_count_and_customer_name_without_queries(self):
+        self._create_orders(1)
+        _, response = self._changelist_queries()
+        order = response.context['cl'].result_list[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(order.items_count, 6)
+            self.assertEqual(order.customer_full_name, 'Иван Сергеевич Петров')
+
+
+class OrderTotalsTests(TestCase):
+    """Итоги заказа обновляются вместе с позициями и сверяются командой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_buyer()
+        cls.products = create_phones(2, price='19.99')
+
+    def _totals(self, order):
+        order.refresh_from_db()
+        return order.items_count, order.total_price
+
+    def test_item_changes_update_order(self):
+        order = Order.objects.create(user=self.user)
+        first = OrderItem.objects.create(order=order, product=self.products[0], quantity=3, price=Decimal('19.99'))
+        second = OrderItem.objects.create(order=order, product=self.products[1], quantity=1, price=Decimal('0.10'))
+        self.assertEqual(self._totals(order), (4, Decimal('60.07')))
+
+        first.quantity = 1
+        first.save()
+        self.assertEqual(self._totals(order), (2, Decimal('20.09')))
+
+        other = Order.objects.create(user=self.user)
+        second.order = other
+        second.save()
+        self.assertEqual(self._totals(order), (1, Decimal('19.99')))
+        self.assertEqual(self._totals(other), (1, Decimal('0.10')))
+
+        first.delete()
+        self.assertEqual(self._totals(order), (0, Decimal('0')))
+
+    def test_checkout_sets_totals(self):
+        order, _ = place_order(self.user, {str(self.products[0].id): 2, str(self.products[1].id): 1})
+        self.assertEqual(self._totals(order), (3, Decimal('59.97')))
+
+    def test_sync_command_fixes_mismatches(self):
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=2, price=Decimal('19.99'))
+        Order.objects.filter(id=order.id).update(items_count=0, total_price=0)
+
+        with self.assertRaises(CommandError):
+            call_command('sync_order_totals', '--verify', stdout=StringIO())
+        call_command('sync_order_totals', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(self._totals(order), (2, Decimal('39.98')))
+        call_command('sync_order_totals', '--verify', stdout=StringIO())
+
+
+class ProductSearchTests(TestCase):
+    """Поиск по индексу: префиксы, регистр и «ё», синхронизация с товарами"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(slug='trees', name='Ёлочные игрушки')
+        cls.ball = Product.objects.create(category=cls.category, name='Шар Стеклянный', slug='ball', price=100,
+                                          year=2024, country='Россия', model='SH-1', stock=5)
+        cls.star = Product.objects.create(category=cls.category, name='Звезда', slug='star', price=200,
+                                          year=2023, country='Китай', model='ZV-2', stock=5)
+
+    def setUp(self):
+        search._fallback.reset()
+
+    def _found(self, query):
+        return set(search.filter_products(Product.objects.all(), query).values_list('slug', flat=True))
+
+    def _check_backend(self):
+        self.assertEqual(self._found('шар'), {'ball'})
+        self.assertEqual(self._found('СТЕКЛ'), {'ball'})
+        self.assertEqual(self._found('елоч'), {'ball', 'star'})
+        self.assertEqual(self._found('ёлочные кит'), {'star'})
+        self.assertEqual(self._found('sh'), {'ball'})
+        self.assertEqual(self._found('шар китай'), set())
+
+        self.star.name = 'Звезда на верхушку'
+        self.star.save()
+        self.assertEqual(self._found('верхуш'), {'star'})
+        self.star.delete()
+        self.assertEqual(self._found('звезда'), set())
+
+    def test_fts5(self):
+        if not search.fts_available():
+            self.skipTest('SQLite собран без FTS5')
+        self._check_backend()
+
+    @override_settings(SEARCH_BACKEND='python')
+    def test_python_fallback(self):
+        self._check_backend()
+
+    def test_catalog_and_suggest(self):
+        response = self.client.get(reverse('catalog'), {'q': 'звез'})
+        self.assertContains(response, 'Звезда')
+        self.assertNotContains(response, 'Шар Стеклянный')
+        response = self.client.get(reverse('api_search_suggest'), {'q': 'шар стек'})
+        self.assertEqual(response.json()['items'], [{'name': 'Шар Стеклянный', 'slug': 'ball'}])
+
+
+class SeedStoreTests(TestCase):
+    """Генератор синтетических данных для замеров (main/seed.py)"""
+
+    def test_small_store_is_consistent(self):
+        created = seed_store(categories=2, products=20, users=3, orders=5, days=30)
+        self.assertEqual(created, {'categories': 2, 'products': 20, 'users': 3, 'orders': 5, 'order_items': 15})
+        self.assertEqual(UserSession.objects.count(), 9)
+
+        orders = Order.objects.prefetch_related('items')
+        self.assertEqual(len(orders), 5)
+        for order in orders:
+            items = list(order.items.all())
+            self.assertEqual(order.items_count, sum(item.quantity for item in items))
+            self.assertEqual(order.total_price, sum(item.price * item.quantity for item in items))
+
+        # Начальные остатки записаны в журнал склада
+        balances = ledger_balances()
+        for pid, qty in Product.objects.values_list('id', 'stock'):
+            self.assertEqual(balances.get(pid, 0), qty)
+
+        out = StringIO()
+        call_command('seed_store', '--categories', '1', '--products', '3', '--users', '1', '--orders', '1',
+                     stdout=out)
+        self.assertIn('products: 3', out.getvalue())
+        self.assertEqual(Product.objects.count(), 23)
+
+
+class QueryMetricsTests(TestCase):
+    """Метрики запросов по именам URL (main/middleware.py, main/metrics.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.product = create_product()
+        cls.order = Order.objects.create(user=cls.admin)
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=2, price=100)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_session_writes_are_counted(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/api/cart/add', json.dumps({'product_id': self.product.id}),
+                             content_type='application/json')
+        self.assertTrue([q for q in ctx.captured_queries if 'django_session' in q['sql']])
+        self.assertEqual(metrics.snapshot()['api_cart_add']['queries']['sum'], len(ctx.captured_queries))
+
+    def test_one_request_per_view_histograms(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertEqual(response.status_code, 200)
+        view = metrics.snapshot()['product_detail']
+        count = len(ctx.captured_queries)
+        self.assertEqual((view['queries']['count'], view['queries']['sum']), (1, count))
+        self.assertEqual(view['queries']['buckets'],
+                         {str(bound): int(count <= bound) for bound in metrics.BUCKETS['queries']} | {'+Inf': 1})
+        self.assertEqual(view['response_bytes']['sum'], len(response.content))
+        self.assertGreater(view['template_ms']['count'], 0)
+
+    def test_metrics_view_is_staff_only(self):
+        url = reverse('metrics')
+        self.assertRedirects(self.client.get(url), f'{reverse("admin:login")}?next={url}')
+        self.client.force_login(create_buyer())
+        self.assertRedirects(self.client.get(url), f'{reverse("admin:login")}?next={url}')
+
+        self.client.force_login(self.admin)
+        self.client.get(reverse('home'))
+        data = self.client.get(url).json()
+        self.assertEqual(data['views']['home']['queries']['count'], 1)
+        response = self.client.get(url, {'format': 'prometheus'})
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(response, 'store_request_queries_count{view="home"} 1')
+
+    def test_prometheus_format(self):
+        metrics.observe('admin:"odd"\\view', queries=3, db_ms=1.5, template_ms=0, duration_ms=20, response_bytes=2000)
+        metrics.inc('product_cache_hits', 2)
+        lines = metrics.render_prometheus().splitlines()
+        label = 'view="admin:\\"odd\\"\\\\view"'
+        self.assertIn('# TYPE store_request_queries histogram', lines)
+        self.assertIn(f'store_request_queries_bucket{{{label},le="2"}} 0', lines)
+        self.assertIn(f'store_request_queries_bucket{{{label},le="5"}} 1', lines)
+        self.assertIn(f'store_request_queries_bucket{{{label},le="+Inf"}} 1', lines)
+        self.assertIn(f'store_request_queries_sum{{{label}}} 3.0', lines)
+        self.assertIn(f'store_request_queries_count{{{label}}} 1', lines)
+        self.assertIn(f'store_request_db_ms_sum{{{label}}} 1.5', lines)
+        self.assertIn('store_product_cache_hits_total 2', lines)
+
+    @override_settings(REQUEST_METRICS={'SLOW_QUERY_COUNT': 0, 'SLOW_REQUEST_MS': 10000, 'LOG_SQL_LIMIT': 2})
+    def test_slow_request_is_logged_with_sql(self):
+        with self.assertLogs('main.metrics', 'WARNING') as logs:
+            self.client.get(reverse('product_detail', args=[self.product.slug]))
+        message = logs.output[0]
+        self.assertIn(f'Медленный запрос GET /product/{self.product.slug}/ (product_detail)', message)
+        self.assertIn('FROM "main_product"', message)
+
+        # Запрос без SQL не превышает порог — без записи в лог
+        with self.assertNoLogs('main.metrics', 'WARNING'):
+            self.client.get(reverse('home'))
+
+    def test_streaming_response_is_measured_after_body(self):
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('admin:main_product_changelist'), {
+                'action': 'export_json', '_selected_action': [self.product.pk],
+            })
+            self.assertNotIn('admin:main_product_changelist', metrics.snapshot())
+            content = b''.join(response.streaming_content)
+        view = metrics.snapshot()['admin:main_product_changelist']
+        self.assertEqual(view['response_bytes']['sum'], len(content))
+        self.assertEqual(view['queries']['sum'], len(ctx.captured_queries))
+
+    @override_settings(REQUEST_METRICS={'SLOW_QUERY_COUNT': 0})
+    async def test_async_streaming_queries_are_counted(self):
+        await self.async_client.aforce_login(self.admin)
+        with self.assertLogs('main.metrics', 'WARNING') as logs:
+            response = await self.async_client.post(reverse('admin:main_order_changelist'), {
+                'action': 'export_csv', '_selected_action': [self.order.pk],
+            })
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+        # Позиции заказов читаются уже во время отдачи тела
+        self.assertIn('"main_orderitem"', logs.output[0])
+        view = metrics.snapshot()['admin:main_order_changelist']
+        self.assertEqual(view['response_bytes']['sum'], len(content))
+
+
+class PaginationTests(TestCase):
+    """Курсоры каталога: равные значения сортировки, чужие и испорченные курсоры"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Три товара с одной ценой — граница страницы проходит внутри группы
+        cls.products = [create_product(name=f'Телефон {i}', slug=f'phone-{i}', model=f'P{i}', price=price)
+                        for i, price in enumerate((200, 100, 100, 100, 300))]
+
+    def setUp(self):
+        cache.clear()
+
+    def _pages(self, qs, ordering, page_size):
+        pages, cursor = [], ''
+        while cursor is not None:
+            items, cursor = pagination.paginate(qs, ordering, cursor, page_size)
+            pages.append([item.slug for item in items])
+        return pages
+
+    def test_ties_are_not_lost(self):
+        pages = self._pages(Product.objects.all(), ('price', 'id'), 2)
+        self.assertEqual(pages, [['phone-1', 'phone-2'], ['phone-3', 'phone-0'], ['phone-4']])
+        pages = self._pages(Product.objects.all(), ('-price', '-id'), 3)
+        self.assertEqual(pages, [['phone-4', 'phone-0', 'phone-3'], ['phone-2', 'phone-1']])
+
+    def _catalog_page(self, **params):
+        response = self.client.get(reverse('catalog'), params)
+        self.assertEqual(response.status_code, 200)
+        links = re.findall(r'<h5 class="card-title"><a href="([^"]+)"', response.context['products_html'])
+        next_url = response.context['next_page_url']
+        return links, next_url and parse_qs(urlsplit(next_url).query)['cursor'][0]
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_catalog_cursor(self):
+        seen, cursor = [], ''
+        for _ in range(5):
+            links, cursor = self._catalog_page(sort='price', cursor=cursor)
+            seen += links
+            if not cursor:
+                break
+        self.assertEqual(seen, [reverse('product_detail', args=[f'phone-{i}']) for i in (1, 2, 3, 0, 4)])
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_foreign_and_garbage_cursors_give_first_page(self):
+        _, name_cursor = self._catalog_page(sort='name')
+        for sort in ('price', 'year', 'new'):
+            first, _ = self._catalog_page(sort=sort)
+            self.assertEqual(self._catalog_page(sort=sort, cursor=name_cursor)[0], first)
+        first, _ = self._catalog_page()
+        self.assertEqual(self._catalog_page(cursor='garbage')[0], first)
+
+        # Подпись верна, но значения не подходят к полям — курсор не учитывается
+        ordering = ('price', 'id')
+        cursor = pagination.encode_cursor(['дорого', 'x'], ordering)
+        items, _ = pagination.paginate(Product.objects.all(), ordering, cursor, 2)
+        self.assertEqual([item.slug for item in items], ['phone-1', 'phone-2'])
+
+
+class FacetCountTests(TestCase):
+    """Счётчики фасетов совпадают с фильтрацией товаров и следуют за изменениями"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_buyer()
+        cls.phones = create_category()
+        cls.laptops = create_category('laptops', 'Ноутбуки')
+        rows = [
+            (cls.phones, 'Китай', 2020, 3000), (cls.phones, 'Китай', 2023, 15000),
+            (cls.phones, 'Япония', 2023, 30000), (cls.laptops, 'Китай', 2021, 90000),
+        ]
+        cls.products = [
+            Product.objects.create(category=category, name=f'Товар {i}', slug=f'item-{i}', price=price,
+                                   year=year, country=country, model=f'M{i}', stock=1)
+            for i, (category, country, year, price) in enumerate(rows)
+        ]
+
+    def _counts(self, **kwargs):
+        cache.clear()  # кэш строк таблицы сбрасывается по on_commit, а TestCase не фиксирует транзакции
+        return facets._count(facets.Filters(**kwargs))
+
+    def test_counts_exclude_own_filter(self):
+        counts = self._counts(category=self.phones, countries=['Китай'])
+        self.assertEqual(counts['total'], 2)
+        self.assertEqual(counts['country'], {'Китай': 2, 'Япония': 1})
+        self.assertEqual(counts['category'], {self.phones.id: 2, self.laptops.id: 1})
+        self.assertEqual(counts['year'], {2020: 1, 2023: 1})
+
+        filters = facets.Filters(year_from=2021, price_buckets=[facets.price_bucket(15000), facets.price_bucket(90000)])
+        qs, counts = facets.facet_search(filters)
+        self.assertEqual(set(qs.values_list('slug', flat=True)), {'item-1', 'item-3'})
+        self.assertEqual(counts['total'], 2)
+
+    def test_counts_follow_product_and_stock_changes(self):
+        phone = self.products[0]
+        phone.country = 'Вьетнам'
+        phone.save()
+        self.assertEqual(self._counts()['country'], {'Китай': 2, 'Япония': 1, 'Вьетнам': 1})
+
+        place_order(self.user, {str(phone.id): 1})  # последний экземпляр — товар уходит с витрины
+        self.assertEqual(self._counts()['country'], {'Китай': 2, 'Япония': 1})
+
+        stock.release({phone.id: 1})
+        self.assertEqual(self._counts()['total'], 4)
+
+        self.products[3].delete()
+        self.assertEqual(self._counts()['category'], {self.phones.id: 3})
+
+
+class AsyncApiTests(TestCase):
+    """Асинхронные представления под ASGI-клиентом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_buyer()
+        cls.product = create_product(stock=2)
+
+    async def _post(self, url, data):
+        return await self.async_client.post(url, json.dumps(data), content_type='application/json')
+
+    async def test_login(self):
+        response = await self._post('/api/login', {'login': 'buyer', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self._post('/api/login', {'login': 'nobody', 'password': 'secret1'})
+        self.assertEqual(response.status_code, 401)
+        response = await self._post('/api/login', {'login': 'buyer', 'password': 'secret1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await UserSession.objects.filter(user=self.user).aexists())
+        await sync_to_async(recorder.flush)()
+        self.assertTrue(await UserSession.objects.filter(user=self.user).aexists())
+
+    async def test_register(self):
+        response = await self._post('/api/register', {
+            'name': 'Иван', 'surname': 'Петров', 'patronymic': 'Ильич', 'login': 'ivan',
+            'email': 'ivan@example.com', 'password': 'secret1', 'password_repeat': 'secret1', 'rules': True,
+        })
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.select_related('userprofile').aget(username='ivan')
+        self.assertTrue(user.check_password('secret1'))
+        self.assertEqual(user.userprofile.patronymic, 'Ильич')
+
+    async def test_cart_add_is_capped_by_stock(self):
+        for expected in (1, 2, 2):
+            response = await self._post('/api/cart/add', {'product_id': self.product.id, 'delta': 1})
+            self.assertEqual(response.json()['qty'], expected)
+
+    async def test_catalog(self):
+        response = await self.async_client.get('/catalog/', {'q': 'телеф'})
+        self.assertContains(response, 'Телефон')
+
+
+class ProductCacheTests(TestCase):
+    """Кэш товаров по id и slug (main/product_cache.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phone, cls.other = create_phones(2)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_hits_and_misses_are_counted(self):
+        ids = [self.phone.id, self.other.id]
+        self.assertEqual(set(product_cache.get_products(ids)), set(ids))
+        self.assertEqual(product_cache.stats(), {'hits': 0, 'misses': 2})
+        with self.assertNumQueries(0):
+            products = product_cache.get_products(ids + ['abc'])
+        self.assertEqual(products[self.phone.id].category.slug, 'phones')
+        self.assertEqual(product_cache.stats(), {'hits': 2, 'misses': 2})
+        # Несуществующий id не кэшируется — промах и запрос только за ним
+        with self.assertNumQueries(1):
+            self.assertEqual(set(product_cache.get_products(ids + [999999])), set(ids))
+        self.assertEqual(product_cache.stats(), {'hits': 4, 'misses': 3})
+
+    def test_slug_lookup(self):
+        self.assertEqual(product_cache.get_product_by_slug('phone-0'), self.phone)
+        with self.assertNumQueries(0):
+            self.assertEqual(product_cache.get_product_by_slug('phone-0'), self.phone)
+            self.assertEqual(product_cache.get_product(self.phone.id), self.phone)
+        self.assertEqual(product_cache.stats(), {'hits': 2, 'misses': 1})
+
+        self.phone.slug = 'phone-new'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phone.save()
+        self.assertIsNone(product_cache.get_product_by_slug('phone-0'))
+        self.assertEqual(product_cache.get_product_by_slug('phone-new').slug, 'phone-new')
+
+    def test_invalidation_waits_for_commit(self):
+        stale = product_cache.get_product(self.phone.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phone.name = 'Телефон новый'
+            self.phone.save()
+            # Параллельный запрос до фиксации ещё читает старую строку и кладёт её в кэш
+            generation = catalog.get_version(product_cache.GENERATION_SCOPE)
+            cache.set(product_cache._id_key(generation, self.phone.id), stale)
+        self.assertEqual(product_cache.get_product(self.phone.id).name, 'Телефон новый')
+
+    def test_category_change_starts_new_generation(self):
+        product_cache.get_products([self.phone.id])
+        category = self.phone.category
+        category.name = 'Смартфоны'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertEqual(product_cache.get_product(self.phone.id).category.name, 'Смартфоны')
+        self.assertEqual(product_cache.stats()['misses'], 2)
+
+        product_cache.invalidate_all()
+        product_cache.get_product(self.phone.id)
+        self.assertEqual(product_cache.stats(), {'hits': 0, 'misses': 3})
+
+
+class CartStorageTests(TestCase):
+    """Корзина одинаково сохраняется и читается при любом CART_STORAGE"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phone, cls.other = create_phones(2, stock=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def _add(self, product, delta=1):
+        response = self.client.post('/api/cart/add', json.dumps({'product_id': product.id, 'delta': delta}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def _cart(self):
+        response = self.client.get(reverse('cart'))
+        return {item['product'].id: item['qty'] for item in response.context['items']}
+
+    def test_round_trip(self):
+        for storage in ('session', 'cookie', 'db'):
+            with self.subTest(storage=storage), override_settings(CART_STORAGE=storage):
+                self.client.cookies.clear()
+                self._add(self.phone)
+                self._add(self.phone)
+                self._add(self.other)
+                self.assertEqual(self._cart(), {self.phone.id: 2, self.other.id: 1})
+                self._add(self.other, -1)
+                self.assertEqual(self._cart(), {self.phone.id: 2})
+                self.assertEqual(CartItem.objects.count(), 1 if storage == 'db' else 0)
+                CartItem.objects.all().delete()
+
+    @override_settings(CART_STORAGE='cookie')
+    def test_cookie_storage_writes_nothing_to_db(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self._add(self.phone)
+        self.assertFalse([q for q in ctx.captured_queries if not q['sql'].startswith('SELECT')])
+        self.assertEqual(self.client.cookies['cart'].value.split(':')[0], str(self.phone.id))
+
+    @override_settings(CART_STORAGE='cookie')
+    def test_tampered_cookie_cart_is_empty(self):
+        self._add(self.phone)
+        value = self.client.cookies['cart'].value
+        self.client.cookies['cart'] = value.replace(f'{self.phone.id}:1', f'{self.phone.id}:5', 1)
+        self.assertEqual(self._cart(), {})
+
+    @override_settings(CART_STORAGE='db')
+    def test_tampered_cart_key_does_not_reach_other_cart(self):
+        self._add(self.phone)
+        cart_key = CartItem.objects.get().cart_key
+        self.client.cookies['cart_id'] = cart_key  # ключ без подписи
+        self.assertEqual(self._cart(), {})
+        self._add(self.other)
+        self.assertEqual(CartItem.objects.get(cart_key=cart_key).product_id, self.phone.id)
+        self.assertEqual(CartItem.objects.exclude(cart_key=cart_key).get().product_id, self.other.id)
+
+    def test_stale_carts_adding_same_product_do_not_conflict(self):
+        response = HttpResponse()
+        cart = Cart(DatabaseCartStorage(RequestFactory().get('/')))
+        cart.set(self.phone.id, 1)
+        cart.save(response)
+
+        # Две вкладки прочитали корзину до добавления товара — обе считают его новым
+        carts = []
+        for _ in range(2):
+            request = RequestFactory().get('/')
+            request.COOKIES['cart_id'] = response.cookies['cart_id'].value
+            carts.append(Cart(DatabaseCartStorage(request)))
+        for qty, stale in enumerate(carts, start=1):
+            stale.set(self.other.id, qty)
+            stale.save(HttpResponse())
+        rows = CartItem.objects.order_by('product_id').values_list('product_id', 'quantity')
+        self.assertEqual(list(rows), [(self.phone.id, 1), (self.other.id, 2)])
+
+    def test_purge_carts(self):
+        old = timezone.now() - timedelta(days=40)
+        for key, products in (('abandoned', [self.phone, self.other]), ('active', [self.phone, self.other]),
+                              ('fresh', [self.phone])):
+            for product in products:
+                CartItem.objects.create(cart_key=key, product=product, quantity=1)
+        CartItem.objects.exclude(cart_key='fresh').update(updated_at=old)
+        # Одна недавно изменённая позиция сохраняет всю корзину
+        CartItem.objects.filter(cart_key='active', product=self.other).update(updated_at=timezone.now())
+
+        out = StringIO()
+        call_command('purge_carts', '--dry-run', stdout=out)
+        self.assertIn('Будет удалено корзин: 1', out.getvalue())
+        call_command('purge_carts', '--batch-size', '1', stdout=out)
+        self.assertIn('Удалено корзин: 1, позиций: 2', out.getvalue())
+        self.assertEqual(set(CartItem.objects.values_list('cart_key', flat=True)), {'active', 'fresh'})
+
+
+class CartUpdateApiTests(TestCase):
+    """Пакетное изменение корзины api/cart/update"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phone, cls.other = create_phones(2, stock=3, price=100)
+
+    def setUp(self):
+        cache.clear()
+
+    def _update(self, items):
+        return self.client.post(reverse('api_cart_update'), json.dumps({'items': items}),
+                                content_type='application/json')
+
+    def test_quantities_are_clamped_by_stock(self):
+        response = self._update({str(self.phone.id): 5, str(self.other.id): 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual({item['product_id']: item['qty'] for item in data['items']},
+                         {self.phone.id: 3, self.other.id: 2})
+        self.assertEqual(data['adjusted'], [{'product_id': self.phone.id, 'requested': 5, 'qty': 3}])
+        self.assertEqual(Decimal(data['total']), Decimal(500))
+
+        # Позиции не из запроса остаются, 0 удаляет позицию
+        data = self._update({str(self.other.id): 0}).json()
+        self.assertEqual([item['product_id'] for item in data['items']], [self.phone.id])
+        self.assertEqual(data['adjusted'], [])
+
+    def test_unknown_product_is_dropped(self):
+        data = self._update({str(self.phone.id): 1, '999999': 2}).json()
+        self.assertEqual([item['product_id'] for item in data['items']], [self.phone.id])
+        self.assertEqual(data['adjusted'], [{'product_id': 999999, 'requested': 2, 'qty': 0}])
+        response = self.client.get(reverse('cart'))
+        self.assertEqual([item['product'].id for item in response.context['items']], [self.phone.id])
+
+    def test_invalid_payload_is_rejected(self):
+        too_many = {str(pid): 1 for pid in range(1, CART_UPDATE_MAX_ITEMS + 2)}
+        for items in (too_many, [self.phone.id], {str(self.phone.id): 'много'}):
+            with self.subTest(items=type(items).__name__):
+                response = self._update(items)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['ok'])
+        self.assertEqual(self._update({}).json()['items'], [])
+
+
+class PasswordHashingTests(TestCase):
+    """Пул хеширования: кэш повторной проверки пароля и отказ при переполнении"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_buyer()
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def tearDown(self):
+        hashing.shutdown()
+
+    def test_verified_password_is_cached(self):
+        self.assertFalse(hashing.check_password(self.user, 'wrong', cached=True))
+        self.assertTrue(hashing.check_password(self.user, 'secret1', cached=True))
+        self.assertTrue(hashing.check_password(self.user, 'secret1', cached=True))
+        self.assertEqual(metrics.counters()['password_hashes'], 2)
+
+        # Новый хеш — прежняя запись кэша больше не подходит
+        self.user.set_password('secret2')
+        self.user.save()
+        self.assertFalse(hashing.check_password(self.user, 'secret1', cached=True))
+        self.assertEqual(metrics.counters()['password_hashes'], 3)
+
+    @override_settings(PASSWORD_HASHING={'EXECUTOR': 'thread', 'WORKERS': 1, 'MAX_QUEUE': 0})
+    def test_full_queue_is_rejected(self):
+        release = threading.Event()
+        busy = hashing.submit(release.wait)
+        try:
+            self.client.force_login(self.user)
+            response = self.client.post('/api/checkout', json.dumps({'password': 'secret1'}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(metrics.counters()['password_hashing_rejected'], 1)
+        finally:
+            release.set()
+            busy.result()
+        self.assertEqual(metrics.gauges()['password_hashing_queue_depth'], 0)
+
+
+class SessionActivityTests(TestCase):
+    """Входы и активность пишутся пачками, старые сессии удаляются командой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_buyer()
+
+    def setUp(self):
+        recorder.flush()
+
+    def _session(self, key):
+        return UserSession.objects.get(user=self.user, session_key=key)
+
+    def test_logins_and_activity_are_batched(self):
+        hour_ago = timezone.now() - timedelta(hours=1)
+        recorder.record_login(self.user.pk, 'first', '127.0.0.1', 'test', at=hour_ago)
+        recorder.record_login(self.user.pk, 'second', '127.0.0.1', 'test', at=hour_ago)
+        recorder.end(self.user.pk, 'second')
+        with self.assertNumQueries(0):
+            recorder.touch(self.user.pk, 'first')
+        self.assertEqual(recorder.flush(), (2, 0))
+        self.assertGreater(self._session('first').last_activity, hour_ago)
+        self.assertFalse(self._session('second').is_active)
+
+        # Уже записанная сессия: активность из middleware обновляется через bulk_update
+        self.client.force_login(self.user)
+        key = self.client.session.session_key
+        recorder.record_login(self.user.pk, key, '127.0.0.1', 'test', at=hour_ago)
+        recorder.flush()
+        self.client.get(reverse('profile'))
+        self.assertEqual(recorder.flush(), (0, 1))
+        self.assertGreater(self._session(key).last_activity, hour_ago)
+
+    def test_purge_removes_only_stale_sessions(self):
+        old = timezone.now() - timedelta(days=40)
+        for i in range(3):
+            recorder.record_login(self.user.pk, f'old-{i}', '127.0.0.1', 'test', at=old)
+        recorder.record_login(self.user.pk, 'fresh', '127.0.0.1', 'test')
+        recorder.flush()
+
+        call_command('purge_sessions', '--days', '30', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(list(UserSession.objects.values_list('session_key', flat=True)), ['fresh'])
+
+
+def ledger_balances():
+    """{product_id: сумма движений журнала склада}"""
+    return dict(StockMovement.objects.values('product_id').annotate(total=Sum('delta'))
+                .values_list('product_id', 'total'))
+
+
+class StockLedgerTests(TestCase):
+    """Все изменения остатков проходят через журнал склада"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.user = create_buyer()
+        cls.products = create_phones(2)
+
+    def _assert_balanced(self, expected):
+        stocks = dict(Product.objects.values_list('id', 'stock'))
+        self.assertEqual(stocks, ledger_balances())
+        self.assertEqual([stocks[p.id] for p in self.products], expected)
+
+    def _save_order_in_admin(self, order, **data):
+        model_admin = admin.site._registry[Order]
+        request = RequestFactory().post('/')
+        request.user = self.admin
+        order = Order.objects.get(pk=order.pk)
+        form = model_admin.get_form(request, order, change=True)(
+            {'user': order.user_id, 'status': order.status, **data}, instance=order)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, True)
+
+    def test_all_order_paths_write_movements(self):
+        cart = {str(self.products[0].id): 3, str(self.products[1].id): 1}
+        first, _ = place_order(self.user, cart)
+        second, _ = place_order(self.user, cart)
+        third, _ = place_order(self.user, cart)
+        self._assert_balanced([1, 7])
+
+        self.assertTrue(delete_order(first.id))
+        self.assertFalse(Order.objects.filter(id=first.id).exists())
+        self._assert_balanced([4, 8])
+
+        self.assertEqual(cancel_orders([second.id], 'Нет в наличии'), [second.id])
+        self.assertEqual(cancel_orders([second.id], 'Повторно'), [])
+        self._assert_balanced([7, 9])
+
+        self._save_order_in_admin(third, status='cancelled', cancellation_reason='Передумал')
+        self._save_order_in_admin(third, status='cancelled', cancellation_reason='Передумал совсем')
+        self._assert_balanced([10, 10])
+
+        reasons = StockMovement.objects.filter(order_number=first.id).values_list('reason', flat=True)
+        self.assertEqual(sorted(set(reasons)), [StockMovement.ORDER_DELETE, StockMovement.SALE])
+
+    def test_admin_stock_edit_applies_difference(self):
+        product = self.products[0]
+        self.client.force_login(self.admin)
+        url = reverse('admin:main_product_change', args=[product.id])
+        form = self.client.get(url).context['adminform'].form
+        place_order(self.user, {str(product.id): 4})  # продажа, пока форма открыта
+
+        data = {name: value for name, value in form.initial.items() if value is not None and name != 'image'}
+        data.update({'category': product.category_id, 'stock': 15, 'initial-stock': 10})
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 11)  # +5 к остатку после продажи
+        self.assertEqual(ledger_balances()[product.id], 11)
+
+    def _order_action(self, action, orders, **data):
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:main_order_changelist'), {
+            'action': action, '_selected_action': [order.id for order in orders], **data,
+        }, follow=True)
+        self.assertEqual(response.status_code, 200)
+        return [str(message) for message in response.context['messages']]
+
+    def test_admin_order_actions(self):
+        cart = {str(self.products[0].id): 2, str(self.products[1].id): 1}
+        first, second, delivered = [place_order(self.user, cart)[0] for _ in range(3)]
+        Order.objects.filter(pk=delivered.pk).update(status='delivered')
+
+        messages = self._order_action('confirm_orders', [first, delivered])
+        self.assertEqual(messages, ['Подтверждено заказов: 1. Пропущено (не в статусе «Новый»): 1'])
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[o.id] for o in (first, second, delivered)], ['confirmed', 'new', 'delivered'])
+
+        # Остатки возвращаются пачками: по UPDATE на каждый товар
+        with mock.patch.object(stock, 'RESERVE_BATCH_SIZE', 1), CaptureQueriesContext(connection) as ctx:
+            messages = self._order_action('cancel_orders', [first, second, delivered],
+                                          cancellation_reason='Нет в наличии')
+        self.assertEqual(messages, ['Отменено заказов: 2. Пропущено (уже отменены или доставлены): 1'])
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "main_product"')]
+        self.assertEqual(len(updates), 2)
+        cancelled = Order.objects.filter(status='cancelled')
+        self.assertEqual(sorted(cancelled.values_list('id', flat=True)), [first.id, second.id])
+        self.assertEqual(set(cancelled.values_list('cancellation_reason', flat=True)), {'Нет в наличии'})
+        self._assert_balanced([8, 9])
+
+    def test_admin_stock_edit_rejects_oversold_difference(self):
+        product = self.products[0]
+        self.client.force_login(self.admin)
+        url = reverse('admin:main_product_change', args=[product.id])
+        form = self.client.get(url).context['adminform'].form
+        place_order(self.user, {str(product.id): 8})  # раскупили, пока форма открыта
+
+        data = {name: value for name, value in form.initial.items() if value is not None and name != 'image'}
+        data.update({'category': product.category_id, 'name': 'Переименован', 'stock': 5, 'initial-stock': 10})
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('stock', response.context['adminform'].form.errors)
+        self.assertNotContains(response, 'успешно')
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.stock), ('Телефон 0', 2))
+        self._assert_balanced([2, 10])
+
+    def test_admin_cannot_cancel_delivered_order(self):
+        order, _ = place_order(self.user, {str(self.products[0].id): 3})
+        Order.objects.filter(pk=order.pk).update(status='delivered')
+        model_admin = admin.site._registry[Order]
+        request = RequestFactory().post('/')
+        request.user = self.admin
+        order.refresh_from_db()
+        form = model_admin.get_form(request, order, change=True)(
+            {'user': order.user_id, 'status': 'cancelled', 'cancellation_reason': 'Поздно'}, instance=order)
+        self.assertFalse(form.is_valid())
+        self.assertIn('status', form.errors)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'delivered')
+        self._assert_balanced([7, 10])
+
+    def test_compaction_and_reconciliation(self):
+        place_order(self.user, {str(self.products[0].id): 2})
+        StockMovement.objects.update(created_at=timezone.now() - timedelta(days=60))
+        call_command('compact_stock', '--days', '30', stdout=StringIO())
+        movements = StockMovement.objects.filter(product=self.products[0])
+        self.assertEqual(list(movements.values_list('reason', 'delta')), [(StockMovement.COMPACTION, 8)])
+
+        Product.objects.filter(id=self.products[1].id).update(stock=3)  # в обход журнала
+        with self.assertRaises(CommandError):
+            call_command('compact_stock', '--verify', stdout=StringIO())
+        call_command('compact_stock', '--batch-size', '1', stdout=StringIO())
+        self._assert_balanced([8, 3])
+        call_command('compact_stock', '--verify', stdout=StringIO())
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    """Параллельные оформления и отмены не расходятся с журналом склада"""
+
+    def setUp(self):
+        self.user = create_buyer()
+        self.products = create_phones(2, stock=20)
+        self.orders = [place_order(self.user, {str(p.id): 2 for p in self.products})[0] for _ in range(4)]
+
+    def _retry(self, func, *args):
+        # SQLite в памяти не ждёт блокировку, а сразу сообщает о ней
+        for _ in range(100):
+            try:
+                return func(*args)
+            except CheckoutError:
+                return None  # товар закончился — обычный исход под нагрузкой
+            except OperationalError:
+                threading.Event().wait(0.005)
+        raise AssertionError('База так и не освободилась')
+
+    def test_parallel_checkouts_and_cancellations(self):
+        errors = []
+        rng = random.Random(0)
+        carts = [{str(p.id): rng.randint(1, 3) for p in self.products} for _ in range(12)]
+        order_ids = [order.id for order in self.orders]
+
+        def worker(jobs):
+            try:
+                for func, args in jobs:
+                    self._retry(func, *args)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        jobs = [[(place_order, (self.user, cart)) for cart in carts[i::4]] for i in range(4)]
+        # Отмены пересекаются: каждый заказ отменяют сразу два потока
+        jobs += [[(cancel_orders, ([order_id], 'Отмена')) for order_id in order_ids] for _ in range(2)]
+        threads = [threading.Thread(target=worker, args=(job,)) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        sold = dict(OrderItem.objects.exclude(order__status='cancelled').values('product_id')
+                    .annotate(qty=Sum('quantity')).values_list('product_id', 'qty'))
+        stocks = dict(Product.objects.values_list('id', 'stock'))
+        self.assertEqual(stocks, ledger_balances())
+        for product in self.products:
+            self.assertEqual(stocks[product.id], 20 - sold.get(product.id, 0))
+        self.assertEqual(Order.objects.filter(status='cancelled').count(), 4)
+
+
+def image_upload(name, width, height, mode='RGBA'):
+    buffer = BytesIO()
+    Image.new(mode, (width, height), (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ThumbnailTests(TestCase):
+    """Копии фото строятся после сохранения и выводятся через srcset"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = create_category()
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media, THUMBNAILS={**thumbnails.DEFAULTS, 'BACKGROUND': False})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+    def _create(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.category, stock=1, image=upload)
+        product.refresh_from_db()
+        return product
+
+    def test_thumbnails_are_built_and_rendered(self):
+        product = self._create(image_upload('phone.png', 1200, 600))
+        data = product.image_thumbnails
+        self.assertEqual(data['source'], product.image.name)
+        self.assertEqual([w for w, _, _ in data['webp']], [240, 480, 960])
+        self.assertEqual(data['jpeg'][0][:2], [240, 120])
+        for _, _, name in data['webp'] + data['jpeg']:
+            self.assertTrue(default_storage.exists(name))
+            self.assertIn(f".{data['hash']}.", os.path.basename(name))
+
+        response = self.client.get(reverse('catalog'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, f"{default_storage.url(data['jpeg'][-1][2])} 960w")
+        response = self.client.get(reverse('product_detail', args=[product.slug]))
+        self.assertContains(response, 'loading="eager"')
+
+    def test_replacing_and_clearing_image(self):
+        product = self._create(image_upload('phone.png', 300, 300, mode='RGB'))
+        old = thumbnails.stored_names(product.image_thumbnails)
+        self.assertEqual([w for w, _, _ in product.image_thumbnails['jpeg']], [240, 300])
+
+        product.image = image_upload('other.png', 500, 250)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_thumbnails['source'], product.image.name)
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+        current = thumbnails.stored_names(product.image_thumbnails)
+        product.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_thumbnails, {})
+        self.assertFalse(any(default_storage.exists(name) for name in current))
+
+
+class StaticPipelineTests(TestCase):
+    """collectstatic: хеш в именах, минификация, .gz и отдача по Accept-Encoding"""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(STATIC_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_minifiers_keep_strings_and_regexes(self):
+        css = '/* шапка */\n.a > .b ,\n.c {\n  content: "a  ;  b";\n  color: red;\n}\n'
+        self.assertEqual(staticfiles.minify_css(css), '.a>.b,.c{content:"a  ;  b";color:red}')
+        js = "  var s = '// не комментарий'; /* x */\n\n  var r = /a\\/b/g; // хвост\n  x = a / b;\n"
+        self.assertEqual(staticfiles.minify_js(js), "var s = '// не комментарий';\nvar r = /a\\/b/g;\nx = a / b;\n")
+
+    def test_build_and_serve(self):
+        out = StringIO()
+        call_command('build_static', stdout=out)
+        self.assertIn('gzip', out.getvalue())
+
+        hashed = staticfiles_storage.stored_name('css/style.css')
+        self.assertRegex(hashed, r'^css/style\.[0-9a-f]{12}\.css$')
+        self.assertIn(hashed, self.client.get(reverse('home')).content.decode())
+        with staticfiles_storage.open(hashed) as f:
+            minified = f.read()
+        self.assertLess(len(minified), os.path.getsize(staticfiles.finders.find('css/style.css')))
+        with staticfiles_storage.open(hashed + '.gz') as f:
+            self.assertEqual(gzip.decompress(f.read()), minified)
+
+        factory = RequestFactory()
+        response = staticfiles.serve(factory.get('/', HTTP_ACCEPT_ENCODING='gzip, br;q=0'), hashed)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), minified)
+
+        response = staticfiles.serve(factory.get('/', HTTP_ACCEPT_ENCODING='gzip;q=0'), hashed)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), minified)
+        response = staticfiles.serve(factory.get('/'), 'css/style.css')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        response.close()
+        response = staticfiles.serve(factory.get('/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']),
+                                     'css/style.css')
+        self.assertEqual(response.status_code, 304)
+        with self.assertRaises(Http404):
+            staticfiles.serve(factory.get('/'), '../settings.py')
+
+
+class ConditionalGetTests(TestCase):
+    """Повторный запрос каталога и карточки получает 304 без запросов к БД"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = create_category()
+        cls.product = create_product(cls.category, stock=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_catalog_not_modified_until_stock_changes(self):
+        url = reverse('catalog') + '?sort=price'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        # Другие параметры — другая страница
+        self.assertEqual(self.client.get(reverse('catalog'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.adjust(self.product, -2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_page_depends_on_session(self):
+        url = reverse('product_detail', args=[self.product.slug])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # После входа шапка другая — cookie сессии входит в ETag
+        create_buyer()
+        self.client.login(username='buyer', password='secret1')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.product.name = 'Телефон 2'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']), 'Телефон 2')
+
+
+class ExportTests(TestCase):
+    """Потоковая выгрузка заказов и товаров: фильтры, формат, число запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        customer = create_buyer(first_name='Иван', last_name='Петров')
+        cls.product = create_product(name='Телефон, "новый"', stock=100)
+        cls.orders = []
+        for days, status in ((40, 'delivered'), (5, 'new'), (1, 'new')):
+            order = Order.objects.create(user=customer, status=status)
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+            OrderItem.objects.create(order=order, product=cls.product, quantity=2, price=100)
+            cls.orders.append(order)
+        cls.empty = Order.objects.create(user=customer)
+
+    def test_command_filters_and_csv(self):
+        out = StringIO()
+        since = (timezone.localdate() - timedelta(days=10)).isoformat()
+        call_command('export_data', 'orders', '--from', since, '--status', 'new', stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(tuple(rows[0]), export.ORDER_COLUMNS + export.ITEM_COLUMNS)
+        self.assertEqual([int(r[0]) for r in rows[1:]], [self.orders[1].id, self.orders[2].id, self.empty.id])
+        self.assertEqual(rows[1][9], 'Телефон, "новый"')
+        self.assertEqual(rows[1][-1], '200.00')
+        self.assertEqual(rows[-1][8:], [''] * len(export.ITEM_COLUMNS))
+
+        out = StringIO()
+        call_command('export_data', 'orders', '--format', 'json', '--to',
+                     (timezone.localdate() - timedelta(days=30)).isoformat(), stdout=out)
+        data = json.loads(out.getvalue())
+        self.assertEqual([o['order_id'] for o in data], [self.orders[0].id])
+        self.assertEqual(data[0]['items'][0]['quantity'], 2)
+
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'orders', '--from', '01.01.2024')
+
+    def test_queries_per_chunk(self):
+        # Заказы читаются одним курсором по пачкам, позиции — запросом на пачку
+        with self.assertNumQueries(3):
+            rows = list(export.order_rows(Order.objects.all(), chunk_size=2))
+        self.assertEqual(len(rows), 4)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(export.product_rows(Product.objects.all()))), 1)
+
+    def test_admin_actions_stream(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:main_order_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.orders[0].pk, self.empty.pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertEqual(len(list(csv.reader(StringIO(content)))), 3)
+
+        response = self.client.post(reverse('admin:main_product_changelist'), {
+            'action': 'export_json', '_selected_action': [self.product.pk],
+        })
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data[0]['slug'], 'phone')
+
+    async def test_admin_export_streams_under_asgi(self):
+        produced = []
+        real_stream = export.stream
+
+        def counting_stream(*args, **kwargs):
+            for line in real_stream(*args, **kwargs):
+                produced.append(line)
+                yield line
+
+        await self.async_client.aforce_login(self.admin)
+        ids = [order.pk for order in self.orders] + [self.empty.pk]
+        with mock.patch.object(export, 'stream', counting_stream), mock.patch.object(export, 'ASYNC_LINES', 2):
+            response = await self.async_client.post(reverse('admin:main_order_changelist'), {
+                'action': 'export_csv', '_selected_action': ids,
+            })
+            self.assertTrue(response.is_async)
+            chunks = response.streaming_content
+            first = await anext(chunks)
+            # Прочитана только первая пачка, а не вся выгрузка
+            self.assertEqual(len(produced), 2)
+            rest = [chunk async for chunk in chunks]
+        content = b''.join([first, *rest]).decode('utf-8-sig')
+        self.assertEqual(len(list(csv.reader(StringIO(content)))), 5)
+        self.assertEqual(len(produced), 5)
+
+
+@override_settings(PROFILE_ORDERS_PAGE_SIZE=5)
+class ProfileOrderHistoryTests(TestCase):
+    """История заказов в профиле: страницы по курсору, фильтр статуса, позиции по запросу"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_buyer()
+        cls.product = create_product(stock=100)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _create_orders(self, count, status='new'):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, status=status)
+            OrderItem.objects.create(order=order, product=self.product, quantity=2, price=100)
+            orders.append(order)
+        return orders
+
+    def _page(self, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('profile'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_pages_and_constant_queries(self):
+        self._create_orders(3)
+        _, few = self._page()
+        orders = self._create_orders(4, status='cancelled') + self._create_orders(5)
+        response, many = self._page()
+        self.assertEqual(few, many)
+
+        self.assertEqual([o.id for o in response.context['orders']], [o.id for o in orders[::-1][:5]])
+        self.assertEqual(response.context['orders_total'], 12)
+        seen = []
+        while True:
+            seen += [o.id for o in response.context['orders']]
+            url = response.context['next_page_url']
+            if not url:
+                break
+            response = self.client.get(reverse('profile') + url)
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(len(set(seen)), 12)
+
+        response, _ = self._page({'status': 'cancelled'})
+        self.assertEqual([o.id for o in response.context['orders']], [o.id for o in orders[3::-1]])
+        self.assertIsNone(response.context['next_page_url'])
+        self.assertContains(response, 'Отменен (4)')
+
+    @override_settings(PROFILE_ORDERS_PAGE_SIZE=2)
+    def test_foreign_and_garbage_cursors_give_first_page(self):
+        self._create_orders(3)
+        first = [o.id for o in self._page()[0].context['orders']]
+        catalog_cursor = pagination.encode_cursor(['Телефон', 1], ('name', 'id'))
+        # Курсоры того же порядка (после них заказов нет), но без области, другого
+        # пользователя или другого фильтра статуса
+        last = [timezone.now() - timedelta(days=1), 1]
+        unscoped = pagination.encode_cursor(last, ORDER_HISTORY_ORDERING)
+        other_user = pagination.encode_cursor(last, ORDER_HISTORY_ORDERING, scope=f'profile:{self.user.pk + 1}:')
+        other_status = pagination.encode_cursor(last, ORDER_HISTORY_ORDERING,
+                                                scope=f'profile:{self.user.pk}:cancelled')
+        for cursor in (catalog_cursor, unscoped, other_user, other_status, 'garbage'):
+            response, _ = self._page({'cursor': cursor})
+            self.assertEqual([o.id for o in response.context['orders']], first)
+
+    def test_order_items_endpoint(self):
+        order = self._create_orders(1)[0]
+        with self.assertNumQueries(3):  # сессия, пользователь, позиции
+            data = self.client.get(reverse('api_order_items', args=[order.id])).json()
+        self.assertEqual(data['items'], [{'product_id': self.product.id, 'name': 'Телефон', 'slug': 'phone',
+                                          'quantity': 2, 'price': '100.00', 'line_total': '200.00'}])
+
+        other = create_buyer('other')
+        foreign = Order.objects.create(user=other)
+        OrderItem.objects.create(order=foreign, product=self.product, quantity=1, price=100)
+        self.assertEqual(self.client.get(reverse('api_order_items', args=[foreign.id])).status_code, 404)
+
+
+def rollup_snapshot():
+    days = {row.pop('day'): row for row in DailySales.objects.values('day', *rollups.DAY_FIELDS)}
+    products = {(row.pop('day'), row.pop('product_id')): row
+                for row in DailyProductSales.objects.values('day', 'product_id', 'category_id', *rollups.PRODUCT_FIELDS)}
+    return days, products
+
+
+class SalesRollupTests(TestCase):
+    """Дневные итоги продаж меняются вместе с заказами и совпадают с пересчётом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.user = create_buyer()
+        cls.phone = create_product(price=Decimal('99.90'), stock=50)
+        cls.laptop = create_product(create_category('laptops', 'Ноутбуки'), name='Ноутбук', slug='laptop',
+                                    model='L1', price=1000, stock=50)
+
+    def test_incremental_matches_rebuild(self):
+        first, _ = place_order(self.user, {str(self.phone.id): 2, str(self.laptop.id): 1})
+        second, _ = place_order(self.user, {str(self.phone.id): 1})
+        third, _ = place_order(self.user, {str(self.laptop.id): 3})
+        old, _ = place_order(self.user, {str(self.phone.id): 4})
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=3))
+        cancel_orders([second.id], 'Передумал')
+        delete_order(third.id)
+
+        day = DailySales.objects.get(day=timezone.localdate())
+        self.assertEqual((day.orders, day.cancelled_orders, day.units, day.cancelled_units),
+                         (3, 1, 8, 1))
+        self.assertEqual(day.revenue - day.cancelled_revenue, Decimal('1599.40'))
+
+        # Заказ, перенесённый в прошлое в обход rollups, попадает в свой день только после пересчёта
+        incremental = rollup_snapshot()
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertIn('дней с продажами 2', out.getvalue())
+        days, products = rollup_snapshot()
+        self.assertEqual(days[timezone.localdate() - timedelta(days=3)]['units'], 4)
+        today = timezone.localdate()
+        incremental[0][today]['orders'] -= 1
+        incremental[0][today]['units'] -= 4
+        incremental[0][today]['revenue'] -= Decimal('399.60')
+        incremental[1][(today, self.phone.id)]['units'] -= 4
+        incremental[1][(today, self.phone.id)]['revenue'] -= Decimal('399.60')
+        self.assertEqual(incremental[0][today], days[today])
+        self.assertEqual(incremental[1], {key: row for key, row in products.items() if key[0] == today})
+
+    def test_admin_uncancel_and_dashboard(self):
+        order, _ = place_order(self.user, {str(self.phone.id): 1, str(self.laptop.id): 2})
+        cancel_orders([order.id], 'Нет в наличии')
+        self.assertEqual(DailySales.objects.get().cancelled_orders, 1)
+
+        self.client.force_login(self.admin)
+        order.refresh_from_db()
+        response = self.client.post(reverse('admin:main_order_change', args=[order.id]), {
+            'user': order.user_id, 'status': 'confirmed', 'cancellation_reason': '',
+            'items-TOTAL_FORMS': 2, 'items-INITIAL_FORMS': 2, 'items-MIN_NUM_FORMS': 0, 'items-MAX_NUM_FORMS': 1000,
+            **{f'items-{i}-id': item.id for i, item in enumerate(order.items.order_by('id'))},
+            **{f'items-{i}-order': order.id for i in range(2)},
+        })
+        self.assertEqual(response.status_code, 302)
+        row = DailySales.objects.get()
+        self.assertEqual((row.orders, row.cancelled_orders, row.cancelled_units), (1, 0, 0))
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('admin:main_dailysales_changelist'), {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'main_order' in q['sql']])
+        self.assertEqual(response.context['totals']['net_revenue'], Decimal('2099.90'))
+        self.assertEqual([row['product__name'] for row in response.context['products']], ['Ноутбук', 'Телефон'])
+        self.assertContains(response, 'Ноутбуки')
+
+
+    def test_orders_without_rollups_do_not_go_negative(self):
+        # Заказы из времени до итогов: в DailySales их нет
+        legacy = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=legacy, product=self.phone, quantity=2, price=100)
+        cancelled = Order.objects.create(user=self.user, status='cancelled')
+        OrderItem.objects.create(order=cancelled, product=self.phone, quantity=1, price=100)
+        with self.assertLogs('main.rollups', 'WARNING'):
+            delete_order(legacy.id)
+            rollups.orders_cancelled([cancelled.id], sign=-1)
+        self.assertFalse(DailySales.objects.exists())
+        self.assertFalse(DailyProductSales.objects.exists())
+
+        # Итог дня меньше, чем вычитается (позицию добавили в обход rollups) — обрезается до нуля
+        order, _ = place_order(self.user, {str(self.phone.id): 1})
+        OrderItem.objects.create(order=order, product=self.laptop, quantity=5, price=1000)
+        with self.assertLogs('main.rollups', 'WARNING'):
+            delete_order(order.id)
+        day = DailySales.objects.get()
+        self.assertEqual((day.orders, day.units, day.revenue), (0, 0, 0))
+
+
+class DatabaseProfileTests(TestCase):
+    """Профиль SQLite применяется к новым соединениям, чтение каталога уходит на реплику"""
+
+    def _connect(self, profile):
+        path = os.path.join(tempfile.mkdtemp(), 'profile.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': path, 'OPTIONS': {'profile': profile}},
+                                  alias='profile_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def _pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_concurrent_profile(self):
+        wrapper = self._connect('concurrent')
+        self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self._pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma(wrapper, 'busy_timeout'), 5000)
+        with CaptureQueriesContext(wrapper) as ctx:
+            wrapper._start_transaction_under_autocommit()
+        wrapper.connection.rollback()
+        self.assertEqual([q['sql'] for q in ctx.captured_queries], ['BEGIN IMMEDIATE'])
+
+    def test_default_profile_keeps_sqlite_defaults(self):
+        wrapper = self._connect('default')
+        self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'delete')
+        with CaptureQueriesContext(wrapper) as ctx:
+            wrapper._start_transaction_under_autocommit()
+        wrapper.connection.rollback()
+        self.assertEqual([q['sql'] for q in ctx.captured_queries], ['BEGIN'])
+
+    def test_replica_routing(self):
+        router = db_router.ReplicaRouter()
+        with mock.patch.object(db_router, 'replica_available', return_value=True):
+            # Вне запроса — основная БД
+            self.assertEqual(router.db_for_read(Product), 'default')
+            state = db_router.RequestState(replica=True)
+            with db_router.activate(state):
+                # TestCase держит открытую транзакцию: чтение в ней — из default
+                with mock.patch.object(connection, 'in_atomic_block', False):
+                    self.assertEqual(router.db_for_read(Product), 'replica')
+                    # Сессии — всегда из основной БД, их запись не закрепляет за ней
+                    self.assertEqual(router.db_for_read(Session), 'default')
+                    router.db_for_write(Session)
+                    self.assertFalse(state.wrote)
+
+                    # Состояние запроса доходит до потоков sync_to_async
+                    async def view():
+                        return await sync_to_async(router.db_for_read)(Product)
+
+                    self.assertEqual(async_to_sync(view)(), 'replica')
+                    # После записи запрос читает из основной БД
+                    self.assertEqual(router.db_for_write(Product), 'default')
+                    self.assertTrue(state.wrote)
+                    self.assertEqual(router.db_for_read(Product), 'default')
+        # Тестовое зеркало указывает на ту же БД — реплики нет
+        self.assertFalse(db_router.replica_available())
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Чтение с реплики (второй файл SQLite) и чтение своих записей после оформления"""
+    databases = '__all__'
+
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self._use_replica({**connection.settings_dict, 'NAME': path})
+
+        self.user = create_buyer()
+        self.product = create_product(stock=20)
+        call_command('sync_replica', stdout=StringIO())
+        self.client.force_login(self.user)
+
+    def _use_replica(self, settings_dict):
+        if db_router.REPLICA not in connections.settings:
+            connections.settings[db_router.REPLICA] = settings_dict
+            self.addCleanup(connections.settings.pop, db_router.REPLICA)
+            self.addCleanup(connections.__delitem__, db_router.REPLICA)
+            self.addCleanup(lambda: connections[db_router.REPLICA].close())
+            return
+        # Реплика из настроек (DB_REPLICA) в тестах — зеркало default: на время
+        # теста она указывает на отдельный файл
+        replica = connections[db_router.REPLICA]
+        replica.close()
+        self.addCleanup(setattr, replica, 'settings_dict', replica.settings_dict)
+        self.addCleanup(replica.close)
+        replica.settings_dict = settings_dict
+
+    def _orders_total(self):
+        return self.client.get(reverse('profile')).context['orders_total']
+
+    def test_read_your_writes(self):
+        cookie = db_router.get_config()['COOKIE_NAME']
+        place_order(self.user, {str(self.product.id): 1})
+        # Реплика ещё не получила заказ
+        self.assertEqual(self._orders_total(), 0)
+
+        session = self.client.session
+        session['cart'] = {str(self.product.id): 1}
+        session.save()
+        response = self.client.post(reverse('api_checkout'), {'password': 'secret1'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn(cookie, response.cookies)
+        # Окно после записи: профиль читается из основной БД
+        self.assertEqual(self._orders_total(), 2)
+
+        self.client.cookies[cookie] = '0'
+        self.assertEqual(self._orders_total(), 0)
+        call_command('sync_replica', stdout=StringIO())
+        self.assertEqual(self._orders_total(), 2)
+
+    def test_shared_caches_are_filled_from_primary(self):
+        self.client.logout()
+        self.product.name = 'Телефон Про'
+        self.product.save()
+        # Реплика отстаёт, но кэш товара и сетки каталога под новой версией
+        # заполняется из основной БД — иначе старое имя видели бы все
+        self.assertContains(self.client.get(reverse('product_detail', args=['phone'])), 'Телефон Про')
+        self.assertContains(self.client.get(reverse('catalog')), 'Телефон Про')
+        self.assertNotContains(self.client.get(reverse('catalog')), 'Телефон<')
@@ -0,0 +1,205 @@
+# main/thumbnails.py
+"""Уменьшенные копии загруженных изображений (Product.image, UserProfile.avatar).
+
+После сохранения нового файла (сигналы в main/models.py, после коммита)
+фоновый пул строит WebP и JPEG нескольких ширин из THUMBNAILS['WIDTHS'] и
+кладёт их рядом с оригиналом в подкаталог thumbs/. В имя входит хеш
+содержимого оригинала: при замене картинки меняется и имя, поэтому
+thumbs/ можно отдавать с Cache-Control: immutable и сроком в год.
+
+Список копий хранится в JSON-поле модели (<поле>_thumbnails) и читается
+тегом {% responsive_image %} без обращения к хранилищу. Заполнить его для
+уже загруженных картинок — команда generate_thumbnails.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('main.thumbnails')
+
+DEFAULTS = {
+    # Ширины копий по полям моделей
+    'WIDTHS': {
+        'main.Product.image': (240, 480, 960),
+        'main.UserProfile.avatar': (64, 128, 256),
+    },
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    # False — строить копии сразу после коммита в потоке запроса (тесты, отладка)
+    'BACKGROUND': True,
+}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+THUMBS_DIR = 'thumbs'
+EXIF_ORIENTATION = 0x0112
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THUMBNAILS', {})}
+
+
+def thumbnails_field(field_name):
+    return f'{field_name}_thumbnails'
+
+
+def widths_for(model, field_name):
+    return tuple(get_config()['WIDTHS'].get(f'{model._meta.label}.{field_name}', ()))
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_config()['WORKERS'], thread_name_prefix='thumbnails')
+        return _executor
+
+
+def image_saved(instance, field_name, update_fields=None):
+    """post_save: построить копии новой картинки или убрать копии удалённой.
+
+    Копии строятся и тогда, когда в JSON-поле описаны копии другого файла:
+    так же чинится поле, перезаписанное сохранением устаревшего экземпляра.
+    """
+    if update_fields is not None and field_name not in update_fields:
+        return
+    name = getattr(instance, field_name).name or ''
+    current = getattr(instance, thumbnails_field(field_name)) or {}
+    if name and current.get('source') != name:
+        schedule(instance, field_name)
+    elif not name and current:
+        type(instance).objects.filter(pk=instance.pk).update(**{thumbnails_field(field_name): {}})
+        setattr(instance, thumbnails_field(field_name), {})
+        transaction.on_commit(lambda: remove(stored_names(current)))
+
+
+def schedule(instance, field_name):
+    """Построить копии изображения после коммита текущей транзакции"""
+    model, pk = type(instance), instance.pk
+    name = getattr(instance, field_name).name
+
+    def run():
+        if get_config()['BACKGROUND']:
+            _get_executor().submit(_generate_in_worker, model, pk, field_name, name)
+        else:
+            generate(model, pk, field_name, name)
+
+    transaction.on_commit(run)
+
+
+def _generate_in_worker(model, pk, field_name, name):
+    try:
+        generate(model, pk, field_name, name)
+    except Exception:
+        logger.exception('Не удалось построить копии %s', name)
+    finally:
+        close_old_connections()
+
+
+def thumbnail_name(name, digest, width, fmt):
+    """products/a.png -> products/thumbs/a.<хеш>.<ширина>.webp"""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    extension = 'jpg' if fmt == 'jpeg' else fmt
+    return os.path.join(directory, THUMBS_DIR, f'{stem}.{digest}.{width}.{extension}')
+
+
+def _encode(image, width, fmt, quality):
+    height = max(1, round(image.height * width / image.width))
+    resized = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+    if fmt == 'jpeg' and resized.mode != 'RGB':
+        # У JPEG нет прозрачности — подложить белый фон
+        background = Image.new('RGB', resized.size, 'white')
+        background.paste(resized, mask=resized.getchannel('A') if 'A' in resized.getbands() else None)
+        resized = background
+    buffer = BytesIO()
+    resized.save(buffer, format=fmt.upper(), quality=quality, optimize=True,
+                 **({'progressive': True} if fmt == 'jpeg' else {'method': 4}))
+    return buffer.getvalue(), height
+
+
+def build(name, widths, storage=default_storage):
+    """Построить копии файла name; возвращает описание для JSON-поля модели"""
+    config = get_config()
+    with storage.open(name, 'rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    with Image.open(BytesIO(data)) as original:
+        width, height = original.size
+        if original.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        if widths and original.format == 'JPEG':
+            # JPEG декодируется сразу в уменьшенном масштабе, не меньше нужного по обеим сторонам
+            largest = max(widths)
+            original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    # Не увеличивать: ширины больше оригинала заменяются его собственной шириной
+    targets = sorted({min(target, width, image.width) for target in widths})
+    result = {'source': name, 'hash': digest, 'width': width, 'height': height}
+    for fmt in config['FORMATS']:
+        variants = []
+        for target in targets:
+            thumb = thumbnail_name(name, digest, target, fmt)
+            if storage.exists(thumb):
+                # Копия с тем же хешем уже есть — тот же файл, кодировать заново не нужно
+                target_height = max(1, round(height * target / width))
+            else:
+                encoded, target_height = _encode(image, target, fmt, config['QUALITY'])
+                storage.save(thumb, ContentFile(encoded))
+            variants.append([target, target_height, thumb])
+        result[fmt] = variants
+    return result
+
+
+def stored_names(thumbnails):
+    return {thumb for fmt in CONTENT_TYPES for _, _, thumb in (thumbnails or {}).get(fmt, ())}
+
+
+def generate(model, pk, field_name, name=None):
+    """Построить копии и записать их в модель, если картинка за это время не сменилась.
+
+    Возвращает описание копий или None, если строить нечего.
+    """
+    field = thumbnails_field(field_name)
+    row = model.objects.filter(pk=pk).values_list(field_name, field).first()
+    if row is None or not row[0] or (name is not None and row[0] != name):
+        return None
+    name, previous = row
+    thumbnails = build(name, widths_for(model, field_name))
+    updated = model.objects.filter(pk=pk, **{field_name: name}).update(**{field: thumbnails})
+    if updated:
+        remove(stored_names(previous) - stored_names(thumbnails))
+        _invalidate(model, pk)
+    return thumbnails
+
+
+def remove(names, storage=default_storage):
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning('Не удалось удалить %s', name)
+
+
+def _invalidate(model, pk):
+    # Копии показываются в кэшированных фрагментах каталога и карточках товаров
+    Product = apps.get_model('main', 'Product')
+    if model is Product:
+        from . import product_cache
+        from .catalog import invalidate_categories
+        category_id, slug = Product.objects.filter(pk=pk).values_list('category_id', 'slug').get()
+        product_cache.invalidate([pk], slugs=[slug])
+        invalidate_categories([category_id])
@@ -16,7 +16,12 @@ urlpatterns = [
     path('api/register', views.api_register, name='api_register'),
     path('api/login', views.api_login, name='api_login'),
     path('api/profile/update', views.api_profile_update, name='api_profile_update'),
+    path('api/search/suggest', views.api_search_suggest, name='api_search_suggest'),
     path('api/cart/add', views.api_cart_add, name='api_cart_add'),
+    path('api/cart/update', views.api_cart_update, name='api_cart_update'),
     path('api/checkout', views.api_checkout, name='api_checkout'),
+    path('api/order/<int:order_id>/items', views.api_order_items, name='api_order_items'),
     path('api/order/<int:order_id>/delete', views.api_order_delete, name='api_order_delete'),
+    # Служебное
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
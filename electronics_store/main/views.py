@@ -1,15 +1,32 @@
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
 from django.contrib.auth.models import User
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import alogin, logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.utils import timezone
+from django.conf import settings
 from django.db import transaction
-from .models import UserProfile, UserSession, Product, Category, Order, OrderItem
+from django.db.models import Count
+from .models import UserProfile, UserSession, Order, OrderItem
+from .checkout import place_order, delete_order, CheckoutError
+from .pagination import paginate
+from . import catalog as catalog_cache
+from .conditional import conditional_page
+from . import facets
+from . import metrics
+from . import product_cache
+from . import search
+from .activity import recorder
+from .cart import aget_cart, get_cart
+from . import hashing
 from django.views.decorators.http import require_POST
+from urllib.parse import urlencode
+from decimal import Decimal
 import json
 import re
 
@@ -17,148 +34,243 @@ import re
 def home(request):
     return render(request, 'index.html')
 
-def catalog(request):
-    """Каталог с фильтрами и сортировкой, минимум JS, всё на сервере"""
-    qs = Product.objects.filter(in_stock=True)
-
-    # Фильтр по категории (slug)
-    category_slug = request.GET.get('category')
-    active_category = None
-    if category_slug:
-        active_category = Category.objects.filter(slug=category_slug).first()
-        if active_category:
-            qs = qs.filter(category=active_category)
-
-    # Сортировка
-    sort = request.GET.get('sort')  # year|name|price
-    sort_map = {
-        'year': 'year',
-        'name': 'name',
-        'price': 'price',
-    }
-    if sort in sort_map:
-        qs = qs.order_by(sort_map[sort])
-    else:
-        qs = qs.order_by('-created_at')  # по новизне
+# Страница зависит от списка категорий и товаров всех категорий (счётчики фасетов)
+@conditional_page(catalog_cache.CATEGORIES_SCOPE, catalog_cache.ALL_SCOPE)
+async def catalog(request):
+    """Каталог с фильтрами и сортировкой, минимум JS, всё на сервере.
+
+    Асинхронное представление: кэш и ORM вызываются в асинхронном варианте.
+    """
+    categories = await catalog_cache.aget_categories()
+
+    # Категория, страна, диапазоны года и цены, строка поиска
+    filters = facets.Filters.from_request(request.GET, categories)
+
+    # Сортировка: new|year|name|price, по умолчанию по новизне
+    sort = request.GET.get('sort')
+    if sort not in catalog_cache.SORTS:
+        sort = 'new'
 
+    # Счётчики фасетов считаются по кэшированной таблице сочетаний; сетка
+    # товаров берётся из кэша фрагментов, queryset выполняется только при промахе
+    products_qs, facet_counts = await facets.afacet_search(filters)
+    cursor = request.GET.get('cursor', '')
+    products_html, next_cursor = await catalog_cache.aget_products_fragment(products_qs, filters, sort, cursor)
+
+    sort_params = [('sort', sort)] if sort != 'new' else []
+    params = filters.params() + sort_params
     context = {
-        'products': qs.select_related('category'),
-        'categories': Category.objects.all(),
-        'active_category': active_category,
-        'active_sort': sort or 'new',
+        'products_html': products_html,
+        'categories': categories,
+        'active_category': filters.category,
+        'active_sort': sort,
+        'search_query': filters.query,
+        'filters': filters,
+        'facets': facets.options(facet_counts, filters, categories),
+        # Ссылки категорий и сортировок сохраняют остальные фильтры
+        'category_query': urlencode(filters.params(exclude=('category',)) + sort_params, doseq=True),
+        'filter_query': urlencode(filters.params(), doseq=True),
+        'first_page_url': f'?{urlencode(params, doseq=True)}' if cursor else None,
+        'next_page_url': f'?{urlencode(params + [("cursor", next_cursor)], doseq=True)}' if next_cursor else None,
     }
-    return render(request, 'catalog.html', context)
+    # Контекстные процессоры (user, messages) читают сессию, у которой в
+    # Django 5.0 нет асинхронного API, поэтому страница рендерится в потоке
+    return await sync_to_async(render)(request, 'catalog.html', context)
+
+def api_search_suggest(request):
+    """Подсказки для строки поиска: до 10 товаров в наличии"""
+    query = request.GET.get('q', '').strip()[:search.QUERY_MAX_LENGTH]
+    return JsonResponse({'ok': True, 'items': search.suggest(query)})
 
 def contacts(request):
     return render(request, 'contacts.html')
 
+# Порядок истории заказов в профиле; id — для стабильного порядка при равном времени
+ORDER_HISTORY_ORDERING = ('-created_at', '-id')
+
 @login_required
 def profile(request):
-    """Страница профиля пользователя"""
+    """Страница профиля пользователя.
+
+    История заказов — страницами по курсору (main/pagination.py) с фильтром
+    по статусу; позиции заказа подгружаются при раскрытии (api_order_items),
+    поэтому число запросов не зависит от числа заказов.
+    """
     user_profile = request.user.userprofile
-    # Получаем заказы пользователя, упорядоченные от новых к старым
-    orders = Order.objects.filter(user=request.user).prefetch_related('items__product').order_by('-created_at')
+    statuses = dict(Order.STATUS_CHOICES)
+    status = request.GET.get('status')
+    if status not in statuses:
+        status = None
+    # Счётчики для вкладок статусов — один GROUP BY
+    counts = dict(
+        Order.objects.filter(user=request.user).order_by()
+        .values('status').annotate(n=Count('id')).values_list('status', 'n')
+    )
+    orders_qs = Order.objects.filter(user=request.user)
+    if status:
+        orders_qs = orders_qs.filter(status=status)
+    cursor = request.GET.get('cursor', '')
+    page_size = getattr(settings, 'PROFILE_ORDERS_PAGE_SIZE', 20)
+    # Курсор привязан к пользователю и фильтру: чужой даёт первую страницу
+    orders, next_cursor = paginate(orders_qs, ORDER_HISTORY_ORDERING, cursor, page_size,
+                                   scope=f'profile:{request.user.pk}:{status or ""}')
+    status_params = [('status', status)] if status else []
     context = {
         'user_profile': user_profile,
         'user_sessions': UserSession.objects.filter(user=request.user, is_active=True).order_by('-last_activity')[:5],
-        'orders': orders
+        'orders': orders,
+        'orders_total': sum(counts.values()),
+        'active_status': status,
+        'status_tabs': [
+            {'value': value, 'label': label, 'count': counts.get(value, 0),
+             'query': urlencode({'status': value})}
+            for value, label in Order.STATUS_CHOICES if counts.get(value)
+        ],
+        'first_page_url': f'?{urlencode(status_params)}' if cursor else None,
+        'next_page_url': f'?{urlencode(status_params + [("cursor", next_cursor)])}' if next_cursor else None,
     }
     return render(request, 'profile.html', context)
 
+@login_required
+def api_order_items(request, order_id):
+    """Позиции заказа текущего пользователя — для раскрытия строки в истории заказов"""
+    items = list(
+        OrderItem.objects.filter(order_id=order_id, order__user=request.user)
+        .order_by('id').values_list('product_id', 'product__name', 'product__slug', 'quantity', 'price')
+    )
+    if not items and not Order.objects.filter(id=order_id, user=request.user).exists():
+        return JsonResponse({'ok': False, 'error': 'Заказ не найден'}, status=404)
+    return JsonResponse({'ok': True, 'items': [
+        {'product_id': pid, 'name': name, 'slug': slug, 'quantity': qty,
+         'price': str(price), 'line_total': str(price * qty)}
+        for pid, name, slug, qty, price in items
+    ]})
+
 def logout_view(request):
     """Выход из системы"""
     if request.user.is_authenticated:
-        # Деактивация сессий пользователя
+        # Деактивация сессий пользователя (в том числе ещё не записанной из буфера)
+        recorder.end(request.user.pk, request.session.session_key)
         UserSession.objects.filter(user=request.user, session_key=request.session.session_key).update(is_active=False)
         logout(request)
         messages.success(request, 'Вы успешно вышли из системы')
     return redirect('home')
 
 def cart(request):
-    # Корзина хранится в сессии как словарь {product_id: qty}
-    cart = request.session.get('cart', {})
+    # Корзина — словарь {product_id: qty}, хранилище задаётся CART_STORAGE (см. main/cart.py)
+    cart = get_cart(request)
     items = []
-    total = 0
+    total = Decimal(0)
     if cart:
-        products = Product.objects.filter(id__in=cart.keys())
+        products = product_cache.get_products(cart.items.keys()).values()
         for p in products:
-            qty = max(0, min(int(cart.get(str(p.id), 0)), p.stock))
-            line = float(p.price) * qty
+            qty = max(0, min(cart.get(p.id), p.stock))
+            line = p.price * qty
             total += line
             items.append({ 'product': p, 'qty': qty, 'line': line })
     return render(request, 'cart.html', { 'items': items, 'total': total })
 
+# Любое изменение товара увеличивает версию ALL_SCOPE, категории — и поколение кэша товаров
+@conditional_page(catalog_cache.ALL_SCOPE, product_cache.GENERATION_SCOPE)
 def product_detail(request, slug):
-    product = Product.objects.filter(slug=slug, in_stock=True).select_related('category').first()
-    if not product:
+    product = product_cache.get_product_by_slug(slug)
+    if not product or not product.in_stock:
         from django.http import Http404
         raise Http404('Товар не найден или отсутствует в наличии')
     return render(request, 'product_detail.html', { 'product': product })
 
 @require_POST
-def api_cart_add(request):
+async def api_cart_add(request):
     data = _json_body(request)
     product_id = str(data.get('product_id'))
     delta = int(data.get('delta', 1))  # +1 или -1
-    cart = request.session.get('cart', {})
-    try:
-        p = Product.objects.get(id=product_id, in_stock=True)
-    except Product.DoesNotExist:
+    cart = await aget_cart(request)
+    p = await product_cache.aget_product(product_id)
+    if p is None or not p.in_stock:
         return JsonResponse({'ok': False, 'error': 'Товар недоступен'}, status=404)
-    current = int(cart.get(product_id, 0))
-    new_qty = max(0, min(current + delta, p.stock))
-    if new_qty == 0:
-        cart.pop(product_id, None)
-    else:
-        cart[product_id] = new_qty
-    request.session['cart'] = cart
-    return JsonResponse({'ok': True, 'qty': new_qty})
+    new_qty = max(0, min(cart.get(p.id) + delta, p.stock))
+    cart.set(p.id, new_qty)
+    response = JsonResponse({'ok': True, 'qty': new_qty})
+    await cart.asave(response)
+    return response
+
+# Сколько позиций можно изменить одним запросом api/cart/update
+CART_UPDATE_MAX_ITEMS = 100
+
+@require_POST
+def api_cart_update(request):
+    """Пакетное изменение корзины: {"items": {"<product_id>": qty, ...}}.
+
+    Количества абсолютные (0 — удалить позицию) и ограничиваются остатком.
+    Все товары корзины проверяются одним запросом (или берутся из кэша),
+    в ответе — вся корзина с суммами по строкам.
+    """
+    data = _json_body(request)
+    changes = data.get('items')
+    if not isinstance(changes, dict) or len(changes) > CART_UPDATE_MAX_ITEMS:
+        return JsonResponse({'ok': False, 'error': 'Некорректный список позиций'}, status=400)
+    try:
+        changes = {int(pid): max(0, int(qty)) for pid, qty in changes.items()}
+    except (TypeError, ValueError):
+        return JsonResponse({'ok': False, 'error': 'Некорректный список позиций'}, status=400)
+
+    cart = get_cart(request)
+    requested = {int(pid): int(qty) for pid, qty in cart.items.items() if str(pid).isdigit()}
+    requested.update(changes)
+    products = product_cache.get_products(requested.keys())
+
+    items = []
+    adjusted = []
+    total = Decimal(0)
+    for pid, qty in requested.items():
+        p = products.get(pid)
+        available = p.stock if p is not None and p.in_stock else 0
+        new_qty = min(qty, available)
+        if new_qty != qty:
+            adjusted.append({'product_id': pid, 'requested': qty, 'qty': new_qty})
+        cart.set(pid, new_qty)
+        if new_qty:
+            line = p.price * new_qty
+            total += line
+            items.append({'product_id': pid, 'qty': new_qty, 'price': p.price, 'line': line})
+
+    response = JsonResponse({'ok': True, 'items': items, 'total': total, 'adjusted': adjusted})
+    cart.save(response)
+    return response
 
 @login_required
 @require_POST
 def api_checkout(request):
     data = _json_body(request)
     password = data.get('password') or ''
-    if not request.user.check_password(password):
+    # Повторный ввод пароля: недавняя успешная проверка берётся из кэша
+    try:
+        valid = hashing.check_password(request.user, password, cached=True)
+    except hashing.HashingBusy:
+        return _hashing_busy({'error': 'Сервер перегружен, повторите попытку'})
+    if not valid:
         return JsonResponse({'ok': False, 'error': 'Неверный пароль'}, status=400)
 
-    cart = request.session.get('cart', {})
-    if not cart:
-        return JsonResponse({'ok': False, 'error': 'Корзина пуста'}, status=400)
-
-    products = Product.objects.select_for_update().filter(id__in=cart.keys(), in_stock=True)
-    if products.count() == 0:
-        return JsonResponse({'ok': False, 'error': 'Товары недоступны'}, status=400)
-
-    # Создание заказа с проверкой остатков
+    # Создание заказа с условным списанием остатков (см. main/checkout.py)
+    cart = get_cart(request)
     try:
-        with transaction.atomic():
-            order = Order.objects.create(user=request.user, total_price=0)
-            total = 0
-            id_to_product = { str(p.id): p for p in products }
-            for pid, qty in cart.items():
-                p = id_to_product.get(str(pid))
-                if not p:
-                    continue
-                qty = max(0, min(int(qty), p.stock))
-                if qty == 0:
-                    continue
-                OrderItem.objects.create(order=order, product=p, quantity=qty, price=p.price)
-                p.stock -= qty
-                if p.stock == 0:
-                    p.in_stock = False
-                p.save()
-                total += float(p.price) * qty
-            if total == 0:
-                raise Exception('empty')
-            order.total_price = total
-            order.save()
-            # Очистить корзину
-            request.session['cart'] = {}
-            return JsonResponse({'ok': True, 'order_id': order.id, 'total': total})
+        order, shortfalls = place_order(request.user, cart.items)
+    except CheckoutError as e:
+        return JsonResponse({'ok': False, 'error': e.message, 'shortfalls': e.shortfalls}, status=e.status)
     except Exception:
         return JsonResponse({'ok': False, 'error': 'Не удалось оформить заказ'}, status=500)
 
+    # Очистить корзину
+    response = JsonResponse({
+        'ok': True,
+        'order_id': order.id,
+        'total': order.total_price,
+        'shortfalls': shortfalls,
+    })
+    cart.clear()
+    cart.save(response)
+    return response
+
 @ensure_csrf_cookie
 def login_view(request):
     return render(request, 'login.html')
@@ -167,13 +279,19 @@ def login_view(request):
 def register(request):
     return render(request, 'register.html')
 
+def _hashing_busy(payload):
+    """Очередь хеширования паролей заполнена — клиенту стоит повторить запрос"""
+    response = JsonResponse({'ok': False, **payload}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
 def _json_body(request):
     try:
         return json.loads(request.body.decode('utf-8'))
     except Exception:
         return {}
 
-def api_register(request):
+async def api_register(request):
     """API для регистрации пользователя с полной валидацией"""
     if request.method != 'POST':
         return JsonResponse({'ok': False, 'errors': {'form': 'Метод не поддерживается'}}, status=405)
@@ -205,7 +323,7 @@ def api_register(request):
     if not login_val or not reg_login.match(login_val):
         errors['login'] = 'Логин: латиница, цифры и тире'
     else:
-        if User.objects.filter(username=login_val).exists():
+        if await User.objects.filter(username=login_val).aexists():
             errors['login'] = 'Такой логин уже занят'
     
     # Валидация email
@@ -216,7 +334,7 @@ def api_register(request):
     else:
         try:
             validate_email(email)
-            if User.objects.filter(email=email).exists():
+            if await User.objects.filter(email=email).aexists():
                 errors['email'] = 'Email уже используется'
         except ValidationError:
             errors['email'] = 'Некорректный email'
@@ -232,27 +350,35 @@ def api_register(request):
     if errors:
         return JsonResponse({'ok': False, 'errors': errors}, status=400)
 
-    # Создание пользователя в транзакции
+    # Хеш пароля считается в пуле хеширования, пользователь создаётся в транзакции
     try:
-        with transaction.atomic():
-            user = User.objects.create_user(
-                username=login_val, 
-                email=email, 
-                password=password,
-                first_name=name, 
-                last_name=surname
-            )
-            
-            # Обновление профиля с отчеством
-            if patronymic:
-                user.userprofile.patronymic = patronymic
-                user.userprofile.save()
-            
-            return JsonResponse({'ok': True, 'message': 'Пользователь успешно зарегистрирован'})
+        password_hash = await hashing.amake_password(password)
+        await _create_user(login_val, email, password_hash, name, surname, patronymic)
+    except hashing.HashingBusy:
+        return _hashing_busy({'errors': {'form': 'Сервер перегружен, повторите попытку'}})
     except Exception as e:
         return JsonResponse({'ok': False, 'errors': {'form': 'Ошибка при создании пользователя'}}, status=500)
+    return JsonResponse({'ok': True, 'message': 'Пользователь успешно зарегистрирован'})
+
+@sync_to_async
+def _create_user(username, email, password_hash, first_name, last_name, patronymic):
+    """Пользователь и профиль с отчеством — одной транзакцией (в асинхронном
+    ORM Django 5.0 транзакций нет)"""
+    with transaction.atomic():
+        user = User.objects.create(
+            username=User.normalize_username(username),
+            email=User.objects.normalize_email(email),
+            password=password_hash,
+            first_name=first_name,
+            last_name=last_name,
+        )
+        # Обновление профиля с отчеством
+        if patronymic:
+            user.userprofile.patronymic = patronymic
+            user.userprofile.save()
+    return user
 
-def api_login(request):
+async def api_login(request):
     """API для авторизации пользователя с отслеживанием сессий"""
     if request.method != 'POST':
         return JsonResponse({'ok': False, 'errors': {'form': 'Метод не поддерживается'}}, status=405)
@@ -266,23 +392,29 @@ def api_login(request):
     if not password:
         return JsonResponse({'ok': False, 'errors': {'password': 'Укажите пароль'}}, status=400)
     
-    user = authenticate(username=login_val, password=password)
+    # То же, что authenticate() с ModelBackend, но хеш проверяется в пуле хеширования
+    user = await User.objects.filter(username=login_val).afirst()
+    try:
+        if user is None:
+            # Время ответа не должно выдавать, существует ли логин
+            await hashing.amake_password(password)
+        elif not await hashing.acheck_password(user, password) or not user.is_active:
+            user = None
+    except hashing.HashingBusy:
+        return _hashing_busy({'errors': {'form': 'Сервер перегружен, повторите попытку'}})
     if user is None:
         return JsonResponse({'ok': False, 'errors': {'auth': 'Неверный логин или пароль'}}, status=401)
     
     # Авторизация пользователя
-    login(request, user)
+    await alogin(request, user)
     
-    # Создание записи о сессии
-    try:
-        UserSession.objects.create(
-            user=user,
-            session_key=request.session.session_key,
-            ip_address=_get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-        )
-    except Exception:
-        pass  # Игнорируем ошибки создания сессии
+    # Запись о сессии уходит в буфер и пишется пачкой (main/activity.py)
+    recorder.record_login(
+        user.pk,
+        request.session.session_key,
+        _get_client_ip(request),
+        request.META.get('HTTP_USER_AGENT', ''),
+    )
     
     return JsonResponse({'ok': True, 'message': 'Успешная авторизация'})
 
@@ -341,15 +473,21 @@ def api_order_delete(request, order_id):
     if not order.can_be_deleted:
         return JsonResponse({'ok': False, 'error': 'Можно удалить только новые заказы'}, status=400)
     
-    # Возвращаем товары на склад
+    # Возвращаем товары на склад и удаляем заказ (main/checkout.py)
     try:
-        with transaction.atomic():
-            for item in order.items.all():
-                product = item.product
-                product.stock += item.quantity
-                product.in_stock = True
-                product.save()
-            order.delete()
-            return JsonResponse({'ok': True, 'message': 'Заказ удален'})
+        if not delete_order(order.id):
+            return JsonResponse({'ok': False, 'error': 'Можно удалить только новые заказы'}, status=400)
+        return JsonResponse({'ok': True, 'message': 'Заказ удален'})
     except Exception as e:
-        return JsonResponse({'ok': False, 'error': 'Ошибка при удалении заказа'}, status=500)
\ No newline at end of file
+        return JsonResponse({'ok': False, 'error': 'Ошибка при удалении заказа'}, status=500)
+
+@staff_member_required
+def metrics_view(request):
+    """Метрики запросов по именам URL (только для персонала).
+
+    ?format=prometheus — текстовый формат для Prometheus, иначе JSON.
+    """
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    return JsonResponse({'ok': True, 'views': metrics.snapshot(), 'counters': metrics.counters(),
+                         'gauges': metrics.gauges()})